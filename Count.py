@@ -1,18 +1,17 @@
 import os
 import json
 from tqdm import tqdm
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
+import metrics
+from json_stream import iter_json_array
+from batch_writer import CheckpointedWriter
+from columnar import ParquetPartWriter
+from text_cleaning import clean_text  # Bundled tokenizer and stopwords, no NLTK download
 
-# Ensure stopwords are downloaded
-import nltk
-nltk.download('stopwords')
-nltk.download('punkt')
-
-STOPWORDS = set(stopwords.words('english'))
 MIN_WORD_COUNT = 10  # Set your minimum word count here
 OUTPUT_FILE = 'filtered_news.jsonl'  # Output file for filtered data
 PROCESSED_FILES_LOG = 'processed_files.log'  # Log file to track processed files
+CHECKPOINT_FILE = 'ingest_checkpoint.json'  # Committed sizes of the output and logs plus resume position
+COLUMNAR_OUTPUT = None  # Set to e.g. 'filtered_news.parquet' to write Parquet part files instead of OUTPUT_FILE
 
 def load_processed_files():
     """Load list of processed files from log."""
@@ -21,20 +20,15 @@ def load_processed_files():
             return set(line.strip() for line in f)
     return set()
 
-def append_to_log(file_name):
-    """Append file name to log after processing."""
-    with open(PROCESSED_FILES_LOG, 'a') as f:
-        f.write(f"{file_name}\n")
-
-def clean_text(text):
-    """Remove stopwords from text and return cleaned text."""
-    words = word_tokenize(text.lower())  # Lowercase entire text
-    cleaned_words = [word for word in words if word.isalnum() and word not in STOPWORDS]
-    return " ".join(cleaned_words)
+def append_to_log(writer, file_name):
+    """Buffer file name for the log; it is committed together with the file's records."""
+    writer.log(PROCESSED_FILES_LOG, file_name)
 
 def filter_news_object(obj):
     """Filter a news object based on word count after removing stopwords."""
+    metrics.inc('records_in', stage='ingest')
     if 'body' not in obj:
+        metrics.inc('records_dropped', stage='ingest', reason='no_body')
         return None  # Discard objects without a 'body'
     
     original_body = obj['body'].lower()  # Lowercase the original body text
@@ -42,6 +36,7 @@ def filter_news_object(obj):
     word_count = len(cleaned_body.split())
     
     if word_count < MIN_WORD_COUNT:
+        metrics.inc('records_dropped', stage='ingest', reason='too_short')
         return None  # Discard objects with fewer than MIN_WORD_COUNT words
     
     # Keep original and cleaned body along with other necessary columns
@@ -52,38 +47,57 @@ def filter_news_object(obj):
         # Add other necessary fields if needed
     }
 
-def process_json_file(file_path):
-    """Process a single JSON file, filter objects, and append results to output file."""
+def process_json_file(file_path, writer, skip=0):
+    """Process a single JSON file, filter objects, and append results to output file.
+
+    The first `skip` objects were committed before an interruption and are not reprocessed.
+    """
+    file_name = os.path.basename(file_path)
     records_written = 0
-    with open(file_path, 'r') as f:
-        try:
-            data = json.load(f)  # Load the entire file as a JSON array
-            for obj in data:
-                filtered_obj = filter_news_object(obj)
-                if filtered_obj:
-                    with open(OUTPUT_FILE, 'a') as output_file:
-                        output_file.write(json.dumps(filtered_obj) + '\n')
-                    records_written += 1  # Increment count of records written
-        except json.JSONDecodeError:
-            print(f"Skipping invalid JSON file: {file_path}")
+    objects_read = 0
+    try:
+        for obj in metrics.timed_iter(iter_json_array(file_path)):  # Stream one object at a time
+            objects_read += 1
+            if objects_read <= skip:
+                continue  # Already committed by an earlier run
+            filtered_obj = filter_news_object(obj)
+            if filtered_obj:
+                writer.write(filtered_obj)
+                metrics.inc('records_kept', stage='ingest')
+                records_written += 1  # Increment count of records written
+                writer.maybe_commit(file=file_name, position=objects_read)
+    except json.JSONDecodeError as e:
+        # Everything before the bad byte has already been written
+        print(f"Stopped at invalid JSON in {file_path} after {records_written} records: {e}")
     print(f"Processed {file_path}: {records_written} records written")  # Debugging output
-    return records_written > 0
+    return records_written > 0 or skip > 0  # A mid-file commit means records were written
 
 def main():
     folder_path = 'path_to_your_json_files'  # Update to your JSON folder path
+    # Opening the writer rolls the output and log back to the last committed batch
+    if COLUMNAR_OUTPUT:
+        writer = ParquetPartWriter(COLUMNAR_OUTPUT, CHECKPOINT_FILE, logs=[PROCESSED_FILES_LOG])  # One part per batch
+    else:
+        writer = CheckpointedWriter(OUTPUT_FILE, CHECKPOINT_FILE, logs=[PROCESSED_FILES_LOG])
     processed_files = load_processed_files()
+    resume = writer.state
     
     json_files = sorted([f for f in os.listdir(folder_path) if f.endswith('.json') and f not in processed_files])
     
-    for file_name in tqdm(json_files, desc="Processing JSON files"):
-        file_path = os.path.join(folder_path, file_name)
-        
-        try:
-            if process_json_file(file_path):
-                append_to_log(file_name)  # Log file as processed only if records were written
-        except Exception as e:
-            print(f"Error processing {file_name}: {e}")
-            break  # Stop processing on error to avoid partial file corruption
+    with writer, metrics.stage('ingest'):
+        for file_name in tqdm(json_files, desc="Processing JSON files"):
+            file_path = os.path.join(folder_path, file_name)
+            skip = resume.get('position', 0) if resume.get('file') == file_name else 0
+            
+            try:
+                if process_json_file(file_path, writer, skip):
+                    append_to_log(writer, file_name)  # Committed with the next batch, or the final commit
+            except Exception as e:
+                print(f"Error processing {file_name}: {e}")
+                break  # Stop processing on error; the uncommitted batch is discarded
+        else:
+            writer.commit()  # Every file finished: commit the last batch
+    metrics.export()  # Only when PIPELINE_METRICS=1
 
 if __name__ == "__main__":
     main()
@@ -1,68 +1,55 @@
 import torch
-from transformers import pipeline, DistilBertTokenizer, DistilBertForSequenceClassification
+from transformers import DistilBertTokenizerFast, DistilBertForSequenceClassification
 import pandas as pd
-import gc
 from tqdm import tqdm
+import metrics
+from sentiment_engine import SentimentEngine
+from inference_cache import InferenceCache
+from sentiment_backends import load_backend
+from sentiment_stream import score_stream
+
+BACKEND = 'torch'  # 'torch' (fp32), 'int8' (dynamic quantization, CPU) or 'onnx' (ONNX Runtime, CPU)
+INTRA_OP_THREADS = 0  # Threads per operator for the int8 / ONNX backends; 0 leaves the library default
+STREAMING = False  # Score filtered_news.jsonl incrementally and resumably instead of the DataFrame below
 
 # Load your DataFrame (replace with your actual DataFrame)
 # Assuming the DataFrame has a column 'original_body'
 df = pd.DataFrame({'original_body': ["Your large text data goes here..."] * 100})  # Example data with 100 entries
 
 # Load DistilBERT model and tokenizer with GPU support
-tokenizer = DistilBertTokenizer.from_pretrained("distilbert-base-uncased-finetuned-sst-2-english")
+tokenizer = DistilBertTokenizerFast.from_pretrained("distilbert-base-uncased-finetuned-sst-2-english")
 model = DistilBertForSequenceClassification.from_pretrained("distilbert-base-uncased-finetuned-sst-2-english")
 
 # Try to use GPU if available, otherwise fall back to CPU
-device = 0 if torch.cuda.is_available() else -1
-
-# Initialize the sentiment-analysis pipeline with return_all_scores=True
-sentiment_pipeline = pipeline("sentiment-analysis", model=model, tokenizer=tokenizer, device=device, return_all_scores=True)
-
-# Function to calculate negative probability for large text by chunking
-def get_negative_probability(text, chunk_size=512):
-    tokens = tokenizer(text, return_tensors="pt", truncation=True, padding=True, max_length=chunk_size)
-    input_ids = tokens["input_ids"][0]
-    num_chunks = len(input_ids) // chunk_size + (1 if len(input_ids) % chunk_size > 0 else 0)
-
-    negative_probs = []
-    for i in range(num_chunks):
-        chunk_text = tokenizer.decode(input_ids[i * chunk_size: (i + 1) * chunk_size], skip_special_tokens=True)
-
-        # Attempt to run on GPU, fallback to CPU in case of memory errors
-        try:
-            result = sentiment_pipeline(chunk_text)
-        except RuntimeError as e:
-            if 'out of memory' in str(e):
-                print("Out of memory error encountered. Switching to CPU for this chunk.")
-                # Clear GPU cache
-                torch.cuda.empty_cache()
-                gc.collect()
-                
-                # Switch to CPU for this pipeline instance
-                sentiment_pipeline_cpu = pipeline(
-                    "sentiment-analysis", model=model, tokenizer=tokenizer, device=-1, return_all_scores=True
-                )
-                result = sentiment_pipeline_cpu(chunk_text)
-            else:
-                raise e  # Re-raise if it's a different error
-
-        # Extract the probability for "NEGATIVE"
-        neg_prob = next(item['score'] for item in result[0] if item['label'] == "NEGATIVE")
-        negative_probs.append(neg_prob)
-
-        # Clear GPU cache after processing each chunk
-        torch.cuda.empty_cache()
-        gc.collect()
-
-    # Return the average negative probability across all chunks
-    return sum(negative_probs) / len(negative_probs) if negative_probs else 0
-
-# Process each row with a progress bar and save the negative probability in a new column
-df['neg_probability'] = [
-    get_negative_probability(text) for text in tqdm(df['original_body'], desc="Calculating Negative Probabilities")
-]
-
-# Save the updated DataFrame to a CSV
-df.to_csv("sentiment_output_with_neg_probability.csv", index=False)
-
+device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+# Batched inference engine: overlapping windows of every document are length-bucketed and scored together
+# Windows scored in earlier runs (or repeated in syndicated copies) are read from the cache instead
+# On CPU-only workers the int8 and ONNX backends are usually faster than fp32 (see sentiment_backends.py)
+backend = load_backend(BACKEND, model, device=device, threads=INTRA_OP_THREADS)
+cache = InferenceCache(backend.fingerprint(), path='inference_cache.db')
+engine = SentimentEngine(backend, tokenizer, cache=cache)
+
+# Function to calculate negative probability for a single text
+def get_negative_probability(text):
+    return engine.score_documents([text])[0]
+
+if STREAMING:
+    # Read filtered_news.jsonl in batches, tokenizing ahead of the model, and append scores
+    # to sentiment_scores.jsonl; a restart resumes after the last committed batch
+    with tqdm(desc="Calculating Negative Probabilities") as progress:
+        score_stream(engine, progress=progress)
+else:
+    # Score every row in batches with a progress bar and save the negative probability in a new column
+    with tqdm(total=len(df), desc="Calculating Negative Probabilities") as progress, metrics.stage('sentiment'):
+        df['neg_probability'] = engine.score_documents(df['original_body'].tolist(), progress=progress)
+print(f"Scored {engine.docs_scored} documents at {engine.throughput():.1f} docs/sec")
+print(f"Inference cache: {cache.hits} hits, {cache.misses} misses ({cache.hit_rate():.1%} of windows skipped the model)")
+cache.close()
+
+if not STREAMING:
+    # Save the updated DataFrame to a CSV
+    df.to_csv("sentiment_output_with_neg_probability.csv", index=False)
+
+metrics.export()  # Per-stage counters and latencies, only when PIPELINE_METRICS=1
 print("Negative probability analysis completed and saved.")
@@ -1,61 +1,376 @@
+import os
+import json
+import pickle
+import hashlib
+import multiprocessing
 import shap
+import numpy as np
 import pandas as pd
 from openpyxl import Workbook
+import metrics
+from shap_store import row_hashes
 
-def generate_shap_excel(model, X, excel_filename='shap_results.xlsx'):
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Optional: only needed for Parquet output
+    pa = pq = None
+
+CHUNK_ROWS = 50000  # Rows ranked, formatted and written together
+TOP_N = 3  # Contributions listed in the top / lowest columns
+EXCEL_MAX_ROWS = 1048576  # Rows per worksheet, including the header; more rows continue on a new sheet
+OUTPUT_FORMATS = ('xlsx', 'csv', 'parquet')
+EXPLAIN_CHUNK_ROWS = 5000  # Rows explained per task when computing SHAP into a store
+NUM_WORKERS = os.cpu_count() or 1  # Processes computing SHAP chunks
+
+def class_shap_values(shap_values, class_index=1):
     """
-    Generates an Excel file with features, model predictions, 
-    top 3 and lowest 3 feature contributions per row.
+    Return the rows x features SHAP matrix for one class.
+
+    Handles both the list-per-class output of older shap versions and the
+    rows x features x classes array of newer ones.
+    """
+    if isinstance(shap_values, list):
+        return np.asarray(shap_values[class_index])
+    shap_values = np.asarray(shap_values)
+    return shap_values[..., class_index] if shap_values.ndim == 3 else shap_values
+
+def rank_contributions(values, top_n=TOP_N):
+    """
+    Rank every row's features by absolute SHAP value, for all rows at once.
+
+    The sort is stable, so ties (e.g. features with zero contribution) keep
+    column order, as Python's sorted() did.
 
     Parameters:
-    - model: Trained model object (e.g., RandomForestClassifier)
+    - values: rows x features SHAP matrix
+    - top_n: Number of features to keep at each end
+
+    Returns:
+    - (top, lowest) column index arrays of shape rows x top_n, in descending |SHAP| order
+    """
+    order = np.argsort(-np.abs(values), axis=1, kind='stable')
+    return order[:, :top_n], order[:, -top_n:]
+
+def _format_contributions(columns, values, indices):
+    """Format each row's selected contributions as 'feature=value, ...'."""
+    picked = np.take_along_axis(values, indices, axis=1).tolist()
+    return [
+        ', '.join(f"{columns[i]}={round(val, 2)}" for i, val in zip(row_indices, row_values))
+        for row_indices, row_values in zip(indices.tolist(), picked)
+    ]
+
+def explanation_chunks(model, X, values, chunk_rows=CHUNK_ROWS, top_n=TOP_N):
+    """
+    Yield the output table in row chunks: features, prediction, top and lowest contributions.
+
+    Predictions are made with one model.predict call per chunk.
+
+    Parameters:
+    - model: Trained model object
+    - X: Feature dataset (Pandas DataFrame)
+    - values: rows x features SHAP matrix aligned with X (e.g. from class_shap_values)
+    - chunk_rows: Rows per chunk
+    - top_n: Contributions per list
+    """
+    columns = list(X.columns)
+    for start in range(0, len(X), chunk_rows):
+        with metrics.timer('shap_chunk_seconds', step='format'):
+            X_chunk = X.iloc[start:start + chunk_rows]
+            values_chunk = np.asarray(values[start:start + chunk_rows])
+            top, lowest = rank_contributions(values_chunk, top_n)
+            chunk = X_chunk.copy()
+            chunk['Prediction'] = model.predict(X_chunk)
+            chunk[f'Top {top_n} Features'] = _format_contributions(columns, values_chunk, top)
+            chunk[f'Lowest {top_n} Features'] = _format_contributions(columns, values_chunk, lowest)
+        metrics.inc('records_in', len(chunk), stage='shap')
+        yield chunk
+
+def _write_excel(chunks, filename, sheet_title="SHAP Analysis"):
+    """Stream chunks into a write-only workbook, starting a new sheet when one is full."""
+    wb = Workbook(write_only=True)
+    ws, rows, sheet_number = None, 0, 1
+    for chunk in chunks:
+        for row in chunk.itertuples(index=False, name=None):
+            if ws is None or rows >= EXCEL_MAX_ROWS:
+                ws = wb.create_sheet(sheet_title if sheet_number == 1 else f"{sheet_title} {sheet_number}")
+                ws.append(list(chunk.columns))
+                rows, sheet_number = 1, sheet_number + 1
+            ws.append([value.item() if isinstance(value, np.generic) else value for value in row])
+            rows += 1
+    if ws is None:
+        wb.create_sheet(sheet_title)
+    wb.save(filename)
+
+def _write_csv(chunks, filename):
+    header = True
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        for chunk in chunks:
+            chunk.to_csv(f, index=False, header=header)
+            header = False
+
+def _write_parquet(chunks, filename):
+    if pq is None:
+        raise ImportError("Parquet output needs pyarrow (pip install pyarrow)")
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(filename, table.schema)
+            writer.write_table(table, row_group_size=len(chunk))  # One row group per chunk
+    finally:
+        if writer is not None:
+            writer.close()
+
+def write_explanations(chunks, filename, output_format=None):
+    """
+    Write explanation chunks as Excel (write-only mode), CSV or Parquet.
+
+    Parameters:
+    - chunks: Iterable of DataFrames, e.g. from explanation_chunks
+    - filename: Output file
+    - output_format: 'xlsx', 'csv' or 'parquet'; defaults to the filename's extension
+    """
+    if output_format is None:
+        output_format = os.path.splitext(filename)[1].lstrip('.').lower() or 'xlsx'
+    if output_format == 'xlsx':
+        _write_excel(chunks, filename)
+    elif output_format == 'csv':
+        _write_csv(chunks, filename)
+    elif output_format == 'parquet':
+        _write_parquet(chunks, filename)
+    else:
+        raise ValueError(f"Unknown output format {output_format!r}; expected one of {OUTPUT_FORMATS}")
+    return filename
+
+def model_fingerprint(model):
+    """Hash of a pickled model; stored SHAP values are only reused for the same fingerprint."""
+    return hashlib.blake2b(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL), digest_size=16).hexdigest()
+
+def data_fingerprint(X):
+    """Hash of a DataFrame's index and values, reduced from pandas' per-row hashes to one digest."""
+    row_digests = pd.util.hash_pandas_object(X, index=True).to_numpy()
+    return hashlib.blake2b(row_digests.tobytes(), digest_size=16).hexdigest()
+
+def _progress_file(store_file):
+    return store_file + '.progress.json'
+
+def _save_progress(store_file, progress):
+    tmp_file = _progress_file(store_file) + '.tmp'
+    with metrics.io(), open(tmp_file, 'w') as f:
+        json.dump(progress, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, _progress_file(store_file))
+
+_explain_state = {}  # Explainer and open store of a worker process
+
+def _init_explain_worker(model, store_file, class_index):
+    _explain_state['explainer'] = shap.TreeExplainer(model)
+    _explain_state['store'] = np.load(store_file, mmap_mode='r+')
+    _explain_state['class_index'] = class_index
+
+def _explain_chunk(task):
+    """Explain one row block, write its SHAP values straight into the store, and return its index and metrics."""
+    chunk_index, start, X_chunk = task
+    with metrics.timer('shap_chunk_seconds', step='explain'):
+        values = class_shap_values(_explain_state['explainer'].shap_values(X_chunk), _explain_state['class_index'])
+    metrics.inc('shap_rows_explained', len(X_chunk))
+    store = _explain_state['store']
+    with metrics.io():
+        store[start:start + len(X_chunk)] = values
+        store.flush()
+    return chunk_index, metrics.drain()
+
+def explain_to_store(model, X, store_file='shap_values.npy', chunk_rows=EXPLAIN_CHUNK_ROWS,
+                     workers=NUM_WORKERS, class_index=1, dtype=np.float64, progress=None):
+    """
+    Compute TreeExplainer SHAP values in row chunks across a process pool, into a memory-mapped .npy file.
+
+    Only the rows x features matrix of class_index is kept, and no process holds
+    more than one chunk of it. Finished chunks are recorded in
+    '<store_file>.progress.json' after their values are flushed, so an
+    interrupted run resumes with the chunks that are missing; the store is
+    started over if the model, columns, rows (by content hash) or chunking differ.
+
+    Parameters:
+    - model: Trained tree model
     - X: Feature dataset (Pandas DataFrame)
-    - excel_filename: Output Excel filename (default 'shap_results.xlsx')
+    - store_file: .npy file for the SHAP matrix (default 'shap_values.npy')
+    - chunk_rows: Rows per task (default 5000)
+    - workers: Processes; 1 computes in this process (default: all CPUs)
+    - class_index: Class whose SHAP values are stored (default 1)
+    - dtype: Store dtype; float32 halves the file (default float64)
+    - progress: Optional tqdm progress bar, advanced once per row
 
     Returns:
-    - Path to the generated Excel file
+    - Path to the store
     """
-    # Initialize SHAP explainer and calculate SHAP values
-    explainer = shap.TreeExplainer(model)
-    shap_values = explainer.shap_values(X)
+    expected = {
+        'model': model_fingerprint(model),
+        'columns': [str(column) for column in X.columns],
+        'rows': len(X),
+        'data': data_fingerprint(X),
+        'chunk_rows': chunk_rows,
+        'class_index': class_index,
+        'dtype': np.dtype(dtype).str,
+    }
+    state = None
+    if os.path.exists(store_file) and os.path.exists(_progress_file(store_file)):
+        with open(_progress_file(store_file), 'r') as f:
+            state = json.load(f)
+        if {key: state.get(key) for key in expected} != expected:
+            state = None
+    if state is None:
+        np.lib.format.open_memmap(store_file, mode='w+', dtype=dtype, shape=(len(X), len(X.columns))).flush()
+        state = dict(expected, done=[])
+        _save_progress(store_file, state)
+
+    done = set(state['done'])
+    tasks = (
+        (chunk_index, start, X.iloc[start:start + chunk_rows])
+        for chunk_index, start in enumerate(range(0, len(X), chunk_rows))
+        if chunk_index not in done
+    )
+    if done:
+        print(f"Resuming {store_file}: {len(done)} chunks already explained")
+        if progress is not None:
+            progress.update(min(len(done) * chunk_rows, len(X)))
 
-    # Create an Excel workbook and sheet
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "SHAP Analysis"
+    def record(result):
+        chunk_index, worker_metrics = result
+        metrics.merge(worker_metrics)
+        state['done'].append(chunk_index)
+        _save_progress(store_file, state)
+        if progress is not None:
+            progress.update(min(chunk_rows, len(X) - chunk_index * chunk_rows))
 
-    # Add headers to the Excel sheet
-    headers = list(X.columns) + ['Prediction', 'Top 3 Features', 'Lowest 3 Features']
-    ws.append(headers)
+    if workers > 1:
+        with multiprocessing.Pool(workers, initializer=_init_explain_worker,
+                                  initargs=(model, store_file, class_index)) as pool:
+            for result in pool.imap_unordered(_explain_chunk, tasks):
+                record(result)
+    else:
+        _init_explain_worker(model, store_file, class_index)
+        for task in tasks:
+            record(_explain_chunk(task))
+    _explain_state.clear()
+    return store_file
+
+def generate_shap_excel_from_store(model, X, store_file, excel_filename='shap_results.xlsx', output_format=None,
+                                   chunk_rows=CHUNK_ROWS):
+    """
+    Write the explanation file from a SHAP store made by explain_to_store.
 
-    # Loop through each row in the dataset
-    for idx, row in X.iterrows():
-        # Convert the row to a list of values
-        row_data = row.tolist()
+    The store is memory-mapped and read one chunk of rows at a time.
 
-        # Get SHAP values for the current row
-        shap_row_values = shap_values[1][idx]  # For class 1 predictions
+    Returns:
+    - Path to the generated file
+    """
+    values = np.load(store_file, mmap_mode='r')
+    if values.shape != (len(X), len(X.columns)):
+        raise ValueError(f"{store_file} holds {values.shape} SHAP values, X is {X.shape}")
+    with metrics.stage('shap'):
+        write_explanations(explanation_chunks(model, X, values, chunk_rows), excel_filename, output_format)
+    print(f"Explanation file saved: {excel_filename}")
+    return excel_filename
 
-        # Extract top 3 and lowest 3 feature contributions
-        sorted_contributions = sorted(
-            zip(X.columns, shap_row_values), key=lambda x: abs(x[1]), reverse=True
-        )
-        top_3 = ', '.join([f"{feat}={round(val, 2)}" for feat, val in sorted_contributions[:3]])
-        lowest_3 = ', '.join([f"{feat}={round(val, 2)}" for feat, val in sorted_contributions[-3:]])
+def explain_incremental(model, X, shap_store, segments=None, class_index=None, chunk_rows=EXPLAIN_CHUNK_ROWS):
+    """
+    Explain only the rows of X the SHAP store has not seen, record all rows, and return X's SHAP matrix.
 
-        # Predict the outcome for the row
-        prediction = model.predict([row])[0]
+    Rows are identified by X's index and matched by content, so unchanged rows
+    from earlier runs are read from the store instead of being explained again.
 
-        # Prepare the data for the current row in Excel
-        excel_row = row_data + [prediction, top_3, lowest_3]
+    Parameters:
+    - model: Trained tree model
+    - X: Feature dataset (Pandas DataFrame); its index holds the row IDs
+    - shap_store: ShapStore opened with this model's fingerprint and X's columns
+    - segments: Segment of each row (list or Series aligned with X) for segment importance (default: none)
+    - class_index: Class whose SHAP values are stored; must be the store's (default: the store's)
+    - chunk_rows: Rows explained per shap_values call
+
+    Returns:
+    - rows x features SHAP matrix aligned with X
+    """
+    if class_index is None:
+        class_index = shap_store.class_index
+    elif class_index != shap_store.class_index:
+        raise ValueError(f"The SHAP store holds class {shap_store.class_index} values, not class {class_index}")
+    hashes = row_hashes(X)
+    missing = shap_store.missing(hashes)
+    rows, seen = [], set()
+    for i, row_hash in enumerate(hashes):
+        if row_hash in missing and row_hash not in seen:
+            rows.append(i)
+            seen.add(row_hash)
+    print(f"Explaining {len(rows)} of {len(X)} rows; the rest are in the SHAP store")
+
+    new_values = {}
+    if rows:
+        explainer = shap.TreeExplainer(model)
+        for start in range(0, len(rows), chunk_rows):
+            chunk = rows[start:start + chunk_rows]
+            with metrics.timer('shap_chunk_seconds', step='explain'):
+                values = class_shap_values(explainer.shap_values(X.iloc[chunk]), class_index)
+            metrics.inc('shap_rows_explained', len(chunk))
+            new_values.update(zip((hashes[i] for i in chunk), values))
+    shap_store.add(list(X.index), hashes, new_values, None if segments is None else list(segments))
+    return shap_store.values(hashes)
+
+def generate_shap_excel(model, X, excel_filename='shap_results.xlsx', output_format=None, chunk_rows=CHUNK_ROWS,
+                        store_file=None, workers=NUM_WORKERS, shap_store=None, segments=None):
+    """
+    Generates an Excel file with features, model predictions,
+    top 3 and lowest 3 feature contributions per row.
+
+    Contributions are ranked for all rows at once and rows are written in
+    chunks (Excel in write-only mode), so memory does not grow with the
+    output. For very large X, write CSV or Parquet instead of Excel, and pass
+    store_file to compute SHAP in parallel chunks into a resumable memory-mapped
+    store instead of one in-memory array. With a ShapStore, only rows it has
+    not explained before are computed, and its importance aggregates are updated.
+
+    Parameters:
+    - model: Trained model object (e.g., RandomForestClassifier)
+    - X: Feature dataset (Pandas DataFrame)
+    - excel_filename: Output filename (default 'shap_results.xlsx')
+    - output_format: 'xlsx', 'csv' or 'parquet' (default: from the filename's extension)
+    - chunk_rows: Rows ranked and written together (default 50000)
+    - store_file: .npy SHAP store for chunked, parallel, resumable computation (default: in memory)
+    - workers: Processes computing SHAP chunks when store_file is given (default: all CPUs)
+    - shap_store: Persistent ShapStore for incremental explanation (default: none)
+    - segments: Segment of each row, recorded in shap_store (default: none)
+
+    Returns:
+    - Path to the generated file
+    """
+    with metrics.stage('shap'):
+        if store_file is not None:
+            explain_to_store(model, X, store_file, workers=workers)
+            return generate_shap_excel_from_store(model, X, store_file, excel_filename, output_format, chunk_rows)
 
-        # Append the row data to the Excel sheet
-        ws.append(excel_row)
+        if shap_store is not None:
+            values = explain_incremental(model, X, shap_store, segments)
+        else:
+            # Initialize SHAP explainer and calculate SHAP values
+            explainer = shap.TreeExplainer(model)
+            with metrics.timer('shap_chunk_seconds', step='explain'):  # All of X is one chunk here
+                values = class_shap_values(explainer.shap_values(X))  # For class 1 predictions
+            metrics.inc('shap_rows_explained', len(X))
 
-    # Save the Excel file
-    wb.save(excel_filename)
-    print(f"Excel file saved: {excel_filename}")
+        write_explanations(explanation_chunks(model, X, values, chunk_rows), excel_filename, output_format)
+    print(f"Explanation file saved: {excel_filename}")
+    return excel_filename
 
 # Example usage:
 # Assuming 'rf_model' is your trained Random Forest model and 'X_test' is your feature dataset
 # generate_shap_excel(rf_model, X_test)
+# generate_shap_excel(rf_model, X_test, 'shap_results.parquet')  # Millions of rows
+# generate_shap_excel(rf_model, X_test, 'shap_results.parquet', store_file='shap_values.npy')  # Wide and large X
+#
+# Daily re-explanation: only new or changed rows are explained; importance queries read the store's aggregates
+# store = ShapStore(model_fingerprint(rf_model), X_test.columns)  # from shap_store import ShapStore
+# generate_shap_excel(rf_model, X_test, shap_store=store, segments=X_test['region'])
+# store.global_importance(), store.segment_importance(), store.top_contributors(X_test.index[0])
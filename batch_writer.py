@@ -0,0 +1,123 @@
+import os
+import json
+import metrics
+
+BATCH_SIZE = 10000  # Records buffered in memory between commits
+
+class CheckpointedWriter:
+    """
+    Buffered, batch-committed appends to an output file plus any number of log files.
+
+    Records and log lines are held in memory and written with one append per file
+    at each commit. A commit flushes and fsyncs every file and then atomically
+    replaces a small JSON checkpoint holding the committed size of each file and
+    any caller state (e.g. the input position). On startup, anything past the
+    committed sizes is a torn batch from a crash and is truncated away, so a
+    resumed run continues from exactly the last committed batch.
+
+    Args:
+        output_file (str): JSONL file that records are appended to.
+        checkpoint_file (str): Path of the JSON checkpoint.
+        logs (list): Extra logs (e.g. processed file or ID logs) committed together with the output.
+        batch_size (int): Pending records that trigger a commit in maybe_commit (default: 10000).
+        on_commit (list): Callables run after each commit, e.g. to sync an index built from a log.
+        before_commit (list): Callables run once the batch is fsynced but before the checkpoint
+            is replaced, e.g. to commit a side store that must never lag behind the checkpoint.
+    """
+
+    def __init__(self, output_file, checkpoint_file, logs=(), batch_size=BATCH_SIZE, on_commit=(), before_commit=()):
+        self.output_file = output_file
+        self.checkpoint_file = checkpoint_file
+        self.batch_size = batch_size
+        self.paths = [output_file] + list(logs)
+        self.on_commit = list(on_commit)
+        self.before_commit = list(before_commit)
+        self.pending = 0  # Records buffered since the last commit
+        self._buffers = {path: [] for path in self.paths}
+
+        checkpoint = self._load_checkpoint() or {'sizes': {}}
+        self.state = checkpoint.get('state', {})
+        self._sizes = dict(checkpoint['sizes'])  # Keeps sizes of files other writers share this checkpoint for
+        for path in self.paths:
+            on_disk = os.path.getsize(path) if os.path.exists(path) else 0
+            committed = checkpoint['sizes'].get(path)
+            if committed is None:
+                committed = on_disk  # Not tracked yet: adopt what is already there
+            elif on_disk > committed:
+                os.truncate(path, committed)  # Drop a batch that was never committed
+            self._sizes[path] = min(committed, on_disk)
+        self._files = {path: open(path, 'ab') for path in self.paths}
+
+    def _load_checkpoint(self):
+        """Load the last committed checkpoint, or None if there is none yet."""
+        if os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file, 'r') as f:
+                return json.load(f)
+        return None
+
+    def write(self, record):
+        """Buffer one record for the output file."""
+        self._buffers[self.output_file].append((json.dumps(record) + '\n').encode('utf-8'))
+        self.pending += 1
+
+    def write_raw(self, text):
+        """Buffer pre-serialized text for the output file."""
+        self._buffers[self.output_file].append(text.encode('utf-8'))
+        self.pending += 1
+
+    def log(self, path, line):
+        """Buffer one line for a log file committed with the output."""
+        self._buffers[path].append(f"{line}\n".encode('utf-8'))
+
+    def log_bytes(self, path, data):
+        """Buffer raw bytes for a binary log committed with the output."""
+        self._buffers[path].append(data)
+
+    def maybe_commit(self, **state):
+        """Commit if at least batch_size records are pending."""
+        if self.pending >= self.batch_size:
+            self.commit(**state)
+
+    def commit(self, **state):
+        """Write all buffered data, fsync it, then atomically record the new checkpoint."""
+        with metrics.io():
+            for path in self.paths:
+                buffer = self._buffers[path]
+                f = self._files[path]
+                if buffer:
+                    f.write(b''.join(buffer))  # One large append per file
+                    buffer.clear()
+                f.flush()
+                os.fsync(f.fileno())
+                self._sizes[path] = os.fstat(f.fileno()).st_size
+            for callback in self.before_commit:
+                callback()
+
+            self.state = state
+            tmp_file = self.checkpoint_file + '.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump({'sizes': self._sizes, 'state': state}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.checkpoint_file)  # The commit point
+        self.pending = 0
+        for callback in self.on_commit:
+            callback()
+
+    def close(self):
+        """Close the files, discarding anything not yet committed."""
+        for f in self._files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def committed_size(checkpoint_file, path):
+    """Return the size of `path` committed in a CheckpointedWriter checkpoint, or None if unknown."""
+    if not os.path.exists(checkpoint_file):
+        return None
+    with open(checkpoint_file, 'r') as f:
+        return json.load(f)['sizes'].get(path)
@@ -0,0 +1,391 @@
+import os
+import sys
+import json
+import time
+import random
+import string
+import shutil
+import argparse
+import contextlib
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import metrics
+
+REPORT_FILE = 'benchmark_report.json'  # Latest run
+BASELINE_FILE = 'benchmark_baseline.json'  # Run that later runs are compared against
+REGRESSION_TOLERANCE = 0.2  # Throughput drop (or p99 latency rise) beyond which a stage counts as regressed
+SEED = 0  # Every generator is seeded, so runs see identical data
+UNITS = 20  # Timed units per batch stage; per-record latency percentiles are taken over these
+
+SIZES = {
+    'small': {  # Seconds; for a quick check before committing
+        'news_files': 4, 'news_per_file': 250, 'duplicate_rate': 0.1, 'body_words': 150,
+        'customers': 200, 'jsonl_lines': 2000,
+        'fuzzy_rows': 300, 'fuzzy_brute_rows': 60, 'vita_rows': 2000, 'mandates': 500,
+        'shap_rows': 2000, 'shap_features': 20, 'sentiment_docs': 200, 'texts': 1000,
+    },
+    'full': {  # Minutes; closer to production volumes
+        'news_files': 20, 'news_per_file': 2000, 'duplicate_rate': 0.1, 'body_words': 300,
+        'customers': 5000, 'jsonl_lines': 50000,
+        'fuzzy_rows': 5000, 'fuzzy_brute_rows': 200, 'vita_rows': 50000, 'mandates': 5000,
+        'shap_rows': 50000, 'shap_features': 50, 'sentiment_docs': 2000, 'texts': 20000,
+    },
+}
+
+_WORDS = ("market shares company bank profit loss revenue growth quarter year investors customers board "
+          "deal merger debt rating upgrade downgrade fraud lawsuit fine investigation record rose fell "
+          "strong weak reported said expects outlook guidance analysts trading volume dividend capital").split()
+
+# Synthetic data generators
+
+def synthetic_texts(n, words=40, seed=SEED):
+    """Short news-like sentences."""
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(n):
+        tokens = rng.choices(_WORDS, k=words)
+        sentences = [' '.join(tokens[i:i + 12]).capitalize() + '.' for i in range(0, len(tokens), 12)]
+        texts.append(' '.join(sentences))
+    return texts
+
+def synthetic_company_name(rng):
+    stem = ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9))).capitalize()
+    return f"{stem} {rng.choice(['Corp', 'Holdings', 'Group', 'Bank', 'Capital', 'Partners'])}"
+
+def synthetic_customers(n, seed=SEED):
+    """Customer table with 'customer_id' and 'customer_name'."""
+    rng = random.Random(seed)
+    return pd.DataFrame({
+        'customer_id': list(range(1, n + 1)),
+        'customer_name': [synthetic_company_name(rng) for _ in range(n)],
+    })
+
+def synthetic_news(n, duplicate_rate=0.1, body_words=300, seed=SEED, id_offset=0):
+    """
+    Raw news objects ('newsReferenceId', 'body'); duplicate_rate of them repeat an earlier article.
+    """
+    rng = random.Random(seed)
+    articles = []
+    for i in range(n):
+        if articles and rng.random() < duplicate_rate:
+            articles.append(dict(rng.choice(articles)))
+            continue
+        articles.append({
+            'newsReferenceId': f"news-{id_offset + i}",
+            'body': synthetic_texts(1, body_words, seed=rng.random())[0],
+        })
+    return articles
+
+def write_news_files(folder, files, per_file, duplicate_rate=0.1, body_words=300, seed=SEED):
+    """Write JSON array files of raw news, as the ingest scripts read them."""
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for number in range(files):
+        path = os.path.join(folder, f"news_{number:04d}.json")
+        with open(path, 'w') as f:
+            json.dump(synthetic_news(per_file, duplicate_rate, body_words, seed + number, number * per_file), f)
+        paths.append(path)
+    return paths
+
+def synthetic_filtered_news(path, lines, customers, mention_rate=0.3, seed=SEED):
+    """Write an ingest-style JSONL file whose cleaned bodies mention customers at mention_rate."""
+    rng = random.Random(seed)
+    names = customers['customer_name'].str.lower().tolist()
+    with open(path, 'w') as f:
+        for i, body in enumerate(synthetic_texts(lines, 60, seed)):
+            body = body.lower()
+            if rng.random() < mention_rate:
+                body = f"{body} {rng.choice(names)} {body}"
+            f.write(json.dumps({'id': f"news-{i}", 'original_body': body, 'cleaned_body': body}) + '\n')
+
+def _typo(rng, text):
+    position = rng.randrange(len(text))
+    return text[:position] + rng.choice(string.ascii_lowercase) + text[position + 1:]
+
+def synthetic_fuzzy_datasets(rows, seed=SEED):
+    """Two name tables where most df1 names are typo'd variants of df2 names."""
+    rng = random.Random(seed)
+    names = [synthetic_company_name(rng) for _ in range(rows)]
+    df2 = pd.DataFrame({'id2': range(rows), 'name2': names})
+    df1 = pd.DataFrame({
+        'id1': range(rows),
+        'name1': [_typo(rng, name) if rng.random() < 0.8 else synthetic_company_name(rng) for name in names],
+    })
+    return df1, df2
+
+def synthetic_mandates(vita_rows, mandates, seed=SEED):
+    """VITA raw mandate names and a mandate table, as map_vita_to_mandates takes them."""
+    rng = random.Random(seed)
+    names = [f"{rng.choice(_WORDS)} {rng.choice(_WORDS)} {rng.choice(_WORDS)} policy" for _ in range(mandates)]
+    df_mandates = pd.DataFrame({'src_sys_vldtn_id': [f"M{i:05d}" for i in range(mandates)], 'vldtn_item_nm': names})
+    df_vita = pd.DataFrame({'raw_mandate_name': [_typo(rng, rng.choice(names)) for _ in range(vita_rows)]})
+    return df_vita, df_mandates
+
+def synthetic_tree_model(rows, features, seed=SEED):
+    """A random forest trained on a synthetic binary target, and its feature matrix."""
+    from sklearn.ensemble import RandomForestClassifier
+
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.normal(size=(rows, features)), columns=[f"feature_{i}" for i in range(features)])
+    y = (X.iloc[:, 0] + X.iloc[:, 1] * X.iloc[:, 2] + rng.normal(scale=0.5, size=rows) > 0).astype(int)
+    model = RandomForestClassifier(n_estimators=50, max_depth=8, random_state=seed, n_jobs=1).fit(X, y)
+    return model, X
+
+# Measurement
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far, in MB, or None if it cannot be measured."""
+    peak = metrics.rss_bytes()[1]
+    return peak / 2 ** 20 if peak is not None else None
+
+def time_units(units, function):
+    """
+    Run function on every unit and time each call.
+
+    Args:
+        units (list): (argument, records in the unit) pairs.
+        function (callable): Called with each argument.
+
+    Returns:
+        dict: records, seconds, records_per_sec and p50/p99 per-record latency in ms.
+    """
+    per_record, records, seconds = [], 0, 0.0
+    for argument, unit_records in units:
+        start = time.perf_counter()
+        function(argument)
+        elapsed = time.perf_counter() - start
+        seconds += elapsed
+        records += unit_records
+        if unit_records:
+            per_record.append(elapsed / unit_records)
+    latencies = np.array(per_record) * 1000
+    return {
+        'records': records,
+        'seconds': seconds,
+        'records_per_sec': records / seconds if seconds else 0.0,
+        'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+        'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+    }
+
+def _split(items, parts=UNITS):
+    """Split a DataFrame or list into up to `parts` blocks, as (block, records) units."""
+    size = max(1, -(-len(items) // parts))
+    blocks = (items.iloc[start:start + size] if isinstance(items, pd.DataFrame) else items[start:start + size]
+              for start in range(0, len(items), size))
+    return [(block, len(block)) for block in blocks]
+
+# Stages: each builds its data in `workdir` and returns time_units() results
+
+def bench_clean_text(size, workdir):
+    from text_cleaning import clean_text
+
+    texts = synthetic_texts(size['texts'], size['body_words'])
+    return time_units([(text, 1) for text in texts], clean_text)
+
+def bench_process_json_file(size, workdir):
+    import handle_duplicates
+    from batch_writer import CheckpointedWriter
+    from dedup_index import DedupIndex
+
+    paths = write_news_files(os.path.join(workdir, 'news'), size['news_files'], size['news_per_file'],
+                             size['duplicate_rate'], size['body_words'])
+    processed_ids = DedupIndex(os.path.join(workdir, 'processed_ids.idx'))
+    writer = CheckpointedWriter(os.path.join(workdir, 'filtered_news.jsonl'), os.path.join(workdir, 'checkpoint.json'),
+                                logs=[processed_ids.keys_file], on_commit=[processed_ids.sync])
+    handle_duplicates.NEAR_DUPLICATE_INDEX = os.path.join(workdir, 'near_duplicates.db')
+    near_duplicates = handle_duplicates.load_near_duplicates()
+    if near_duplicates is not None:
+        writer.before_commit.append(near_duplicates.commit)
+
+    def process(path):
+        handle_duplicates.process_json_file(path, processed_ids, writer, near_duplicates)
+        writer.commit()
+
+    with writer, near_duplicates or contextlib.nullcontext():
+        return time_units([(path, size['news_per_file']) for path in paths], process)
+
+def bench_process_jsonl_file(size, workdir):
+    import search_names
+
+    search_names.df_customers = synthetic_customers(size['customers'])
+    search_names.MATCHER_CACHE = os.path.join(workdir, 'customer_matcher.pkl')
+    search_names.build_matcher()  # Compile outside the timing, as a cached matcher would be on a rerun
+    lines_per_unit = max(1, size['jsonl_lines'] // UNITS)
+    units = []
+    for number in range(UNITS):
+        path = os.path.join(workdir, f"filtered_{number:03d}.jsonl")
+        synthetic_filtered_news(path, lines_per_unit, search_names.df_customers, seed=SEED + number)
+        units.append((number, lines_per_unit))
+
+    def process(number):
+        search_names.INPUT_JSONL_FILE = os.path.join(workdir, f"filtered_{number:03d}.jsonl")
+        search_names.OUTPUT_FILE = os.path.join(workdir, f"identified_{number:03d}.jsonl")
+        search_names.PROCESSED_LINES_LOG = os.path.join(workdir, f"processed_{number:03d}.log")
+        search_names.process_jsonl_file()
+
+    return time_units(units, process)
+
+def bench_fuzzy_join_datasets(size, workdir):
+    from fuzzy import fuzzy_join_datasets
+
+    df1, df2 = synthetic_fuzzy_datasets(size['fuzzy_brute_rows'])
+    return time_units(_split(df1), lambda block: fuzzy_join_datasets(block, df2, 'name1', 'name2', 'id1', 'id2'))
+
+def bench_fuzzy_join_blocked(size, workdir):
+    from fuzzy import fuzzy_join_blocked
+
+    df1, df2 = synthetic_fuzzy_datasets(size['fuzzy_rows'])
+    return time_units(_split(df1), lambda block: fuzzy_join_blocked(block, df2, 'name1', 'name2', 'id1', 'id2'))
+
+def bench_map_vita_to_mandates(size, workdir):
+    from val import map_vita_to_mandates
+
+    df_vita, df_mandates = synthetic_mandates(size['vita_rows'], size['mandates'])
+    return time_units(_split(df_vita), lambda block: map_vita_to_mandates(
+        block, df_mandates, 'raw_mandate_name', 'src_sys_vldtn_id', 'vldtn_item_nm'))
+
+def bench_generate_shap_excel(size, workdir):
+    from Shap_Explain import generate_shap_excel
+
+    model, X = synthetic_tree_model(size['shap_rows'], size['shap_features'])
+    output = os.path.join(workdir, 'shap_results.xlsx')
+    return time_units(_split(X), lambda block: generate_shap_excel(model, block, output))
+
+def bench_sentiment_cpu(size, workdir):
+    from sentiment_backends import build_tiny_model, TorchBackend
+    from sentiment_engine import SentimentEngine
+
+    model, tokenizer = build_tiny_model(os.path.join(workdir, 'tiny_distilbert'))
+    engine = SentimentEngine(TorchBackend(model, 'cpu'), tokenizer)
+    texts = synthetic_texts(size['sentiment_docs'], size['body_words'])
+    return time_units(_split(texts), engine.score_documents)
+
+STAGES = {
+    'clean_text': bench_clean_text,
+    'process_json_file': bench_process_json_file,
+    'process_jsonl_file': bench_process_jsonl_file,
+    'fuzzy_join_datasets': bench_fuzzy_join_datasets,
+    'fuzzy_join_blocked': bench_fuzzy_join_blocked,
+    'map_vita_to_mandates': bench_map_vita_to_mandates,
+    'generate_shap_excel': bench_generate_shap_excel,
+    'sentiment_cpu': bench_sentiment_cpu,
+}
+
+def run_stage(name, size):
+    """Run one stage in a scratch directory; missing optional dependencies skip it."""
+    workdir = tempfile.mkdtemp(prefix=f"benchmark_{name}_")
+    cwd = os.getcwd()
+    os.chdir(workdir)  # Stages that write relative files (caches, indexes) write them here
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):  # The scripts' per-file prints
+            result = STAGES[name](size, workdir)
+        result['peak_rss_mb'] = peak_rss_mb()
+        return result
+    except ImportError as e:
+        return {'skipped': f"missing dependency: {e}"}
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def run_benchmarks(stages=None, size='small', isolate=True):
+    """
+    Run benchmark stages on synthetic data.
+
+    Args:
+        stages (list): Stage names (default: all of STAGES).
+        size (str): Key of SIZES (default: 'small').
+        isolate (bool): Run each stage in a fresh process so its peak RSS is its own (default: True).
+
+    Returns:
+        dict: Report with environment info and one result per stage.
+    """
+    stages = list(STAGES) if stages is None else stages
+    results = {}
+    for name in stages:
+        started = time.perf_counter()
+        if isolate:
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                results[name] = pool.submit(run_stage, name, SIZES[size]).result()
+        else:
+            results[name] = run_stage(name, SIZES[size])
+        result = results[name]
+        if 'skipped' in result:
+            print(f"{name}: skipped ({result['skipped']})")
+        else:
+            peak_rss = f"{result['peak_rss_mb']:.0f} MB" if result['peak_rss_mb'] is not None else "unknown"
+            print(f"{name}: {result['records_per_sec']:.1f} records/s, p50 {result['p50_ms']:.3f} ms, "
+                  f"p99 {result['p99_ms']:.3f} ms, peak RSS {peak_rss} "
+                  f"({time.perf_counter() - started:.1f}s)")
+    return {
+        'size': size,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'cpus': os.cpu_count(),
+        'stages': results,
+    }
+
+def compare_to_baseline(report, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Compare a report with a baseline report of the same size.
+
+    A stage regresses when its throughput falls, or its p99 latency rises, by
+    more than `tolerance` relative to the baseline.
+
+    Returns:
+        dict: Stage name -> throughput and p99 ratios (current / baseline) and 'regressed'.
+    """
+    if baseline.get('size') != report.get('size'):
+        raise ValueError(f"Baseline was run at size {baseline.get('size')!r}, this run at {report.get('size')!r}")
+    comparison = {}
+    for name, result in report['stages'].items():
+        before = baseline['stages'].get(name)
+        if before is None or 'skipped' in before or 'skipped' in result:
+            continue
+        throughput = result['records_per_sec'] / before['records_per_sec'] if before['records_per_sec'] else None
+        p99 = result['p99_ms'] / before['p99_ms'] if before['p99_ms'] else None
+        comparison[name] = {
+            'throughput_ratio': throughput,
+            'p99_ratio': p99,
+            'regressed': (throughput is not None and throughput < 1 - tolerance)
+                         or (p99 is not None and p99 > 1 + tolerance),
+        }
+    return comparison
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic data.")
+    parser.add_argument('--size', choices=sorted(SIZES), default='small')
+    parser.add_argument('--stages', help="Comma-separated stage names (default: all)")
+    parser.add_argument('--report', default=REPORT_FILE)
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help="Store this run as the new baseline")
+    parser.add_argument('--no-isolate', action='store_true', help="Run stages in this process")
+    args = parser.parse_args(argv)
+
+    stages = args.stages.split(',') if args.stages else None
+    report = run_benchmarks(stages, args.size, isolate=not args.no_isolate)
+
+    regressed = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r') as f:
+            report['comparison'] = compare_to_baseline(report, json.load(f))
+        for name, comparison in report['comparison'].items():
+            ratios = ', '.join(f"{key.replace('_ratio', '')} {value:.2f}x"
+                               for key, value in comparison.items() if key.endswith('_ratio') and value is not None)
+            print(f"{name}: {ratios} of baseline{'  REGRESSED' if comparison['regressed'] else ''}")
+            if comparison['regressed']:
+                regressed.append(name)
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    if args.save_baseline:
+        shutil.copyfile(args.report, args.baseline)
+        print(f"Saved baseline to {args.baseline}")
+    return 1 if regressed else 0
+
+if __name__ == "__main__":
+    # python benchmark.py --size small --save-baseline   (once)
+    # python benchmark.py --size small                   (later; exits 1 on a regression)
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import pandas as pd
+import metrics
+from batch_writer import CheckpointedWriter
+
+CHUNK_SIZE = 10000  # Rows per call of the batched function, per output write and per checkpoint
+NUM_WORKERS = os.cpu_count() or 1  # Threads or processes running chunks
+AHEAD_PER_WORKER = 2  # Chunks submitted ahead per worker, bounding memory on huge frames
+OUTPUT_COLUMN = 'prediction'  # Column added for results that are not a DataFrame
+
+class RowFunction:
+    """
+    Turn a one-value-at-a-time function into a batched one over a column.
+
+    Picklable when `function` is a module-level function, so it also runs in a process pool.
+    """
+
+    def __init__(self, function, column):
+        self.function = function
+        self.column = column
+
+    def __call__(self, chunk):
+        return [self.function(value) for value in chunk[self.column]]
+
+def _run_chunk(function, chunk, output_column, header=False):
+    """Apply the batched function and return the chunk with its results as CSV text."""
+    result = function(chunk)
+    if isinstance(result, pd.DataFrame):
+        results = {column: result[column].to_numpy() for column in result.columns}
+    else:
+        results = {output_column: result.to_numpy() if isinstance(result, pd.Series) else list(result)}
+    for column, values in results.items():
+        if len(values) != len(chunk):
+            raise ValueError(f"Function returned {len(values)} {column} values for a chunk of {len(chunk)} rows")
+    return chunk.assign(**results).to_csv(index=False, header=header)
+
+def run_chunked(df, function, output_file, checkpoint_file=None, chunk_size=CHUNK_SIZE, workers=NUM_WORKERS,
+                executor='thread', output_column=OUTPUT_COLUMN, start_row=0, progress=None):
+    """
+    Apply a batched function to a DataFrame chunk by chunk, appending results to a CSV, resumably.
+
+    `function` receives a chunk (a DataFrame slice) and returns one result per
+    row (list, array or Series, stored in output_column) or a DataFrame of
+    result columns. Chunks run in a thread or process pool with a bounded
+    number in flight, but are written in order: each finished chunk is one CSV
+    append followed by one checkpoint commit recording the rows done, so a
+    restart skips every completed chunk and never duplicates output.
+
+    Args:
+        df (pd.DataFrame): Input rows.
+        function (callable): Batched function, e.g. model.predict wrapper or RowFunction(f, column).
+            Must be picklable for executor='process'.
+        output_file (str): CSV the input columns plus results are appended to.
+        checkpoint_file (str): Checkpoint path (default: output_file + '.checkpoint.json').
+        chunk_size (int): Rows per chunk (default: 10000).
+        workers (int): Threads or processes; 1 runs chunks inline (default: all CPUs).
+        executor (str): 'thread' (I/O-bound or GIL-releasing functions) or 'process' (default: 'thread').
+        output_column (str): Column for non-DataFrame results (default: 'prediction').
+        start_row (int): Rows already done when there is no checkpoint yet, e.g. from a legacy log.
+        progress (tqdm): Optional progress bar, advanced once per row.
+
+    Returns:
+        int: Rows processed in this run.
+    """
+    if checkpoint_file is None:
+        checkpoint_file = output_file + '.checkpoint.json'
+    with CheckpointedWriter(output_file, checkpoint_file) as writer:
+        rows_done = writer.state.get('rows_done', start_row)
+        if progress is not None:
+            progress.update(rows_done)
+        header = os.path.getsize(output_file) == 0  # Written with the first chunk of a new output
+        starts = range(rows_done, len(df), chunk_size)
+
+        def finish(text, chunk_rows):
+            nonlocal rows_done
+            writer.write_raw(text)
+            rows_done += chunk_rows
+            writer.commit(rows_done=rows_done)
+            metrics.inc('records_in', chunk_rows, stage=metrics.current_stage())
+            if progress is not None:
+                progress.update(chunk_rows)
+
+        started, first_row = time.perf_counter(), rows_done
+        if workers > 1:
+            pool_class = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+            with pool_class(workers) as pool:
+                in_flight = deque()  # Futures in chunk order; results are written in this order
+                for start in starts:
+                    chunk = df.iloc[start:start + chunk_size]
+                    in_flight.append((pool.submit(_run_chunk, function, chunk, output_column, header), len(chunk)))
+                    header = False
+                    if len(in_flight) >= workers * AHEAD_PER_WORKER:
+                        future, chunk_rows = in_flight.popleft()
+                        finish(future.result(), chunk_rows)
+                while in_flight:
+                    future, chunk_rows = in_flight.popleft()
+                    finish(future.result(), chunk_rows)
+        else:
+            for start in starts:
+                chunk = df.iloc[start:start + chunk_size]
+                finish(_run_chunk(function, chunk, output_column, header), len(chunk))
+                header = False
+
+    processed = rows_done - first_row
+    elapsed = time.perf_counter() - started
+    print(f"Processed {processed} rows in {elapsed:.1f}s ({processed / elapsed if elapsed else 0:.0f} rows/sec)")
+    return processed
@@ -0,0 +1,150 @@
+import os
+import metrics
+from batch_writer import CheckpointedWriter, committed_size
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Optional: only needed for the columnar (Parquet) output and input paths
+    pa = pq = None
+
+MANIFEST_FILE = '_parts.txt'  # Committed part file names, one per line, inside the dataset directory
+COMPRESSION = 'zstd'  # Parquet compression codec
+ROW_GROUP_SIZE = 64 * 1024  # Rows per Parquet row group
+READ_BATCH = 8192  # Rows per Arrow record batch when reading
+
+def _require_pyarrow():
+    if pq is None:
+        raise ImportError("Columnar output needs pyarrow (pip install pyarrow)")
+
+def is_dataset(path):
+    """True if path is a Parquet part dataset written by ParquetPartWriter."""
+    return os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+class ParquetPartWriter(CheckpointedWriter):
+    """
+    CheckpointedWriter whose records go to Parquet part files instead of a JSONL file.
+
+    Records are buffered as with CheckpointedWriter, and each commit writes them
+    as one compressed Parquet part file (itself split into row groups) in the
+    dataset directory. Part names are appended to a manifest inside the
+    directory, which is the writer's checkpointed output file: a part only
+    becomes visible when the checkpoint naming its manifest line is committed,
+    and parts left behind by a crash are deleted on open. Logs, state and
+    callbacks work as in CheckpointedWriter.
+
+    Args:
+        dataset_dir (str): Directory holding the part files and manifest.
+        checkpoint_file (str): Path of the JSON checkpoint.
+        logs (list): Extra logs committed together with the parts.
+        batch_size (int): Pending records that trigger a commit in maybe_commit (default: one row group).
+        on_commit (list): Callables run after each commit.
+        before_commit (list): Callables run just before the checkpoint is replaced.
+        schema (pyarrow.Schema): Fixed schema; by default each part's is inferred from its records.
+        compression (str): Parquet codec (default: 'zstd').
+    """
+
+    def __init__(self, dataset_dir, checkpoint_file, logs=(), schema=None, compression=COMPRESSION, **kwargs):
+        _require_pyarrow()
+        os.makedirs(dataset_dir, exist_ok=True)
+        self.dataset_dir = dataset_dir
+        self.schema = schema
+        self.compression = compression
+        self._records = []
+        kwargs.setdefault('batch_size', ROW_GROUP_SIZE)  # Parts written by maybe_commit fill a whole row group
+        super().__init__(os.path.join(dataset_dir, MANIFEST_FILE), checkpoint_file, logs=logs, **kwargs)
+
+        parts = _read_manifest(self.output_file)
+        self._next_part = len(parts)
+        for name in os.listdir(dataset_dir):  # Parts of a commit that never happened
+            if name.endswith(('.parquet', '.parquet.tmp')) and name not in parts:
+                os.remove(os.path.join(dataset_dir, name))
+
+    def write(self, record):
+        """Buffer one record (a dict of column values)."""
+        self._records.append(record)
+        self.pending += 1
+
+    def write_raw(self, text):
+        raise TypeError("ParquetPartWriter stores records, not pre-serialized text")
+
+    def commit(self, **state):
+        """Write the buffered records as one part file, then commit the manifest, logs and checkpoint."""
+        if self._records:
+            name = f"part-{self._next_part:06d}.parquet"
+            columns = dict.fromkeys(key for record in self._records for key in record)  # Optional fields included
+            table = pa.table({column: [record.get(column) for record in self._records] for column in columns})
+            if self.schema is not None:
+                table = table.select(self.schema.names).cast(self.schema)
+            path = os.path.join(self.dataset_dir, name)
+            tmp_file = path + '.tmp'
+            with metrics.io():
+                pq.write_table(table, tmp_file, compression=self.compression, row_group_size=ROW_GROUP_SIZE)
+                with open(tmp_file, 'rb') as f:
+                    os.fsync(f.fileno())
+                os.replace(tmp_file, path)
+            self._buffers[self.output_file].append(f"{name}\n".encode('utf-8'))
+            self._records = []
+            self._next_part += 1
+        super().commit(**state)
+
+def _read_manifest(manifest_file, end=None):
+    if not os.path.exists(manifest_file):
+        return []
+    with open(manifest_file, 'rb') as f:
+        data = f.read() if end is None else f.read(end)
+    return [line.decode('utf-8') for line in data.split(b'\n') if line]
+
+def dataset_parts(dataset_dir, checkpoint_file=None):
+    """
+    Return the paths of a dataset's committed part files, in write order.
+
+    Args:
+        dataset_dir (str): Dataset directory.
+        checkpoint_file (str): The writer's checkpoint; when given, a commit in
+            progress in another process is ignored.
+    """
+    manifest_file = os.path.join(dataset_dir, MANIFEST_FILE)
+    end = committed_size(checkpoint_file, manifest_file) if checkpoint_file else None
+    return [os.path.join(dataset_dir, name) for name in _read_manifest(manifest_file, end)]
+
+def iter_batches(dataset_dir, columns=None, checkpoint_file=None, start_part=0, batch_size=READ_BATCH):
+    """
+    Stream Arrow record batches of selected columns from a dataset.
+
+    Only the requested column chunks are read and decompressed. The pipeline's
+    consumers still convert each batch's columns to Python values, since name
+    matching and tokenization work on Python strings, so the saving is in
+    what is read and decoded, not in per-record objects.
+
+    Args:
+        dataset_dir (str): Dataset directory.
+        columns (list): Columns to read, e.g. ['id', 'cleaned_body'] (default: all).
+        checkpoint_file (str): Writer checkpoint bounding the committed parts.
+        start_part (int): Skip the parts before this one, e.g. when resuming.
+        batch_size (int): Rows per batch (default: 8192).
+
+    Yields:
+        tuple: (part number, pyarrow.RecordBatch)
+    """
+    _require_pyarrow()
+    parts = dataset_parts(dataset_dir, checkpoint_file)
+    for part_number in range(start_part, len(parts)):
+        part = pq.ParquetFile(parts[part_number])
+        present = None if columns is None else [column for column in columns if column in part.schema_arrow.names]
+        for batch in part.iter_batches(batch_size=batch_size, columns=present):
+            if present is not None and len(present) < len(columns):  # Optional field absent from this part
+                batch = pa.RecordBatch.from_arrays(
+                    [batch.column(column) if column in present else pa.nulls(batch.num_rows) for column in columns],
+                    names=columns,
+                )
+            yield part_number, batch
+
+def read_table(dataset_dir, columns=None, checkpoint_file=None):
+    """Read selected columns of every committed part into one Arrow table (e.g. for .to_pandas())."""
+    _require_pyarrow()
+    parts = dataset_parts(dataset_dir, checkpoint_file)
+    if not parts:
+        return pa.table({})
+    return pa.concat_tables(
+        [pq.read_table(part, columns=columns) for part in parts], promote_options='default')
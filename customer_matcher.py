@@ -0,0 +1,154 @@
+import gc
+import os
+import pickle
+import hashlib
+import metrics
+
+CACHE_VERSION = 1  # Bump when the pickled automaton layout changes
+
+def _is_word_char(char):
+    return char.isalnum() or char == '_'
+
+class CustomerMatcher:
+    """
+    Aho-Corasick automaton over normalized customer names.
+
+    All names are compiled into one character trie with failure links, so a body
+    is scanned once however many customers there are: matching costs time linear
+    in the body length plus the number of hits, instead of one substring test per
+    customer.
+
+    Args:
+        customer_ids (list): Customer IDs, in DataFrame row order.
+        customer_names (list): Normalized customer names, aligned with customer_ids.
+    """
+
+    def __init__(self, customer_ids, customer_names):
+        self.customer_ids = list(customer_ids)
+        self.fingerprint = fingerprint(self.customer_ids, customer_names)
+
+        # Trie: per node, its child transitions, the name it completes (or -1), and its depth
+        self._goto = [{}]
+        self._terminal = [-1]
+        self._depth = [0]
+        self._rows = []  # Per distinct name, the rows (in row order) that have it
+        name_index = {}
+        for row, name in enumerate(customer_names):
+            if not name:
+                continue  # An empty name would match every body
+            if name not in name_index:
+                name_index[name] = len(self._rows)
+                self._rows.append([])
+                self._add_name(name, name_index[name])
+            self._rows[name_index[name]].append(row)
+        self._build_links()
+
+    def _add_name(self, name, index):
+        node = 0
+        for char in name:
+            child = self._goto[node].get(char)
+            if child is None:
+                child = len(self._goto)
+                self._goto[node][char] = child
+                self._goto.append({})
+                self._terminal.append(-1)
+                self._depth.append(self._depth[node] + 1)
+            node = child
+        self._terminal[node] = index
+
+    def _build_links(self):
+        """Compute failure links and output links (nearest terminal on the failure chain) breadth-first."""
+        goto, terminal = self._goto, self._terminal
+        self._fail = fail = [0] * len(goto)
+        self._output = output = [0] * len(goto)
+        queue = list(goto[0].values())
+        for node in queue:  # The queue grows while we iterate, giving breadth-first order
+            for char, child in goto[node].items():
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                fail[child] = goto[state].get(char, 0)
+                output[child] = fail[child] if terminal[fail[child]] >= 0 else output[fail[child]]
+                queue.append(child)
+
+    @metrics.timed('customer_search_seconds')
+    def match_rows(self, text, word_boundary=False):
+        """
+        Find the customers whose name occurs in a normalized text.
+
+        Args:
+            text (str): Normalized text, e.g. a cleaned_body.
+            word_boundary (bool): Only count occurrences not flanked by letters, digits or '_'.
+
+        Returns:
+            list: Matching row positions, ascending (i.e. in DataFrame row order).
+        """
+        goto, fail, terminal, output, depth = self._goto, self._fail, self._terminal, self._output, self._depth
+        found = set()
+        node = 0
+        for end, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            hit = node if terminal[node] >= 0 else output[node]
+            while hit:
+                name = terminal[hit]
+                if name not in found:
+                    if not word_boundary:
+                        found.add(name)
+                    else:
+                        start = end - depth[hit] + 1
+                        if ((start == 0 or not _is_word_char(text[start - 1]))
+                                and (end + 1 == len(text) or not _is_word_char(text[end + 1]))):
+                            found.add(name)
+                hit = output[hit]
+        return sorted(row for name in found for row in self._rows[name])
+
+    def match(self, text, word_boundary=False):
+        """Return the customer_ids whose name occurs in a normalized text, in row order."""
+        return [self.customer_ids[row] for row in self.match_rows(text, word_boundary)]
+
+def fingerprint(customer_ids, customer_names):
+    """Hash of the customer list, used to tell whether a cached automaton is still valid."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(CACHE_VERSION).encode('utf-8'))
+    for customer_id, name in zip(customer_ids, customer_names):
+        digest.update(repr((customer_id, name)).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def load_matcher(customer_ids, customer_names, cache_file=None):
+    """
+    Return a CustomerMatcher for a customer list, reusing a cached automaton if it is current.
+
+    Args:
+        customer_ids (list): Customer IDs, in DataFrame row order.
+        customer_names (list): Normalized customer names, aligned with customer_ids.
+        cache_file (str): Pickle file holding the last compiled automaton, or None to disable caching.
+
+    Returns:
+        CustomerMatcher: The compiled matcher.
+    """
+    customer_ids = list(customer_ids)
+    customer_names = list(customer_names)
+    expected = fingerprint(customer_ids, customer_names)
+    if cache_file and os.path.exists(cache_file):
+        try:
+            gc.disable()  # The automaton is millions of small objects; collecting mid-load only slows it down
+            try:
+                with open(cache_file, 'rb') as f:
+                    matcher = pickle.load(f)
+            finally:
+                gc.enable()
+            if getattr(matcher, 'fingerprint', None) == expected:
+                return matcher
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+            print(f"Ignoring unreadable matcher cache {cache_file}: {e}")
+
+    matcher = CustomerMatcher(customer_ids, customer_names)
+    if cache_file:
+        tmp_file = cache_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(matcher, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)  # Never leave a half-written cache behind
+    return matcher
@@ -0,0 +1,167 @@
+import os
+import mmap
+import struct
+import hashlib
+
+KEY_SIZE = 16  # Bytes of BLAKE2b digest stored per ID
+INITIAL_CAPACITY = 1 << 20  # Slots in a new table (always a power of two)
+MAX_LOAD = 0.7  # Grow the table once it is this full
+
+_MAGIC = b'DDIX'
+_HEADER = struct.Struct('<4sIQQQ')  # magic, version, capacity, count, keys covered
+_HEADER_SIZE = 64
+_EMPTY = bytes(KEY_SIZE)
+
+def hash_id(record_id):
+    """Return the fixed-size key stored for a record ID."""
+    key = hashlib.blake2b(str(record_id).encode('utf-8'), digest_size=KEY_SIZE).digest()
+    return key if key != _EMPTY else b'\x01' + key[1:]  # All-zero marks an empty slot
+
+class DedupIndex:
+    """
+    Persistent set of processed record IDs backed by a memory-mapped hash table.
+
+    Every ID is stored as a 16-byte BLAKE2b key in two files: an append-only keys
+    log, which is the source of truth, and an open-addressing hash table over the
+    keys log, which is memory-mapped so opening it takes constant time and a lookup
+    touches only the pages it probes. `add()` returns the new key so the caller can
+    append it to the keys log together with its output (e.g. as a CheckpointedWriter
+    log); until then it is held in memory, and `sync()` folds committed keys into the
+    table. On open and on sync, the table is caught up with (or rebuilt from) the keys log.
+
+    Args:
+        path (str): Base path; the table is `path` and the keys log is `path + '.keys'`.
+    """
+
+    def __init__(self, path):
+        self.table_file = path
+        self.keys_file = path + '.keys'
+        self._pending = set()  # Keys added since the last sync
+
+        if not os.path.exists(self.table_file):
+            self._create_table(INITIAL_CAPACITY)
+        self._map_table()
+        self._reconcile()
+
+    def _create_table(self, capacity, path=None):
+        """Write an empty table file with the given capacity."""
+        with open(path or self.table_file, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, 1, capacity, 0, 0).ljust(_HEADER_SIZE, b'\0'))
+            f.truncate(_HEADER_SIZE + capacity * KEY_SIZE)  # Sparse file, zero-filled
+
+    def _map_table(self):
+        """Memory-map the table file and read its header."""
+        self._file = open(self.table_file, 'r+b')
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+        magic, _, self.capacity, self.count, self.keys_covered = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{self.table_file} is not a dedup index")
+
+    def _write_header(self):
+        _HEADER.pack_into(self._mm, 0, _MAGIC, 1, self.capacity, self.count, self.keys_covered)
+
+    def _find(self, key):
+        """Return (slot offset, found) for a key using linear probing."""
+        mask = self.capacity - 1
+        slot = int.from_bytes(key[:8], 'little') & mask
+        mm = self._mm
+        while True:
+            offset = _HEADER_SIZE + slot * KEY_SIZE
+            stored = mm[offset:offset + KEY_SIZE]
+            if stored == key:
+                return offset, True
+            if stored == _EMPTY:
+                return offset, False
+            slot = (slot + 1) & mask
+
+    def _insert(self, key):
+        """Insert a key into the mapped table; returns False if it was already there."""
+        offset, found = self._find(key)
+        if found:
+            return False
+        self._mm[offset:offset + KEY_SIZE] = key
+        self.count += 1
+        return True
+
+    def _iter_log_keys(self, start=0):
+        """Yield keys from the keys log starting at key number `start`."""
+        if not os.path.exists(self.keys_file):
+            return
+        with open(self.keys_file, 'rb') as f:
+            f.seek(start * KEY_SIZE)
+            while True:
+                block = f.read(KEY_SIZE * 65536)
+                if len(block) < KEY_SIZE:
+                    return
+                for i in range(0, len(block) - KEY_SIZE + 1, KEY_SIZE):
+                    yield block[i:i + KEY_SIZE]
+
+    def _reconcile(self):
+        """Bring the table in line with the keys log, which may have grown or been rolled back."""
+        keys_logged = os.path.getsize(self.keys_file) // KEY_SIZE if os.path.exists(self.keys_file) else 0
+        if self.keys_covered > keys_logged:
+            # The keys log was rolled back past what the table holds; rebuild from the log
+            self._rebuild(self.capacity)
+        elif self.keys_covered < keys_logged:
+            self._catch_up()
+
+    def _catch_up(self):
+        """Insert keys committed to the log after the table was last synced."""
+        for key in self._iter_log_keys(self.keys_covered):
+            if (self.count + 1) > self.capacity * MAX_LOAD:
+                self._rebuild(self.capacity * 2)  # Rebuild reads the whole log, so we are done
+                return
+            self._insert(key)
+            self.keys_covered += 1
+        self._write_header()
+        self._mm.flush()
+
+    def _rebuild(self, capacity):
+        """Rebuild the table from the keys log into a new file of the given capacity."""
+        keys_covered = os.path.getsize(self.keys_file) // KEY_SIZE if os.path.exists(self.keys_file) else 0
+        while keys_covered > capacity * MAX_LOAD:
+            capacity *= 2
+        self.close()
+        tmp_file = self.table_file + '.tmp'
+        self._create_table(capacity, tmp_file)
+        os.replace(tmp_file, self.table_file)
+        self._map_table()
+        for key in self._iter_log_keys():
+            self._insert(key)
+        self.keys_covered = keys_covered
+        self._write_header()
+        self._mm.flush()
+
+    def __contains__(self, record_id):
+        key = hash_id(record_id)
+        return key in self._pending or self._find(key)[1]
+
+    def __len__(self):
+        return self.count + len(self._pending)
+
+    def add(self, record_id):
+        """Add an ID and return its key for the keys log, or b'' if it was already present."""
+        key = hash_id(record_id)
+        if key in self._pending or self._find(key)[1]:
+            return b''
+        self._pending.add(key)
+        return key
+
+    def sync(self):
+        """Fold keys committed to the keys log into the table, or rebuild it if the log was rolled back."""
+        self._pending.clear()
+        self._reconcile()
+
+    def close(self):
+        """Unmap and close the table file."""
+        self._mm.close()
+        self._file.close()
+
+def migrate_log(log_file, index):
+    """Load IDs from a legacy one-ID-per-line log into a DedupIndex."""
+    with open(log_file, 'r') as f, open(index.keys_file, 'ab') as keys:
+        for line in f:
+            record_id = line.strip()
+            if record_id:
+                keys.write(index.add(record_id))
+    index.sync()
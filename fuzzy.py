@@ -1,5 +1,15 @@
+import multiprocessing
+from collections import defaultdict
+import numpy as np
 import pandas as pd
 from rapidfuzz import fuzz, process
+import metrics
+from match_cache import fingerprint, scorer_key
+
+NGRAM_SIZE = 3  # Characters per n-gram in the blocking index
+MAX_CANDIDATES = 500  # df2 rows scored per df1 row in the blocked join
+MAX_PAIRS = 2000000  # Candidate pairs scored per rapidfuzz call, bounding memory
+JOIN_CHUNK_SIZE = 2000  # df1 rows per task when the blocked join uses worker processes
 
 def fuzzy_join_datasets(
     df1, df2, 
@@ -40,36 +50,273 @@ def fuzzy_join_datasets(
         
         if best_match:
             matches.append(best_match)
+    metrics.inc('records_in', len(df1), stage='fuzzy_join')
+    metrics.inc('matches', len(matches), stage='fuzzy_join')
     
     # Create a DataFrame from matches
     result_df = pd.DataFrame(matches, columns=[f"{id1}_df1", column1, f"{id2}_df2", column2, "similarity_score"])
     return result_df
 
+class NgramIndex:
+    """
+    Inverted index from character n-grams to the rows of a list of strings.
 
-# Example datasets
-data1 = {
-    "id": [1, 2, 3],
-    "name": ["Alice Johnson", "Bob Smith", "Charlie Brown"]
-}
+    Used for blocking: only strings sharing n-grams with a query are worth
+    scoring. N-grams are taken from the lowercased string padded at both ends,
+    so word starts and ends still produce n-grams.
 
-data2 = {
-    "id": ["A", "B", "C"],
-    "name": ["Alice Jonson", "Bobby Smith", "Charles Brown"]
-}
+    Args:
+        choices (list): Strings to index.
+        ngram_size (int): Characters per n-gram (default: 3).
+    """
 
-df1 = pd.DataFrame(data1)
-df2 = pd.DataFrame(data2)
+    def __init__(self, choices, ngram_size=NGRAM_SIZE):
+        self.ngram_size = ngram_size
+        self.size = len(choices)
+        self.lengths = np.array([len(str(choice)) for choice in choices], dtype=np.int64)
+        postings = defaultdict(list)
+        for row, choice in enumerate(choices):
+            for gram in self.ngrams(choice):
+                postings[gram].append(row)
+        self.postings = {gram: np.array(rows, dtype=np.int64) for gram, rows in postings.items()}
 
-# Perform fuzzy join
-result = fuzzy_join_datasets(
-    df1, df2, 
-    column1="name", column2="name", 
-    id1="id", id2="id", 
-    matching_function=fuzz.ratio, 
-    threshold=85
-)
+    def ngrams(self, text):
+        """Return the set of n-grams of a string."""
+        pad = '\0' * (self.ngram_size - 1)
+        padded = f"{pad}{str(text).lower()}{pad}"
+        return {padded[i:i + self.ngram_size] for i in range(len(padded) - self.ngram_size + 1)}
+
+    def candidates(self, query, max_candidates=None):
+        """
+        Return the rows sharing at least one n-gram with a query, ascending.
+
+        Queries shorter than an n-gram cannot share one with longer strings, so
+        every row is a candidate for them, capped to the rows closest in length.
+
+        Args:
+            query (str): String to find candidates for.
+            max_candidates (int): Keep only this many rows, those sharing the most
+                n-grams (or, for short queries, closest in length), earlier rows
+                first on ties (default: None, keep all).
+
+        Returns:
+            np.ndarray: Candidate row positions.
+        """
+        if len(str(query)) < self.ngram_size:
+            if max_candidates is None or self.size <= max_candidates:
+                return np.arange(self.size, dtype=np.int64)
+            distance = np.abs(self.lengths - len(str(query)))
+            return np.sort(np.argsort(distance, kind='stable')[:max_candidates])
+        rows = [self.postings[gram] for gram in self.ngrams(query) if gram in self.postings]
+        if not rows:
+            return np.empty(0, dtype=np.int64)
+        rows, shared = np.unique(np.concatenate(rows), return_counts=True)
+        if max_candidates is not None and len(rows) > max_candidates:
+            # Partition instead of sorting; rows tied at the cut are taken in row order
+            cut = np.partition(shared, len(shared) - max_candidates)[len(shared) - max_candidates]
+            above = shared > cut
+            at_cut = np.flatnonzero(shared == cut)[:max_candidates - int(above.sum())]
+            above[at_cut] = True
+            rows = rows[above]
+        return rows
+
+_join_state = {}  # Index, values and settings of the join a worker process is helping with
+
+def _init_join_worker(state):
+    _join_state.update(state)
+
+def _join_rows(rows1):
+    """
+    Find the best match of the given df1 rows among their blocked candidates.
+
+    Returns:
+        list: (df1 row, df2 row, score) for every row with a match above the threshold.
+    """
+    index, values1, values2 = _join_state['index'], _join_state['values1'], _join_state['values2']
+    matches = []
+
+    def score_batch(batch_rows1, batch_candidates):
+        # Score every (df1 row, candidate) pair of the batch in one call
+        counts = np.array([len(rows) for rows in batch_candidates])
+        pair_rows2 = np.concatenate(batch_candidates)
+        scores = process.cpdist(
+            [values1[row] for row in np.repeat(batch_rows1, counts)],
+            [values2[row] for row in pair_rows2],
+            scorer=_join_state['matching_function'],
+            dtype=np.float64,
+            workers=_join_state['threads'],
+        )
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        for i, row1 in enumerate(batch_rows1):
+            segment = scores[offsets[i]:offsets[i + 1]]
+            best = int(np.argmax(segment))  # First maximum, i.e. the earliest df2 row
+            if segment[best] > _join_state['threshold']:
+                matches.append((row1, int(pair_rows2[offsets[i] + best]), float(segment[best])))
+
+    batch_rows1, batch_candidates, batch_pairs = [], [], 0
+    for row1 in rows1:
+        candidates = index.candidates(values1[row1], _join_state['max_candidates'])
+        if not len(candidates):
+            continue
+        batch_rows1.append(row1)
+        batch_candidates.append(candidates)
+        batch_pairs += len(candidates)
+        if batch_pairs >= _join_state['max_pairs']:
+            score_batch(batch_rows1, batch_candidates)
+            batch_rows1, batch_candidates, batch_pairs = [], [], 0
+    if batch_rows1:
+        score_batch(batch_rows1, batch_candidates)
+    return matches
+
+def fuzzy_join_blocked(
+    df1, df2,
+    column1, column2,
+    id1, id2,
+    matching_function=fuzz.ratio,
+    threshold=80,
+    max_candidates=MAX_CANDIDATES,
+    ngram_size=NGRAM_SIZE,
+    workers=1,
+    max_pairs=MAX_PAIRS,
+    cache=None
+):
+    """
+    Perform the same fuzzy join as fuzzy_join_datasets, scoring only blocked candidate pairs.
+
+    Candidates for each df1 row are the df2 rows sharing the most character
+    n-grams with it. Candidate pairs are scored in batches with one vectorized
+    rapidfuzz call each, and the best df2 row above the threshold is kept per
+    df1 row (ties go to the earlier df2 row, as in the brute-force join). With
+    several workers, df1 is split into chunks scored by a pool of processes.
+
+    Pairs outside a row's candidates are never scored, so a weak match can be
+    missed; check with compare_with_brute_force on a sample, and raise
+    max_candidates or lower ngram_size for more recall.
+
+    Args:
+        df1 (pd.DataFrame): First dataset.
+        df2 (pd.DataFrame): Second dataset.
+        column1 (str): Column name in df1 to match.
+        column2 (str): Column name in df2 to match.
+        id1 (str): ID column name in df1.
+        id2 (str): ID column name in df2.
+        matching_function (function): Fuzzy matching function (default: fuzz.ratio).
+        threshold (int): Matching threshold (default: 80).
+        max_candidates (int): Recall-vs-speed knob: df2 rows scored per df1 row, those
+            sharing the most n-grams. None scores every row sharing an n-gram (default: 500).
+        ngram_size (int): Characters per blocking n-gram (default: 3).
+        workers (int): Worker processes (default: 1).
+        max_pairs (int): Candidate pairs scored per call, bounding memory (default: 2,000,000).
+        cache (MatchCache): Reuse best matches of df1 values seen in earlier runs against
+            the same df2 values and settings, and store the new ones (default: None).
+
+    Returns:
+        pd.DataFrame: Joined dataset with matched rows and similarity scores.
+    """
+    # Missing values never match (rapidfuzz scores them 0), and NaN != NaN would break the
+    # per-value lookups below, so every missing df1 value becomes None and is skipped
+    values1 = [None if missing else value for value, missing in zip(df1[column1].tolist(), df1[column1].isna().tolist())]
+    values2 = df2[column2].tolist()
+    ids1 = df1[id1].tolist()
+    ids2 = df2[id2].tolist()
+    state = {
+        'index': NgramIndex(values2, ngram_size),
+        'values1': values1,
+        'values2': values2,
+        'matching_function': matching_function,
+        'threshold': threshold,
+        'max_candidates': max_candidates,
+        'max_pairs': max_pairs,
+        'threads': 1,
+    }
+
+    best = {}  # df1 value -> [df2 row, score], or None if it has no match
+    if cache is not None:
+        cache_args = (
+            'fuzzy_join',
+            fingerprint(values2),
+            scorer_key(matching_function, threshold=threshold, max_candidates=max_candidates, ngram_size=ngram_size),
+        )
+        best = cache.get_many(*cache_args, [value for value in values1 if value is not None])
+    # Score each distinct uncached value once
+    rows1, seen = [], set(best) | {None}
+    for row1, value in enumerate(values1):
+        if value not in seen:
+            seen.add(value)
+            rows1.append(row1)
+
+    if workers > 1:
+        chunks = [rows1[start:start + JOIN_CHUNK_SIZE] for start in range(0, len(rows1), JOIN_CHUNK_SIZE)]
+        with multiprocessing.Pool(workers, initializer=_init_join_worker, initargs=(state,)) as pool:
+            results = list(pool.imap(_join_rows, chunks))
+    else:
+        _init_join_worker(state)
+        results = [_join_rows(rows1)]
+    _join_state.clear()
+
+    scored = {values1[row1]: None for row1 in rows1}
+    scored.update((values1[row1], [row2, score]) for chunk_matches in results for row1, row2, score in chunk_matches)
+    if cache is not None:
+        cache.put_many(*cache_args, scored)
+    best.update(scored)
+
+    matches = [
+        (ids1[row1], value, ids2[best[value][0]], values2[best[value][0]], best[value][1])
+        for row1, value in enumerate(values1) if best.get(value) is not None
+    ]
+    metrics.inc('records_in', len(values1), stage='fuzzy_join')
+    metrics.inc('matches', len(matches), stage='fuzzy_join')
+    return pd.DataFrame(matches, columns=[f"{id1}_df1", column1, f"{id2}_df2", column2, "similarity_score"])
+
+def compare_with_brute_force(df1, df2, column1, column2, id1, id2, matching_function=fuzz.ratio, threshold=80, **kwargs):
+    """
+    Check fuzzy_join_blocked against fuzzy_join_datasets on the same inputs.
+
+    Brute force is quadratic, so run this on a sample. Extra keyword arguments
+    (e.g. max_candidates) are passed to fuzzy_join_blocked.
+
+    Returns:
+        pd.DataFrame: Rows whose best match differs between the two joins, with a
+            '_merge' column telling which join produced them; empty if they agree.
+            Columns are id1, value1, id2, value2 and similarity_score.
+    """
+    brute = fuzzy_join_datasets(df1, df2, column1, column2, id1, id2, matching_function, threshold)
+    blocked = fuzzy_join_blocked(df1, df2, column1, column2, id1, id2, matching_function, threshold, **kwargs)
+    # column1 and column2 may share a name, so compare on positional column names
+    columns = ['id1', 'value1', 'id2', 'value2', 'similarity_score']
+    brute.columns = blocked.columns = columns
+    merged = brute.merge(blocked, how='outer', indicator=True)
+    merged['_merge'] = merged['_merge'].cat.rename_categories({'left_only': 'brute_force_only', 'right_only': 'blocked_only'})
+    return merged[merged['_merge'] != 'both']
+
+
+if __name__ == "__main__":
+    # Example datasets
+    data1 = {
+        "id": [1, 2, 3],
+        "name": ["Alice Johnson", "Bob Smith", "Charlie Brown"]
+    }
+
+    data2 = {
+        "id": ["A", "B", "C"],
+        "name": ["Alice Jonson", "Bobby Smith", "Charles Brown"]
+    }
+
+    df1 = pd.DataFrame(data1)
+    df2 = pd.DataFrame(data2)
 
-# Display result
-print(result)
+    # Perform fuzzy join
+    result = fuzzy_join_datasets(
+        df1, df2, 
+        column1="name", column2="name", 
+        id1="id", id2="id", 
+        matching_function=fuzz.ratio, 
+        threshold=85
+    )
 
+    # Display result
+    print(result)
 
+    # The blocked join scores only candidate pairs and should find the same best matches
+    print(fuzzy_join_blocked(df1, df2, "name", "name", "id", "id", fuzz.ratio, 85))
+    print(f"Rows differing from brute force: {len(compare_with_brute_force(df1, df2, 'name', 'name', 'id', 'id', fuzz.ratio, 85))}")
@@ -1,19 +1,33 @@
 import os
 import json
+import itertools
+import contextlib
+import multiprocessing
+from collections import deque
 from tqdm import tqdm
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
+import metrics
+from json_stream import iter_json_array
+from batch_writer import CheckpointedWriter
+from columnar import ParquetPartWriter
+from dedup_index import DedupIndex
+from near_duplicates import NearDuplicateIndex, minhash_signature
+from news_index import update_from_ingest
+from text_cleaning import clean_text  # Bundled tokenizer and stopwords, no NLTK download
 
-# Ensure stopwords are downloaded
-import nltk
-nltk.download('stopwords')
-nltk.download('punkt')
-
-STOPWORDS = set(stopwords.words('english'))
 MIN_WORD_COUNT = 10  # Set your minimum word count here
 OUTPUT_FILE = 'filtered_news.jsonl'  # Output file for filtered data
 PROCESSED_FILES_LOG = 'processed_files.log'  # Log file to track processed files
-PROCESSED_IDS_LOG = 'processed_ids.log'  # Log file to track processed IDs
+PROCESSED_IDS_LOG = 'processed_ids.log'  # Legacy text log of processed IDs, migrated into the index
+PROCESSED_IDS_INDEX = 'processed_ids.idx'  # On-disk dedup index of processed IDs
+CHECKPOINT_FILE = 'ingest_checkpoint.json'  # Committed sizes of the output and logs
+NUM_WORKERS = 1  # Set above 1 to clean files in parallel worker processes
+PARALLEL_CHUNK_OBJECTS = 1000  # Raw objects per worker task; bounds memory in parallel mode
+AHEAD_PER_WORKER = 2  # Worker tasks in flight per worker
+NEAR_DUPLICATE_INDEX = 'near_duplicates.db'  # Persistent MinHash LSH index of written articles
+NEAR_DUPLICATE_THRESHOLD = 0.8  # Estimated Jaccard similarity of cleaned bodies that counts as a near-duplicate
+NEAR_DUPLICATE_ACTION = 'drop'  # 'drop' near-duplicates, 'tag' them with near_duplicate_of, or None to disable
+NEWS_INDEX = None  # Set to e.g. 'news_index.db' to update the phrase index after each run (JSONL output only)
+COLUMNAR_OUTPUT = None  # Set to e.g. 'filtered_news.parquet' to write Parquet part files instead of OUTPUT_FILE
 
 def load_processed_files():
     """Load list of processed files from log."""
@@ -22,36 +36,42 @@ def load_processed_files():
             return set(line.strip() for line in f)
     return set()
 
-def load_processed_ids():
-    """Load list of processed IDs from log."""
-    if os.path.exists(PROCESSED_IDS_LOG):
-        with open(PROCESSED_IDS_LOG, 'r') as f:
-            return set(line.strip() for line in f)
-    return set()
+def migrate_processed_ids(writer, processed_ids):
+    """
+    Load the legacy ID log into an empty processed ID index.
 
-def append_to_log(file_name):
-    """Append file name to log after processing."""
-    with open(PROCESSED_FILES_LOG, 'a') as f:
-        f.write(f"{file_name}\n")
+    The keys are committed through the writer like any other batch, so the
+    checkpoint covers them and a crash mid-migration rolls the index back to
+    empty, which makes the next run migrate again.
+    """
+    if len(processed_ids) or not os.path.exists(PROCESSED_IDS_LOG):
+        return
+    print(f"Migrating {PROCESSED_IDS_LOG} into {PROCESSED_IDS_INDEX}")
+    with open(PROCESSED_IDS_LOG, 'r') as f:
+        for line in f:
+            record_id = line.strip()
+            if record_id:
+                append_id_to_log(writer, processed_ids, record_id)
+    writer.commit(**writer.state)  # Keep any mid-file resume position
 
-def append_id_to_log(record_id):
-    """Append processed ID to log."""
-    with open(PROCESSED_IDS_LOG, 'a') as f:
-        f.write(f"{record_id}\n")
+def append_to_log(writer, file_name):
+    """Buffer file name for the log; it is committed together with the file's records."""
+    writer.log(PROCESSED_FILES_LOG, file_name)
 
-def clean_text(text):
-    """Remove stopwords from text and return cleaned text."""
-    words = word_tokenize(text.lower())  # Lowercase entire text
-    cleaned_words = [word for word in words if word.isalnum() and word not in STOPWORDS]
-    return " ".join(cleaned_words)
+def append_id_to_log(writer, processed_ids, record_id):
+    """Add processed ID to the index; its key is committed together with its record."""
+    writer.log_bytes(processed_ids.keys_file, processed_ids.add(record_id))
 
 def filter_news_object(obj, processed_ids):
     """Filter a news object based on word count after removing stopwords."""
+    metrics.inc('records_in', stage='ingest')
     record_id = obj.get('newsReferenceId', None)  # Adjust based on available ID field
     if not record_id or record_id in processed_ids:
+        metrics.inc('records_dropped', stage='ingest', reason='duplicate_id' if record_id else 'no_id')
         return None  # Skip if no ID or if ID is already processed
 
     if 'body' not in obj:
+        metrics.inc('records_dropped', stage='ingest', reason='no_body')
         return None  # Discard objects without a 'body'
     
     original_body = obj['body'].lower()  # Lowercase the original body text
@@ -59,6 +79,7 @@ def filter_news_object(obj, processed_ids):
     word_count = len(cleaned_body.split())
     
     if word_count < MIN_WORD_COUNT:
+        metrics.inc('records_dropped', stage='ingest', reason='too_short')
         return None  # Discard objects with fewer than MIN_WORD_COUNT words
     
     # Keep original and cleaned body along with other necessary columns
@@ -68,41 +89,201 @@ def filter_news_object(obj, processed_ids):
         'cleaned_body': cleaned_body,
     }
 
-def process_json_file(file_path, processed_ids):
-    """Process a single JSON file, filter objects, and append results to output file."""
+def iter_filtered_objects(file_path, processed_ids):
+    """Yield filtered news objects from a JSON file, stopping at the first invalid byte."""
+    objects_read = 0
+    try:
+        for obj in metrics.timed_iter(iter_json_array(file_path)):  # Stream one object at a time
+            objects_read += 1
+            filtered_obj = filter_news_object(obj, processed_ids)
+            if filtered_obj:
+                yield filtered_obj
+    except json.JSONDecodeError as e:
+        # Everything before the bad byte has already been yielded
+        print(f"Stopped at invalid JSON in {file_path} after {objects_read} objects: {e}")
+
+def load_near_duplicates():
+    """Open the near-duplicate index, or return None if near-duplicate detection is disabled."""
+    if NEAR_DUPLICATE_ACTION is None:
+        return None
+    return NearDuplicateIndex(NEAR_DUPLICATE_INDEX, threshold=NEAR_DUPLICATE_THRESHOLD)
+
+def write_filtered_objects(file_path, filtered_objs, processed_ids, writer, near_duplicates=None):
+    """
+    Append filtered objects to the output file, skipping IDs that were already written.
+
+    filtered_objs yields (filtered object, MinHash signature or None) pairs; a missing
+    signature is computed here. Near-duplicates of earlier articles are dropped or
+    tagged according to NEAR_DUPLICATE_ACTION.
+    """
+    file_name = os.path.basename(file_path)
     records_written = 0
-    with open(file_path, 'r') as f:
-        try:
-            data = json.load(f)  # Load the entire file as a JSON array
-            for obj in data:
-                filtered_obj = filter_news_object(obj, processed_ids)
-                if filtered_obj:
-                    with open(OUTPUT_FILE, 'a') as output_file:
-                        output_file.write(json.dumps(filtered_obj) + '\n')
-                    records_written += 1  # Increment count of records written
-                    processed_ids.add(filtered_obj['id'])
-                    append_id_to_log(filtered_obj['id'])  # Log ID to avoid duplicates
-        except json.JSONDecodeError:
-            print(f"Skipping invalid JSON file: {file_path}")
-    print(f"Processed {file_path}: {records_written} records written")  # Debugging output
+    near_duplicates_found = 0
+    for filtered_obj, signature in filtered_objs:
+        if filtered_obj['id'] in processed_ids:
+            metrics.inc('records_dropped', stage='ingest', reason='duplicate_id')
+            continue  # Written earlier in this run or a previous one
+        if near_duplicates is not None:
+            duplicate = near_duplicates.check(filtered_obj['id'], filtered_obj['cleaned_body'], signature)
+            if duplicate is not None:
+                near_duplicates_found += 1
+                if NEAR_DUPLICATE_ACTION == 'drop':
+                    metrics.inc('records_dropped', stage='ingest', reason='near_duplicate')
+                    # Log the ID anyway so the article is not checked again on a later run
+                    append_id_to_log(writer, processed_ids, filtered_obj['id'])
+                    continue
+                filtered_obj['near_duplicate_of'] = duplicate[0]
+                metrics.inc('records_tagged', stage='ingest', reason='near_duplicate')
+        writer.write(filtered_obj)
+        metrics.inc('records_kept', stage='ingest')
+        records_written += 1  # Increment count of records written
+        append_id_to_log(writer, processed_ids, filtered_obj['id'])  # Log ID to avoid duplicates
+        writer.maybe_commit(file=file_name)
+    print(f"Processed {file_path}: {records_written} records written, {near_duplicates_found} near-duplicates")  # Debugging output
     return records_written > 0
 
-def main():
+def process_json_file(file_path, processed_ids, writer, near_duplicates=None):
+    """Process a single JSON file, filter objects, and append results to output file."""
+    filtered_objs = ((filtered_obj, None) for filtered_obj in iter_filtered_objects(file_path, processed_ids))
+    return write_filtered_objects(file_path, filtered_objs, processed_ids, writer, near_duplicates)
+
+def iter_object_chunks(file_path, processed_ids, chunk_size=PARALLEL_CHUNK_OBJECTS):
+    """
+    Yield the raw objects of a JSON file in chunks, skipping IDs that are already processed.
+
+    Known IDs are dropped here, before any worker cleans them; repeats of IDs
+    still in flight are dropped when written. At least one (possibly empty)
+    chunk is yielded per file, stopping at the first invalid byte.
+    """
+    chunk, yielded, objects_read = [], False, 0
+    try:
+        for obj in metrics.timed_iter(iter_json_array(file_path)):  # Stream one object at a time
+            objects_read += 1
+            record_id = obj.get('newsReferenceId', None)
+            if record_id and record_id in processed_ids:
+                metrics.inc('records_in', stage='ingest')
+                metrics.inc('records_dropped', stage='ingest', reason='duplicate_id')
+                continue
+            chunk.append(obj)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk, yielded = [], True
+    except json.JSONDecodeError as e:
+        # Everything before the bad byte has already been read
+        print(f"Stopped at invalid JSON in {file_path} after {objects_read} objects: {e}")
+    if chunk or not yielded:
+        yield chunk
+
+def clean_objects(objs):
+    """
+    Worker task: clean and filter a chunk of raw objects whose IDs are new.
+
+    Returns (filtered object, MinHash signature or None) pairs and the worker's metrics for the chunk.
+    """
+    filtered_objs = []
+    for obj in objs:
+        filtered_obj = filter_news_object(obj, ())
+        if filtered_obj:
+            # Signatures are the expensive part of near-duplicate detection, so workers compute them
+            signature = None
+            if NEAR_DUPLICATE_ACTION is not None:
+                signature = minhash_signature(filtered_obj['cleaned_body'])
+            filtered_objs.append((filtered_obj, signature))
+    return filtered_objs, metrics.drain()
+
+def clean_in_pool(pool, tasks, in_flight_limit):
+    """Run clean_objects on (key, chunk) tasks with at most in_flight_limit in flight; yield (key, pairs) in order."""
+    in_flight = deque()
+    for key, objs in tasks:
+        in_flight.append((key, pool.apply_async(clean_objects, (objs,))))
+        if len(in_flight) >= in_flight_limit:
+            key, result = in_flight.popleft()
+            filtered_objs, worker_metrics = result.get()
+            metrics.merge(worker_metrics)
+            yield key, filtered_objs
+    while in_flight:
+        key, result = in_flight.popleft()
+        filtered_objs, worker_metrics = result.get()
+        metrics.merge(worker_metrics)
+        yield key, filtered_objs
+
+def finish_file(writer, file_name, records_written):
+    """
+    Log a finished file; a mid-file commit before a restart counts as written.
+
+    The log line is committed with the next batch rather than right away, so a
+    batch (and a Parquet part) spans as many small files as it takes to fill it.
+    """
+    if records_written or writer.state.get('file') == file_name:
+        append_to_log(writer, file_name)  # Log file as processed only if records were written
+
+def process_files_parallel(folder_path, json_files, processed_ids, writer, workers, near_duplicates=None):
+    """
+    Clean files across worker processes while this process writes results in file order.
+
+    This process streams every file and sends bounded chunks of objects with new
+    IDs to the workers, across file boundaries, so memory stays bounded however
+    large a file is and small files still keep every worker busy.
+    """
+    file_paths = [os.path.join(folder_path, file_name) for file_name in json_files]
+    tasks = ((file_number, chunk) for file_number, file_path in enumerate(file_paths)
+             for chunk in iter_object_chunks(file_path, processed_ids))
+    with multiprocessing.Pool(workers) as pool:
+        # Results come back in file order, so dedup against processed_ids and the
+        # processed files log behave exactly as in a serial run
+        results = itertools.groupby(clean_in_pool(pool, tasks, workers * AHEAD_PER_WORKER), key=lambda result: result[0])
+        for file_name, file_path in tqdm(zip(json_files, file_paths), total=len(json_files), desc="Processing JSON files"):
+            try:
+                _, file_results = next(results)
+                filtered_objs = (pair for _, pairs in file_results for pair in pairs)
+                records_written = write_filtered_objects(file_path, filtered_objs, processed_ids, writer, near_duplicates)
+                finish_file(writer, file_name, records_written)
+            except Exception as e:
+                print(f"Error processing {file_name}: {e}")
+                break  # Stop processing on error; the uncommitted batch is discarded
+        else:
+            writer.commit()  # Every file finished: commit the last batch
+
+def main(workers=NUM_WORKERS):
     folder_path = 'path_to_your_json_files'  # Update to your JSON folder path
+    processed_ids = DedupIndex(PROCESSED_IDS_INDEX)  # Index of previously processed IDs to avoid duplicates
+    # Opening the writer rolls the output and logs back to the last committed batch
+    logs = [PROCESSED_FILES_LOG, processed_ids.keys_file]
+    if COLUMNAR_OUTPUT:
+        writer = ParquetPartWriter(COLUMNAR_OUTPUT, CHECKPOINT_FILE, logs=logs)  # One compressed part per batch
+    else:
+        writer = CheckpointedWriter(OUTPUT_FILE, CHECKPOINT_FILE, logs=logs)
+    processed_ids.sync()  # Rebuild the index if the writer rolled its keys log back
+    writer.on_commit.append(processed_ids.sync)  # Fold each committed batch of keys into the index
+    migrate_processed_ids(writer, processed_ids)
     processed_files = load_processed_files()
-    processed_ids = load_processed_ids()  # Load previously processed IDs to avoid duplicates
+    near_duplicates = load_near_duplicates()
+    if near_duplicates is not None:
+        # Signatures are committed after their records but before the checkpoint, so a crash
+        # can only leave signatures of a rolled-back batch, which re-reading it ignores
+        writer.before_commit.append(near_duplicates.commit)
     
     json_files = sorted([f for f in os.listdir(folder_path) if f.endswith('.json') and f not in processed_files])
     
-    for file_name in tqdm(json_files, desc="Processing JSON files"):
-        file_path = os.path.join(folder_path, file_name)
-        
-        try:
-            if process_json_file(file_path, processed_ids):
-                append_to_log(file_name)  # Log file as processed only if records were written
-        except Exception as e:
-            print(f"Error processing {file_name}: {e}")
-            break  # Stop processing on error to avoid partial file corruption
+    with writer, near_duplicates or contextlib.nullcontext(), metrics.stage('ingest'):
+        if workers > 1:
+            process_files_parallel(folder_path, json_files, processed_ids, writer, workers, near_duplicates)
+        else:
+            for file_name in tqdm(json_files, desc="Processing JSON files"):
+                file_path = os.path.join(folder_path, file_name)
+                
+                try:
+                    records_written = process_json_file(file_path, processed_ids, writer, near_duplicates)
+                    finish_file(writer, file_name, records_written)
+                except Exception as e:
+                    print(f"Error processing {file_name}: {e}")
+                    break  # Stop processing on error; the uncommitted batch is discarded
+            else:
+                writer.commit()  # Every file finished: commit the last batch
+
+    if NEWS_INDEX and not COLUMNAR_OUTPUT:
+        update_from_ingest(OUTPUT_FILE, CHECKPOINT_FILE, NEWS_INDEX)  # Index only the newly committed records
+    metrics.export()  # Only when PIPELINE_METRICS=1
 
 if __name__ == "__main__":
     main()
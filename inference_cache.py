@@ -0,0 +1,108 @@
+import sqlite3
+import hashlib
+import numpy as np
+import torch
+
+CACHE_FILE = 'inference_cache.db'  # Default location of the inference cache
+MAX_ENTRIES = 10000000  # Cached window scores kept before the least recently used are evicted
+
+def model_fingerprint(model):
+    """Hash of a model's config and weights; cached scores are only valid for the same fingerprint."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(model.config.to_json_string().encode('utf-8'))
+    for name, tensor in sorted(model.state_dict().items()):
+        digest.update(name.encode('utf-8'))
+        digest.update(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
+
+def window_key(input_ids):
+    """Content hash of one window's token IDs (the tokenized, normalized text chunk)."""
+    return hashlib.blake2b(np.asarray(input_ids, dtype=np.int64).tobytes(), digest_size=16).digest()
+
+class InferenceCache:
+    """
+    Persistent cache of per-window model scores, stored in SQLite.
+
+    Scores are keyed by a content hash of the window's token IDs together with a
+    fingerprint of the model, so syndicated copies and reruns skip the model
+    entirely. Scores from any other model are dropped on open, and once more
+    than max_entries scores are held the least recently used are evicted.
+    `hits` and `misses` count lookups since the cache was opened.
+
+    Args:
+        model_fingerprint (str): model_fingerprint() of the model being run.
+        path (str): SQLite database file (default: 'inference_cache.db').
+        max_entries (int): Scores kept before eviction (default: 10,000,000).
+    """
+
+    def __init__(self, model_fingerprint, path=CACHE_FILE, max_entries=MAX_ENTRIES):
+        self.model_fingerprint = model_fingerprint
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS scores (
+                window BLOB, model TEXT, score REAL, last_used INTEGER,
+                PRIMARY KEY (window, model)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used)")
+        with self.conn:
+            self.conn.execute("DELETE FROM scores WHERE model != ?", (model_fingerprint,))
+        # Use counter for LRU order; continues from the most recent use
+        self._clock = self.conn.execute("SELECT COALESCE(MAX(last_used), 0) FROM scores").fetchone()[0]
+
+    def get_many(self, keys):
+        """
+        Look up cached scores.
+
+        Args:
+            keys (list): window_key() of each window.
+
+        Returns:
+            dict: key -> score for the keys that were cached.
+        """
+        found = {}
+        unique = list(set(keys))
+        for i in range(0, len(unique), 900):  # Stay under SQLite's bound parameter limit
+            chunk = unique[i:i + 900]
+            rows = self.conn.execute(
+                f"SELECT window, score FROM scores WHERE model = ? AND window IN ({','.join('?' * len(chunk))})",
+                [self.model_fingerprint] + chunk,
+            )
+            found.update(rows)
+
+        self._clock += 1
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE scores SET last_used = ? WHERE window = ? AND model = ?",
+                ((self._clock, key, self.model_fingerprint) for key in found),
+            )
+        hits = sum(1 for key in keys if key in found)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, scores):
+        """Store key -> score pairs and evict the least recently used beyond max_entries."""
+        self._clock += 1
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)",
+                ((key, self.model_fingerprint, float(score), self._clock) for key, score in scores.items()),
+            )
+            excess = self.conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.conn.execute(
+                    "DELETE FROM scores WHERE rowid IN (SELECT rowid FROM scores ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+
+    def hit_rate(self):
+        """Fraction of window lookups answered from the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,111 @@
+import json
+
+CHUNK_SIZE = 1 << 20  # Characters read from disk per refill
+MAX_RECORD_SIZE = 64 << 20  # Largest single object we wait for before calling the input corrupt
+
+_WHITESPACE = ' \t\n\r'
+_NUMBER_CHARS = '0123456789.eE+-'
+
+def _skip_whitespace(buffer, pos):
+    """Return the index of the first non-whitespace character at or after pos."""
+    while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+        pos += 1
+    return pos
+
+def iter_json_array(file_path, chunk_size=CHUNK_SIZE, max_record_size=MAX_RECORD_SIZE):
+    """
+    Yield the elements of a top-level JSON array one at a time.
+
+    Only the current element (plus one read chunk) is held in memory, so peak
+    memory stays flat however large the file is. If the file is corrupt, every
+    element before the bad byte is still yielded and a json.JSONDecodeError is
+    raised at the point of corruption.
+
+    Args:
+        file_path (str): Path to a file containing a single JSON array.
+        chunk_size (int): Number of characters read per refill (default: 1 MiB).
+        max_record_size (int): Largest element we keep reading for before
+            giving up on it (default: 64 MiB).
+
+    Yields:
+        object: Each decoded element of the array, in file order.
+    """
+    decoder = json.JSONDecoder()
+    with open(file_path, 'r') as f:
+        buffer = ''
+        pos = 0
+        consumed = 0  # Characters dropped from the front of the buffer so far
+        eof = False
+
+        def refill():
+            nonlocal buffer, pos, consumed, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+            # Drop what has already been parsed so the buffer never grows past one record
+            consumed += pos
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+        def corrupt(message, doc=None, doc_pos=None):
+            if doc is None:
+                doc, doc_pos = buffer, pos
+            return json.JSONDecodeError(
+                f"{message} (char offset {consumed + doc_pos} in {file_path})", doc, doc_pos
+            )
+
+        # Find the opening bracket
+        while True:
+            pos = _skip_whitespace(buffer, pos)
+            if pos < len(buffer) or eof:
+                break
+            refill()
+        if pos >= len(buffer) or buffer[pos] != '[':
+            raise corrupt("Expecting '[' at start of JSON array")
+        pos += 1
+        expect_value = True  # False once an element has been read and we need ',' or ']'
+        first = True
+
+        while True:
+            pos = _skip_whitespace(buffer, pos)
+            if pos >= len(buffer):
+                if eof:
+                    raise corrupt("Unterminated JSON array")
+                refill()
+                continue
+
+            char = buffer[pos]
+            if not expect_value:
+                if char == ',':
+                    pos += 1
+                    expect_value = True
+                    continue
+                if char == ']':
+                    return
+                raise corrupt("Expecting ',' or ']' between array elements")
+
+            if char == ']' and first:
+                return
+
+            try:
+                obj, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                # The element may simply be cut off at the end of the buffer; read more
+                # unless we are at EOF, the error is well inside the buffer, or we have
+                # waited for an absurdly large record
+                truncated = e.msg.startswith('Unterminated') or e.pos >= len(buffer) - 6
+                if eof or not truncated or len(buffer) - pos > max_record_size:
+                    raise corrupt(e.msg, e.doc, e.pos) from None
+                refill()
+                continue
+
+            if (not eof and isinstance(obj, (int, float)) and len(buffer) - end < 32
+                    and not buffer[end:].strip(_NUMBER_CHARS)):
+                # A bare number at the buffer edge may continue in the next chunk
+                refill()
+                continue
+
+            pos = end
+            expect_value = False
+            first = False
+            yield obj
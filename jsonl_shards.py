@@ -0,0 +1,81 @@
+import os
+import json
+import mmap
+
+def plan_shards(file_path, num_shards, start=0):
+    """
+    Split a JSONL file into newline-aligned byte ranges.
+
+    Boundaries are placed at roughly equal byte offsets and then moved forward to
+    just past the next newline, so every line falls in exactly one shard.
+
+    Args:
+        file_path (str): Path to the JSONL file.
+        num_shards (int): Number of shards wanted; fewer are returned for small files.
+        start (int): Byte offset to start from, e.g. the end of already-planned shards.
+
+    Returns:
+        list: [start, end) byte ranges covering the file from `start` to its end.
+    """
+    size = os.path.getsize(file_path)
+    if size <= start:
+        return []
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        boundaries = [start]
+        for i in range(1, num_shards):
+            target = max(start + (size - start) * i // num_shards, boundaries[-1])
+            newline = mm.find(b'\n', target)
+            if newline == -1:
+                break
+            if newline + 1 > boundaries[-1]:
+                boundaries.append(newline + 1)
+        if boundaries[-1] < size:
+            boundaries.append(size)
+    return [[begin, end] for begin, end in zip(boundaries, boundaries[1:])]
+
+def iter_shard_lines(file_path, start, end):
+    """
+    Yield the lines of a byte range of a file through a read-only memory map.
+
+    Yields:
+        tuple: (line bytes without the newline, byte offset just past the line).
+    """
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = start
+        while pos < end:
+            newline = mm.find(b'\n', pos, end)
+            line_end = end if newline == -1 else newline
+            next_pos = end if newline == -1 else newline + 1
+            yield mm[pos:line_end], next_pos
+            pos = next_pos
+
+def load_manifest(manifest_file, file_path, num_shards):
+    """
+    Load the shard manifest for a file, creating or extending it as needed.
+
+    Shards are fixed once planned so their checkpoints stay valid across runs. If
+    the file has grown since, the new tail is planned as additional shards.
+
+    Returns:
+        list: [start, end) byte ranges, in file order.
+    """
+    manifest = None
+    if os.path.exists(manifest_file):
+        with open(manifest_file, 'r') as f:
+            manifest = json.load(f)
+        if manifest['input'] != os.path.abspath(file_path):
+            raise ValueError(f"{manifest_file} describes {manifest['input']}, not {file_path}")
+        if os.path.getsize(file_path) < manifest['size']:
+            raise ValueError(f"{file_path} shrank since {manifest_file} was written; remove it to start over")
+
+    shards = manifest['shards'] if manifest else []
+    planned_end = shards[-1][1] if shards else 0
+    new_shards = plan_shards(file_path, num_shards, planned_end)
+    if manifest is None or new_shards:
+        shards = shards + new_shards
+        manifest = {'input': os.path.abspath(file_path), 'size': os.path.getsize(file_path), 'shards': shards}
+        tmp_file = manifest_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_file, manifest_file)
+    return shards
@@ -0,0 +1,122 @@
+import json
+import sqlite3
+import hashlib
+
+CACHE_FILE = 'match_cache.db'  # Default location of the match cache
+MAX_ENTRIES = 5000000  # Cached results kept before the least recently used are evicted
+
+def fingerprint(values):
+    """Hash of a reference list (e.g. the target strings), in order."""
+    digest = hashlib.blake2b(digest_size=16)
+    for value in values:
+        digest.update(repr(value).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def scorer_key(scorer, **settings):
+    """Describe a scorer and the settings that affect its results, e.g. the threshold."""
+    name = f"{getattr(scorer, '__module__', '')}.{getattr(scorer, '__qualname__', repr(scorer))}"
+    return "|".join([name] + [f"{key}={settings[key]!r}" for key in sorted(settings)])
+
+def _source_key(source):
+    # repr keeps the type, so 1 and '1' get separate entries
+    return hashlib.blake2b(repr(source).encode('utf-8'), digest_size=16).digest()
+
+class MatchCache:
+    """
+    Persistent cache of fuzzy-match results, stored in SQLite.
+
+    A result is keyed by the job's namespace, the fingerprint of the reference
+    (target) list it was matched against, the scorer with its settings
+    (threshold etc.) and the source string. Results for different reference
+    lists are kept side by side, so jobs sharing a namespace never evict each
+    other; results for reference lists that are no longer used simply stop
+    being looked up. Once the cache holds more than max_entries results, the
+    least recently used are evicted.
+
+    Source strings are keyed exactly as they are scored, so normalize them
+    before matching if differently formatted inputs should share results.
+
+    Args:
+        path (str): SQLite database file (default: 'match_cache.db').
+        max_entries (int): Results kept before eviction (default: 5,000,000).
+    """
+
+    def __init__(self, path=CACHE_FILE, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS matches (
+                namespace TEXT, fingerprint TEXT, scorer TEXT, source BLOB, result TEXT, last_used INTEGER,
+                PRIMARY KEY (namespace, fingerprint, scorer, source)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS matches_last_used ON matches (last_used)")
+        self.conn.commit()
+        # Use counter for LRU order; continues from the most recent use
+        self._clock = self.conn.execute("SELECT COALESCE(MAX(last_used), 0) FROM matches").fetchone()[0]
+
+    def get_many(self, namespace, fingerprint, scorer, sources):
+        """
+        Look up cached results for many source strings.
+
+        Args:
+            namespace (str): Job name, e.g. 'fuzzy_join'.
+            fingerprint (str): fingerprint() of the reference list.
+            scorer (str): scorer_key() of the scorer and its settings.
+            sources (list): Source strings.
+
+        Returns:
+            dict: source -> cached result (as stored by put_many) for the sources that were cached.
+        """
+        keys = {_source_key(source): source for source in set(sources)}
+        found = {}
+        key_list = list(keys)
+        for i in range(0, len(key_list), 900):  # Stay under SQLite's bound parameter limit
+            chunk = key_list[i:i + 900]
+            rows = self.conn.execute(
+                f"SELECT source, result FROM matches WHERE namespace = ? AND fingerprint = ? AND scorer = ? "
+                f"AND source IN ({','.join('?' * len(chunk))})",
+                [namespace, fingerprint, scorer] + chunk,
+            )
+            for key, result in rows:
+                found[keys[key]] = json.loads(result)
+
+        self._clock += 1
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE matches SET last_used = ? WHERE namespace = ? AND fingerprint = ? AND scorer = ? AND source = ?",
+                ((self._clock, namespace, fingerprint, scorer, _source_key(source)) for source in found),
+            )
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, namespace, fingerprint, scorer, results):
+        """
+        Store results and evict the least recently used ones beyond max_entries.
+
+        Args:
+            namespace (str): Job name, e.g. 'fuzzy_join'.
+            fingerprint (str): fingerprint() of the reference list.
+            scorer (str): scorer_key() of the scorer and its settings.
+            results (dict): source -> JSON-serializable result (None for "no match").
+        """
+        self._clock += 1
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?, ?)",
+                ((namespace, fingerprint, scorer, _source_key(source), json.dumps(result), self._clock)
+                 for source, result in results.items()),
+            )
+            excess = self.conn.execute("SELECT COUNT(*) FROM matches").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.conn.execute(
+                    "DELETE FROM matches WHERE rowid IN (SELECT rowid FROM matches ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,348 @@
+import os
+import sys
+import json
+import time
+import bisect
+import threading
+import functools
+import contextlib
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; the peak RSS comes from psutil there
+    resource = None
+
+try:
+    import psutil
+except ImportError:  # Optional: without it only the peak RSS is reported
+    psutil = None
+
+METRICS_ENV = 'PIPELINE_METRICS'  # Set to 1 to record metrics; worker processes inherit it
+JSON_FILE = 'metrics.json'  # Default JSON export
+PROMETHEUS_FILE = 'metrics.prom'  # Default Prometheus text-format export (e.g. for the node exporter's textfile collector)
+PREFIX = 'pipeline_'  # Prefix of every exported metric name
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)  # Histogram bucket upper bounds, seconds
+NO_STAGE = 'none'  # Stage label of I/O timed outside any stage
+WORKER_NAMES = {'stage_io_seconds': 'worker_io_seconds',
+                'stage_seconds': 'worker_stage_seconds'}  # Names merge() gives worker stage timings
+
+_enabled = os.environ.get(METRICS_ENV, '') not in ('', '0')
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [count per bucket..., count above the last bucket, sum]
+_gauges = {}  # (name, labels) -> value
+_stages = []  # Names of the stages being timed, innermost last
+_NULL = contextlib.nullcontext()
+
+def enabled():
+    """True if metrics are being recorded."""
+    return _enabled
+
+def enable(flag=True):
+    """Turn recording on or off; worker processes started afterwards inherit the setting."""
+    global _enabled
+    _enabled = flag
+    os.environ[METRICS_ENV] = '1' if flag else '0'
+
+def _key(name, labels):
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+def inc(name, value=1, **labels):
+    """Add value to a counter, e.g. inc('records_dropped', stage='ingest', reason='too_short')."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name, value, **labels):
+    """Set a gauge to value."""
+    if not _enabled:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def observe(name, seconds, **labels):
+    """Record one duration in a latency histogram."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+        histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+
+def current_stage():
+    """Name of the innermost stage being timed, or NO_STAGE."""
+    return _stages[-1] if _stages else NO_STAGE
+
+class _Timer:
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+def timer(name, **labels):
+    """Context manager recording the duration of its block in a latency histogram, unless it raises."""
+    return _Timer(name, labels) if _enabled else _NULL
+
+def timed(name, **labels):
+    """Decorator recording the duration of every call that returns in a latency histogram."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            observe(name, time.perf_counter() - start, **labels)
+            return result
+        return wrapper
+    return decorate
+
+class _IoTimer:
+    __slots__ = ('start',)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        inc('stage_io_seconds', time.perf_counter() - self.start, stage=current_stage())
+
+def io():
+    """Context manager counting its block as I/O time of the current stage."""
+    return _IoTimer() if _enabled else _NULL
+
+def timed_iter(iterable):
+    """Iterate, counting the time spent waiting for each item (e.g. reading and parsing) as I/O."""
+    if not _enabled:
+        return iterable
+    return _timed_iter(iter(iterable))
+
+def _timed_iter(iterator):
+    while True:
+        with io():
+            item = next(iterator, _NULL)
+        if item is _NULL:
+            return
+        yield item
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Time a pipeline stage, e.g. `with metrics.stage('ingest'):`.
+
+    The stage's wall time is counted in stage_seconds. I/O timed inside it
+    (io(), timed_iter() and CheckpointedWriter commits) is counted in
+    stage_io_seconds, and the rest is exported as stage_compute_seconds. I/O
+    overlapped by another thread (e.g. a prefetch thread) still counts as I/O,
+    so compute time is a lower bound there. Worker processes' I/O is merged as
+    worker_io_seconds instead, summed over the workers, as it runs in parallel
+    with this process's wall clock. Entering a stage that is already the
+    current one does nothing.
+    """
+    if not _enabled or current_stage() == name:
+        yield
+        return
+    _stages.append(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stages.pop()
+        inc('stage_seconds', time.perf_counter() - start, stage=name)
+
+def rss_bytes():
+    """
+    (current, peak) resident memory of this process in bytes.
+
+    current is None without psutil; peak is None without either the resource
+    module or psutil.
+    """
+    memory = psutil.Process().memory_info() if psutil is not None else None
+    current = memory.rss if memory is not None else None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak if sys.platform == 'darwin' else peak * 1024  # Bytes on macOS, KB on Linux
+    elif memory is not None:
+        peak = getattr(memory, 'peak_wset', current)  # Peak working set on Windows
+    else:
+        peak = None
+    return current, peak
+
+def drain():
+    """
+    Return this process's recorded metrics and reset them, or None when disabled.
+
+    Worker processes return this with their results so the parent can merge() them.
+    """
+    if not _enabled:
+        return None
+    with _lock:
+        data = {'counters': dict(_counters), 'histograms': dict(_histograms), 'peak_rss': rss_bytes()[1]}
+        _counters.clear()
+        _histograms.clear()
+    return data
+
+def merge(data):
+    """
+    Add metrics returned by drain() in a worker process to this process's.
+
+    The worker's stage timings are renamed by WORKER_NAMES, so time spent in
+    parallel with this process is not subtracted from its compute time.
+    """
+    if not _enabled or data is None:
+        return
+    with _lock:
+        for (name, labels), value in data['counters'].items():
+            key = WORKER_NAMES.get(name, name), labels
+            _counters[key] = _counters.get(key, 0) + value
+        for key, histogram in data['histograms'].items():
+            mine = _histograms.get(key)
+            _histograms[key] = list(histogram) if mine is None else [a + b for a, b in zip(mine, histogram)]
+        if data['peak_rss'] is not None:
+            key = _key('worker_peak_resident_memory_bytes', {})
+            _gauges[key] = max(_gauges.get(key, 0), data['peak_rss'])
+
+def _quantile(histogram, q):
+    """Upper bound of the bucket holding the q-quantile (the last bound if it is above every bucket)."""
+    count = sum(histogram[:-1])
+    if not count:
+        return 0.0
+    rank, seen = q * count, 0
+    for bound, bucket_count in zip(LATENCY_BUCKETS, histogram):
+        seen += bucket_count
+        if seen >= rank:
+            return bound
+    return LATENCY_BUCKETS[-1]
+
+def snapshot():
+    """
+    All recorded metrics as a JSON-serializable dict.
+
+    Compute time per stage and the process's RSS are added here.
+    """
+    with _lock:
+        counters, histograms, gauges = dict(_counters), dict(_histograms), dict(_gauges)
+    io_seconds = {dict(labels)['stage']: value for (name, labels), value in counters.items()
+                  if name == 'stage_io_seconds'}
+    for (name, labels), value in list(counters.items()):
+        if name == 'stage_seconds':
+            stage_name = dict(labels)['stage']
+            counters[_key('stage_compute_seconds', {'stage': stage_name})] = max(0.0, value - io_seconds.get(stage_name, 0.0))
+    current, peak = rss_bytes()
+    if peak is not None:
+        gauges[_key('peak_resident_memory_bytes', {})] = peak
+    if current is not None:
+        gauges[_key('resident_memory_bytes', {})] = current
+
+    def entry(key, **fields):
+        return {'name': key[0], 'labels': dict(key[1]), **fields}
+
+    return {
+        'created': time.time(),
+        'pid': os.getpid(),
+        'counters': [entry(key, value=value) for key, value in sorted(counters.items())],
+        'gauges': [entry(key, value=value) for key, value in sorted(gauges.items())],
+        'histograms': [
+            entry(key, count=sum(histogram[:-1]), sum=histogram[-1],
+                  p50=_quantile(histogram, 0.5), p99=_quantile(histogram, 0.99),
+                  buckets=dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], histogram[:-1])))
+            for key, histogram in sorted(histograms.items())
+        ],
+    }
+
+def _labels_text(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{label}="{value}"' for label, value in zip(labels, escaped)) + '}'
+
+def to_prometheus(data):
+    """Render a snapshot() in the Prometheus text exposition format."""
+    lines = []
+    typed = set()
+
+    def declare(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for counter in data['counters']:
+        name = PREFIX + counter['name'] + '_total'
+        declare(name, 'counter')
+        lines.append(f"{name}{_labels_text(counter['labels'])} {counter['value']}")
+    for gauge in data['gauges']:
+        name = PREFIX + gauge['name']
+        declare(name, 'gauge')
+        lines.append(f"{name}{_labels_text(gauge['labels'])} {gauge['value']}")
+    for histogram in data['histograms']:
+        name = PREFIX + histogram['name']
+        declare(name, 'histogram')
+        cumulative = 0
+        for bound, count in histogram['buckets'].items():
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels_text(histogram['labels'], le=bound)} {cumulative}")
+        lines.append(f"{name}_sum{_labels_text(histogram['labels'])} {histogram['sum']}")
+        lines.append(f"{name}_count{_labels_text(histogram['labels'])} {histogram['count']}")
+    return '\n'.join(lines) + '\n'
+
+def _write_atomic(path, text):
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
+def export(json_file=JSON_FILE, prometheus_file=PROMETHEUS_FILE):
+    """
+    Write the metrics to a JSON file and a Prometheus text-format file; does nothing when disabled.
+
+    Args:
+        json_file (str): JSON output, or None to skip (default: 'metrics.json').
+        prometheus_file (str): Prometheus output, or None to skip (default: 'metrics.prom').
+
+    Returns:
+        dict: The exported snapshot, or None when disabled.
+    """
+    if not _enabled:
+        return None
+    data = snapshot()
+    if json_file:
+        _write_atomic(json_file, json.dumps(data, indent=2))
+    if prometheus_file:
+        _write_atomic(prometheus_file, to_prometheus(data))
+    return data
+
+def reset():
+    """Forget everything recorded so far."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _gauges.clear()
+
+def _reset_after_fork():
+    global _lock
+    _lock = threading.Lock()  # May have been held by another thread of the parent
+    _counters.clear()
+    _histograms.clear()
+    _gauges.clear()
+
+# A forked worker starts empty, so what it drains back to its parent is its own work only
+if hasattr(os, 'register_at_fork'):  # Unix only; spawned workers start empty anyway
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,178 @@
+import zlib
+import sqlite3
+import hashlib
+from functools import lru_cache
+import numpy as np
+
+NUM_PERM = 128  # MinHash permutations per signature
+SHINGLE_SIZE = 5  # Words per shingle
+THRESHOLD = 0.8  # Estimated Jaccard similarity at which articles count as near-duplicates
+SEED = 1  # Seed for the permutation coefficients; must stay fixed for a persisted index
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+@lru_cache(maxsize=None)
+def _permutations(num_perm, seed):
+    """Return the (a, b) coefficients of the universal hash permutations."""
+    generator = np.random.RandomState(seed)
+    a = generator.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+    b = generator.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+    return a, b
+
+def shingles(cleaned_body, shingle_size=SHINGLE_SIZE):
+    """Return the set of word shingles of a cleaned body."""
+    words = cleaned_body.split()
+    if len(words) <= shingle_size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)}
+
+def minhash_signature(cleaned_body, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE, seed=SEED):
+    """
+    Compute the MinHash signature of a cleaned body.
+
+    Args:
+        cleaned_body (str): Whitespace-tokenized text, e.g. the 'cleaned_body' field.
+        num_perm (int): Number of permutations (default: 128).
+        shingle_size (int): Words per shingle (default: 5).
+        seed (int): Permutation seed (default: 1).
+
+    Returns:
+        np.ndarray: uint32 signature of length num_perm.
+    """
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode('utf-8')) for shingle in shingles(cleaned_body, shingle_size)),
+        dtype=np.uint64,
+    )
+    a, b = _permutations(num_perm, seed)
+    # a, b and the hashes are all below 2**32, so a * h + b cannot overflow uint64
+    permuted = (np.outer(a, hashes) + b[:, None]) % _MERSENNE_PRIME
+    return (permuted.min(axis=1) & _MAX_HASH).astype(np.uint32)
+
+def lsh_params(threshold, num_perm):
+    """
+    Choose the number of bands and rows per band for an LSH index.
+
+    Minimizes the sum of the false-positive and false-negative areas under the
+    banding S-curve 1 - (1 - s**rows)**bands around the threshold.
+    """
+    step = 0.005
+    similarities = np.arange(step / 2, 1.0, step)
+    below = similarities <= threshold
+    best = None
+    for bands in range(1, num_perm + 1):
+        rows = num_perm // bands
+        curve = 1.0 - (1.0 - similarities ** rows) ** bands  # Probability of sharing a bucket
+        false_positive = curve[below].sum() * step
+        false_negative = (1.0 - curve[~below]).sum() * step
+        error = false_positive + false_negative
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+class NearDuplicateIndex:
+    """
+    Persistent MinHash LSH index of article bodies.
+
+    Signatures are split into bands; each band is hashed into a bucket stored in an
+    indexed SQLite table, so a lookup costs one indexed query per band however many
+    articles are indexed. Candidates sharing a bucket are confirmed by comparing
+    their stored signatures against the threshold.
+
+    Args:
+        path (str): SQLite database file holding the index.
+        threshold (float): Estimated Jaccard similarity for a near-duplicate (default: 0.8).
+        num_perm (int): MinHash permutations (default: 128).
+        shingle_size (int): Words per shingle (default: 5).
+    """
+
+    def __init__(self, path, threshold=THRESHOLD, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS signatures (doc_id TEXT PRIMARY KEY, signature BLOB)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS buckets (band INTEGER, bucket INTEGER, doc_id TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS buckets_lookup ON buckets (band, bucket)")
+
+        # Signatures from different settings are not comparable, so refuse to mix them
+        settings = {'num_perm': num_perm, 'shingle_size': shingle_size, 'seed': SEED,
+                    'bands': self.bands, 'rows': self.rows}
+        stored = dict(self.conn.execute("SELECT key, value FROM meta"))
+        if stored and stored != {key: str(value) for key, value in settings.items()}:
+            raise ValueError(f"{path} was built with different settings: {stored}")
+        self.conn.executemany("INSERT OR IGNORE INTO meta VALUES (?, ?)", [(k, str(v)) for k, v in settings.items()])
+        self.conn.commit()
+
+    def _buckets(self, signature):
+        """Return the bucket key of each band of a signature."""
+        keys = []
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            keys.append(int.from_bytes(hashlib.blake2b(chunk, digest_size=8).digest(), 'little', signed=True))
+        return keys
+
+    def signature(self, cleaned_body):
+        """Compute a signature with this index's settings."""
+        return minhash_signature(cleaned_body, self.num_perm, self.shingle_size)
+
+    def query(self, signature, exclude_id=None):
+        """
+        Find the most similar indexed article at or above the threshold.
+
+        Returns:
+            tuple: (doc_id, estimated Jaccard similarity), or None if there is no near-duplicate.
+        """
+        candidates = set()
+        for band, bucket in enumerate(self._buckets(signature)):
+            rows = self.conn.execute("SELECT doc_id FROM buckets WHERE band = ? AND bucket = ?", (band, bucket))
+            candidates.update(doc_id for (doc_id,) in rows)
+        candidates.discard(exclude_id)  # A record re-read after a crash must not match itself
+
+        best = None
+        for doc_id in sorted(candidates):
+            (blob,) = self.conn.execute("SELECT signature FROM signatures WHERE doc_id = ?", (doc_id,)).fetchone()
+            similarity = float(np.mean(np.frombuffer(blob, dtype=np.uint32) == signature))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (doc_id, similarity)
+        return best
+
+    def add(self, doc_id, signature):
+        """Index an article's signature."""
+        # Re-adding after a crash only leaves duplicate bucket rows, which lookups ignore
+        self.conn.execute("INSERT OR REPLACE INTO signatures VALUES (?, ?)", (doc_id, signature.tobytes()))
+        self.conn.executemany(
+            "INSERT INTO buckets VALUES (?, ?, ?)",
+            [(band, bucket, doc_id) for band, bucket in enumerate(self._buckets(signature))],
+        )
+
+    def check(self, doc_id, cleaned_body, signature=None):
+        """
+        Check an article against the index and index it if it is not a near-duplicate.
+
+        Returns:
+            tuple: (doc_id of the earlier article, similarity) if it is a near-duplicate, else None.
+        """
+        if signature is None:
+            signature = self.signature(cleaned_body)
+        duplicate = self.query(signature, exclude_id=doc_id)
+        if duplicate is None:
+            self.add(doc_id, signature)
+        return duplicate
+
+    def commit(self):
+        """Persist everything added since the last commit."""
+        self.conn.commit()
+
+    def close(self):
+        """Close the database; uncommitted additions are rolled back."""
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,263 @@
+import os
+import sys
+import json
+import sqlite3
+from array import array
+from functools import lru_cache
+from batch_writer import committed_size
+
+INDEX_FILE = 'news_index.db'  # Default location of the inverted index
+BATCH_SIZE = 20000  # Documents per postings segment (and per index transaction)
+POSTINGS_CACHE_SIZE = 4096  # Decoded postings lists kept in memory while querying
+
+def tokenize(text):
+    """Split a cleaned_body into index terms."""
+    return text.split()
+
+def query_terms(phrase):
+    """
+    Turn a phrase (e.g. a customer name) into index terms.
+
+    Normalized like search_names.py does, so a phrase matches where its words
+    appear consecutively in a cleaned_body, i.e. search_names' substring match
+    restricted to whole words.
+    """
+    return tokenize(phrase.lower())
+
+def _encode_postings(postings):
+    """Encode (doc_num, positions) pairs as a flat uint32 array: doc_num, count, positions..."""
+    data = array('I')
+    for doc_num, positions in postings:
+        data.append(doc_num)
+        data.append(len(positions))
+        data.extend(positions)
+    return data.tobytes()
+
+def _decode_postings(blob, into):
+    """Decode a segment blob into a {doc_num: positions} dict."""
+    data = array('I')
+    data.frombytes(blob)
+    i = 0
+    while i < len(data):
+        count = data[i + 1]
+        into[data[i]] = data[i + 2:i + 2 + count]
+        i += 2 + count
+
+class NewsIndex:
+    """
+    Positional inverted index over the cleaned_body of a news JSONL file, stored in SQLite.
+
+    Each document gets a sequential number and its byte offset in the JSONL file.
+    Postings are written in segments: every batch of documents adds one blob per
+    term holding (doc_num, positions) for that batch, so an update only appends
+    and never rewrites existing postings. The index remembers the byte offset it
+    has indexed up to and picks up from there on the next update.
+
+    Args:
+        path (str): SQLite database file holding the index (default: 'news_index.db').
+    """
+
+    def __init__(self, path=INDEX_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS docs (doc_num INTEGER PRIMARY KEY, news_id TEXT, offset INTEGER)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, term_id INTEGER UNIQUE, doc_freq INTEGER)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS postings (term_id INTEGER, segment INTEGER, data BLOB)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS postings_term ON postings (term_id, segment)")
+        self.conn.commit()
+        self._postings = lru_cache(maxsize=POSTINGS_CACHE_SIZE)(self._load_postings)
+
+    def _meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, json.dumps(value)))
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def update(self, jsonl_file, end=None, batch_size=BATCH_SIZE):
+        """
+        Index the documents appended to a JSONL file since the last update.
+
+        Args:
+            jsonl_file (str): News JSONL file with 'id' and 'cleaned_body' fields.
+            end (int): Byte offset to stop at, e.g. the size committed by the ingest
+                checkpoint; defaults to the last complete line in the file.
+            batch_size (int): Documents per postings segment (default: 20000).
+
+        Returns:
+            int: Number of documents added.
+        """
+        source = self._meta('source')
+        if source is not None and source != os.path.abspath(jsonl_file):
+            raise ValueError(f"{self.path} indexes {source}, not {jsonl_file}")
+        offset = self._meta('offset', 0)
+        size = os.path.getsize(jsonl_file)
+        if size < offset:
+            raise ValueError(f"{jsonl_file} is shorter than the indexed offset {offset}; rebuild the index")
+        end = size if end is None else min(end, size)
+
+        doc_num = self.conn.execute("SELECT COALESCE(MAX(doc_num) + 1, 0) FROM docs").fetchone()[0]
+        segment = self.conn.execute("SELECT COALESCE(MAX(segment) + 1, 0) FROM postings").fetchone()[0]
+        added = 0
+        docs, postings = [], {}
+        with open(jsonl_file, 'rb') as f:
+            f.seek(offset)
+            while offset < end:
+                line = f.readline()
+                if not line.endswith(b'\n') or offset + len(line) > end:
+                    break  # Incomplete last line; it is picked up by a later update
+                if line.strip():
+                    news = json.loads(line)
+                    docs.append((doc_num, str(news.get('id')), offset))
+                    positions_by_term = {}
+                    for position, term in enumerate(tokenize(news.get('cleaned_body', ''))):
+                        positions_by_term.setdefault(term, []).append(position)
+                    for term, positions in positions_by_term.items():
+                        postings.setdefault(term, []).append((doc_num, positions))
+                    doc_num += 1
+                offset += len(line)
+                if len(docs) >= batch_size:
+                    self._write_segment(jsonl_file, segment, docs, postings, offset)
+                    added += len(docs)
+                    segment += 1
+                    docs, postings = [], {}
+        if docs or offset != self._meta('offset', 0):
+            self._write_segment(jsonl_file, segment, docs, postings, offset)
+            added += len(docs)
+        return added
+
+    def _write_segment(self, jsonl_file, segment, docs, postings, offset):
+        """Store one batch of documents and its postings in a single transaction."""
+        with self.conn:
+            cursor = self.conn.execute("SELECT COALESCE(MAX(term_id) + 1, 0) FROM terms")
+            next_term_id = cursor.fetchone()[0]
+            term_ids = {}
+            for term, term_postings in postings.items():
+                row = self.conn.execute("SELECT term_id FROM terms WHERE term = ?", (term,)).fetchone()
+                if row is None:
+                    term_ids[term] = next_term_id
+                    self.conn.execute("INSERT INTO terms VALUES (?, ?, ?)", (term, next_term_id, len(term_postings)))
+                    next_term_id += 1
+                else:
+                    term_ids[term] = row[0]
+                    self.conn.execute("UPDATE terms SET doc_freq = doc_freq + ? WHERE term_id = ?", (len(term_postings), row[0]))
+            self.conn.executemany("INSERT INTO docs VALUES (?, ?, ?)", docs)
+            self.conn.executemany(
+                "INSERT INTO postings VALUES (?, ?, ?)",
+                ((term_ids[term], segment, _encode_postings(term_postings)) for term, term_postings in postings.items()),
+            )
+            self._set_meta('source', os.path.abspath(jsonl_file))
+            self._set_meta('offset', offset)
+        self._postings.cache_clear()
+
+    def _load_postings(self, term):
+        """Return {doc_num: positions} for a term across all segments."""
+        postings = {}
+        rows = self.conn.execute(
+            "SELECT data FROM postings JOIN terms USING (term_id) WHERE term = ? ORDER BY segment", (term,)
+        )
+        for (blob,) in rows:
+            _decode_postings(blob, postings)
+        return postings
+
+    def _doc_freq(self, term):
+        row = self.conn.execute("SELECT doc_freq FROM terms WHERE term = ?", (term,)).fetchone()
+        return row[0] if row else 0
+
+    def phrase_docs(self, terms):
+        """
+        Return the doc_nums containing the given terms as a consecutive phrase.
+
+        Args:
+            terms (list): Index terms, e.g. from query_terms().
+
+        Returns:
+            list: Matching doc_nums, ascending.
+        """
+        if not terms:
+            return []
+        # Intersect starting from the rarest term so the candidate set is small from the start
+        order = sorted(range(len(terms)), key=lambda i: self._doc_freq(terms[i]))
+        lists = [self._postings(terms[i]) for i in order]
+        candidates = set(lists[0])
+        for postings in lists[1:]:
+            candidates.intersection_update(postings)
+            if not candidates:
+                return []
+        if len(terms) == 1:
+            return sorted(candidates)
+
+        matches = []
+        for doc_num in sorted(candidates):
+            # Phrase starts: positions p where term i sits at p + i for every i
+            starts = None
+            for i, postings in zip(order, lists):
+                shifted = {position - i for position in postings[doc_num]}
+                starts = shifted if starts is None else starts & shifted
+                if not starts:
+                    break
+            if starts:
+                matches.append(doc_num)
+        return matches
+
+    def search(self, phrase):
+        """Return the news ids whose cleaned_body contains a phrase, in file order."""
+        return self.news_ids(self.phrase_docs(query_terms(phrase)))
+
+    def search_many(self, phrases):
+        """
+        Look up many phrases (e.g. every customer name) at once.
+
+        Returns:
+            dict: phrase -> list of matching news ids, in file order.
+        """
+        return {phrase: self.search(phrase) for phrase in phrases}
+
+    def news_ids(self, doc_nums):
+        """Map doc_nums to news ids."""
+        rows = dict(self._doc_rows(doc_nums, "news_id"))
+        return [rows[doc_num] for doc_num in doc_nums]
+
+    def iter_records(self, jsonl_file, doc_nums):
+        """Yield the full JSONL records of the given doc_nums, read by byte offset."""
+        rows = dict(self._doc_rows(doc_nums, "offset"))
+        with open(jsonl_file, 'rb') as f:
+            for doc_num in doc_nums:
+                f.seek(rows[doc_num])
+                yield json.loads(f.readline())
+
+    def _doc_rows(self, doc_nums, column):
+        doc_nums = list(doc_nums)
+        for i in range(0, len(doc_nums), 900):  # Stay under SQLite's bound parameter limit
+            chunk = doc_nums[i:i + 900]
+            placeholders = ",".join("?" * len(chunk))
+            yield from self.conn.execute(f"SELECT doc_num, {column} FROM docs WHERE doc_num IN ({placeholders})", chunk)
+
+    def close(self):
+        self.conn.close()
+
+def update_from_ingest(jsonl_file, checkpoint_file, index_file=INDEX_FILE):
+    """Index what the ingest step has committed to its output file since the last update."""
+    index = NewsIndex(index_file)
+    try:
+        added = index.update(jsonl_file, end=committed_size(checkpoint_file, jsonl_file))
+        print(f"Indexed {added} new documents ({len(index)} total) into {index_file}")
+    finally:
+        index.close()
+    return added
+
+if __name__ == "__main__":
+    # Update the index from the ingest output, then optionally look up phrases:
+    #   python news_index.py [phrase ...]
+    from handle_duplicates import OUTPUT_FILE, CHECKPOINT_FILE
+
+    update_from_ingest(OUTPUT_FILE, CHECKPOINT_FILE)
+    if len(sys.argv) > 1:
+        index = NewsIndex()
+        for phrase, news_ids in index.search_many(sys.argv[1:]).items():
+            print(f"{phrase}: {len(news_ids)} articles {news_ids[:10]}")
+        index.close()
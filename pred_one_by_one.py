@@ -2,6 +2,8 @@ import pandas as pd
 import time  # Simulating a time-consuming function
 from tqdm import tqdm
 import os
+from chunked_executor import run_chunked, RowFunction
+import metrics
 
 # Sample data and function
 df = pd.DataFrame({'input_column': range(1, 1001)})  # Adjust for actual data
@@ -10,34 +12,36 @@ def some_function(value):
     time.sleep(0.01)  # Replace with your actual processing
     return value * 2
 
-# Log file to keep track of the progress
+# Log file of older runs (one processed index per line); only read to resume them
 log_file = 'progress_log.txt'
 output_file = 'processed_data.csv'
+checkpoint_file = 'processed_data_checkpoint.json'  # Rows done, committed once per chunk
+CHUNK_SIZE = 100  # Rows per batched call and per CSV append
+WORKERS = 8  # Threads; use executor='process' below for CPU-bound functions
 
-# Find the last completed row from the log file
-if os.path.exists(log_file):
-    with open(log_file, 'r') as f:
-        # Get the last processed index from the log file
-        lines = f.readlines()
-        start_index = int(lines[-1].strip()) + 1 if lines else 0
-else:
-    start_index = 0  # Start from the beginning if no log file is found
+def last_logged_index(log_file):
+    """Return the last index in a legacy progress log, reading only its tail, or None."""
+    if not os.path.exists(log_file):
+        return None
+    with open(log_file, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        tail = b''
+        while position > 0 and tail.strip().count(b'\n') < 1:
+            step = min(4096, position)
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+    lines = tail.split()
+    return int(lines[-1]) if lines else None
 
-# Initialize the output CSV file with headers if it doesn't exist
-if not os.path.exists(output_file):
-    # Create a new DataFrame with the same columns as `df` plus `prediction`
-    df.iloc[[0]].assign(prediction=None).to_csv(output_file, index=False)
+# Resume a run started by the old row-by-row script from its log
+last_index = None if os.path.exists(checkpoint_file) else last_logged_index(log_file)
+start_row = 0 if last_index is None else last_index + 1
 
-# Iterate with a progress bar, starting from the last processed index
-for index in tqdm(range(start_index, len(df)), initial=start_index, total=len(df)):
-    row = df.iloc[index]
-    prediction = some_function(row['input_column'])
-
-    # Add the prediction to the row and save it to the output CSV
-    row_with_prediction = row.to_frame().T  # Convert Series to DataFrame for easier appending
-    row_with_prediction['prediction'] = prediction
-    row_with_prediction.to_csv(output_file, mode='a', header=False, index=False)
-
-    # Append the index to the log file after processing each row
-    with open(log_file, 'a') as f:
-        f.write(f"{index}\n")
+# Rows are processed in chunks by a thread pool; each chunk is one CSV append and one checkpoint
+# For a vectorized function pass it directly, e.g. lambda chunk: model.predict(chunk[features])
+with tqdm(total=len(df)) as progress, metrics.stage('predict'):
+    run_chunked(df, RowFunction(some_function, 'input_column'), output_file, checkpoint_file,
+                chunk_size=CHUNK_SIZE, workers=WORKERS, start_row=start_row, progress=progress)
+metrics.export()  # Only when PIPELINE_METRICS=1
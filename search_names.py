@@ -1,6 +1,12 @@
 import os
 import json
+import multiprocessing
 import pandas as pd
+import metrics
+from customer_matcher import load_matcher
+from batch_writer import CheckpointedWriter
+from jsonl_shards import load_manifest, iter_shard_lines
+from columnar import ParquetPartWriter, iter_batches
 
 # Load your customer DataFrame
 # Assuming the DataFrame has columns 'customer_id' and 'customer_name'
@@ -13,6 +19,18 @@ df_customers = pd.DataFrame({
 INPUT_JSONL_FILE = 'path_to_your_huge_jsonl_file.jsonl'  # Path to the large JSONL file
 OUTPUT_FILE = 'identified.jsonl'  # Output file for matches in JSONL format
 PROCESSED_LINES_LOG = 'processed_lines.log'  # Log file to track processed lines for resumption
+MATCHER_CACHE = 'customer_matcher.pkl'  # Compiled customer name automaton, rebuilt when the customer list changes
+WORD_BOUNDARY = False  # Set to True to only match names that are not part of a longer word
+NUM_WORKERS = 1  # Set above 1 to scan byte-range shards of the input in parallel worker processes
+SHARDS_PER_WORKER = 4  # More shards than workers keeps every worker busy until the end
+SHARD_DIR = 'identified_shards'  # Per-shard match output, checkpoints and the shard manifest
+CHECKPOINT_LINES = 10000  # Input lines between shard checkpoints when few lines match
+MERGE_COMMIT_BYTES = 64 << 20  # Bytes of shard output appended to OUTPUT_FILE between merge checkpoints
+NORMALIZED_MATCHES = False  # Set to True to write (news_id, customer_id) pairs instead of full matched records
+INPUT_DATASET = None  # Set to a Parquet dataset (e.g. 'filtered_news.parquet') to read only id and cleaned_body from it
+MATCH_DATASET = 'identified_matches.parquet'  # (news_id, customer_id) match table written from INPUT_DATASET
+MATCH_CHECKPOINT = 'identified_matches_checkpoint.json'  # Committed match parts plus the next input part
+INGEST_CHECKPOINT_FILE = 'ingest_checkpoint.json'  # Only input parts the ingest step has committed are matched
 
 # Function to normalize text (lowercase and strip)
 def normalize_text(text):
@@ -29,7 +47,7 @@ def load_processed_lines():
 # Write last processed line number to the log
 def update_processed_lines(line_number):
     """Write the last processed line number to the log."""
-    with open(PROCESSED_LINES_LOG, 'w') as f:
+    with metrics.io(), open(PROCESSED_LINES_LOG, 'w') as f:
         f.write(f"{line_number}\n")
 
 # Check for exact phrase match of customer name in cleaned_body
@@ -37,44 +55,175 @@ def search_customer_in_news(customer_name, cleaned_body):
     """Check if customer_name appears as an exact phrase in cleaned_body."""
     return customer_name in cleaned_body
 
+# Compile every customer name into one automaton, reusing the cached one when possible
+def build_matcher():
+    """Load the customer name matcher for df_customers."""
+    customer_names = [normalize_text(name) for name in df_customers['customer_name']]
+    return load_matcher(df_customers['customer_id'].tolist(), customer_names, MATCHER_CACHE)
+
+def match_pairs(news_id, cleaned_body, matcher):
+    """Return the normalized (news_id, customer_id) match records of one article."""
+    pairs = [
+        {'news_id': news_id, 'customer_id': matcher.customer_ids[row]}
+        for row in matcher.match_rows(normalize_text(cleaned_body or ''), WORD_BOUNDARY)
+    ]
+    metrics.inc('matches', len(pairs), stage='search')
+    return pairs
+
+def match_news_line(line, matcher, customer_names):
+    """Return the match records for one JSONL line, including all fields of the news object."""
+    news = json.loads(line)
+    metrics.inc('records_in', stage='search')
+    if NORMALIZED_MATCHES:
+        return match_pairs(news.get('id'), news.get('cleaned_body'), matcher)
+    cleaned_body = normalize_text(news.get('cleaned_body', ''))
+    matches = [
+        {**news, 'customer_id': matcher.customer_ids[row], 'customer_name': customer_names[row]}
+        for row in matcher.match_rows(cleaned_body, WORD_BOUNDARY)
+    ]
+    metrics.inc('matches', len(matches), stage='search')
+    return matches
+
 # Process the JSONL file line by line
 def process_jsonl_file():
     """Process the large JSONL file and append matches to output JSONL file."""
     last_processed_line = load_processed_lines()
+    matcher = build_matcher()
+    customer_names = df_customers['customer_name'].tolist()
     
     with open(INPUT_JSONL_FILE, 'r') as input_file, open(OUTPUT_FILE, 'a') as output_file:
-        for line_number, line in enumerate(input_file):
+        for line_number, line in enumerate(metrics.timed_iter(input_file)):
             # Skip lines that have already been processed
             if line_number < last_processed_line:
                 continue
 
-            # Load the JSON object from the line
-            news = json.loads(line.strip())
-            cleaned_body = normalize_text(news.get('cleaned_body', ''))
-            matches = []
-            
-            # Iterate through each customer to check for an exact phrase match
-            for _, customer in df_customers.iterrows():
-                customer_id = customer['customer_id']
-                customer_name = normalize_text(customer['customer_name'])
-                
-                # Check for exact phrase match in the cleaned_body
-                if search_customer_in_news(customer_name, cleaned_body):
-                    # Prepare the matched data by including all fields from the JSON object
-                    match = {
-                        **news,  # Include all fields from the JSON object
-                        'customer_id': customer_id,
-                        'customer_name': customer['customer_name']
-                    }
-                    # Write each matched result as a single line in JSONL format
-                    output_file.write(json.dumps(match) + '\n')
+            # Find every customer name in the cleaned_body in a single pass
+            for match in match_news_line(line.strip(), matcher, customer_names):
+                # Write each matched result as a single line in JSONL format
+                output_file.write(json.dumps(match) + '\n')
 
             # Update the log with the last processed line number
             update_processed_lines(line_number + 1)
 
-def main():
-    # Process the large JSONL file line by line
-    process_jsonl_file()
+def shard_paths(shard_number):
+    """Return the output and checkpoint files of a shard."""
+    base = os.path.join(SHARD_DIR, f"shard_{shard_number:05d}")
+    return base + '.jsonl', base + '.checkpoint.json'
+
+_worker_matcher = None
+
+def init_shard_worker():
+    """Worker initializer: load the matcher once per process (from the cache the parent built)."""
+    global _worker_matcher
+    _worker_matcher = build_matcher()
+
+def scan_shard(task):
+    """
+    Worker task: match one [start, end) byte range of the input into the shard's own output.
+
+    The shard checkpoint records the byte offset of the next unscanned line, so a
+    resumed shard seeks straight to it. Returns the shard number and the worker's
+    metrics for the shard.
+    """
+    shard_number, start, end = task
+    output_file, checkpoint_file = shard_paths(shard_number)
+    customer_names = df_customers['customer_name'].tolist()
+    with CheckpointedWriter(output_file, checkpoint_file) as writer:
+        offset = writer.state.get('offset', start)
+        if offset >= end:
+            return shard_number, metrics.drain()  # Finished in an earlier run
+        lines_since_commit = 0
+        for line, offset in metrics.timed_iter(iter_shard_lines(INPUT_JSONL_FILE, offset, end)):
+            if line.strip():
+                for match in match_news_line(line, _worker_matcher, customer_names):
+                    writer.write(match)
+            lines_since_commit += 1
+            if writer.pending >= writer.batch_size or lines_since_commit >= CHECKPOINT_LINES:
+                writer.commit(offset=offset)
+                lines_since_commit = 0
+        writer.commit(offset=end)
+    return shard_number, metrics.drain()
+
+def merge_shards(num_shards):
+    """
+    Append the shard outputs not merged yet, in shard (i.e. input) order, to OUTPUT_FILE.
+
+    Matches already in OUTPUT_FILE, e.g. from an earlier run over a shorter input,
+    are kept. The merge checkpoint records the committed size of OUTPUT_FILE and
+    the next shard byte to copy. It is first committed before anything is
+    appended, so an interrupted merge is truncated back to the last commit and
+    resumed from there instead of duplicating or losing matches.
+    """
+    checkpoint_file = os.path.join(SHARD_DIR, 'merge_checkpoint.json')
+    with CheckpointedWriter(OUTPUT_FILE, checkpoint_file) as writer:
+        if not writer.state:
+            writer.commit(shard=0, offset=0)  # Record the pre-merge size of OUTPUT_FILE
+        shard_number, offset = writer.state['shard'], writer.state['offset']
+        buffered = 0
+        while shard_number < num_shards:
+            with open(shard_paths(shard_number)[0], 'rb') as shard_file:
+                shard_file.seek(offset)
+                for block in iter(lambda: shard_file.read(1 << 20), b''):
+                    writer.log_bytes(OUTPUT_FILE, block)
+                    offset += len(block)
+                    buffered += len(block)
+                    if buffered >= MERGE_COMMIT_BYTES:
+                        writer.commit(shard=shard_number, offset=offset)
+                        buffered = 0
+            shard_number, offset = shard_number + 1, 0
+        writer.commit(shard=shard_number, offset=0)
+
+def process_jsonl_shards(workers):
+    """
+    Scan the input as newline-aligned byte-range shards in parallel worker processes.
+
+    Each shard writes and checkpoints its matches independently; once every shard
+    is done, the new outputs are appended in input order, so OUTPUT_FILE is
+    identical to a sequential scan's.
+    """
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    shards = load_manifest(os.path.join(SHARD_DIR, 'manifest.json'), INPUT_JSONL_FILE, workers * SHARDS_PER_WORKER)
+    build_matcher()  # Compile and cache the automaton once before the workers load it
+    tasks = [(shard_number, start, end) for shard_number, (start, end) in enumerate(shards)]
+    with multiprocessing.Pool(workers, initializer=init_shard_worker) as pool:
+        for _, worker_metrics in pool.imap_unordered(scan_shard, tasks):
+            metrics.merge(worker_metrics)
+    merge_shards(len(shards))
+
+def process_parquet_dataset():
+    """
+    Match the articles of a Parquet dataset into a normalized (news_id, customer_id) Parquet table.
+
+    Only the id and cleaned_body columns are read, batch by batch. Matches are
+    committed once per input part together with the next part to read, so a
+    restart resumes at the first unfinished part.
+    """
+    matcher = build_matcher()
+    with ParquetPartWriter(MATCH_DATASET, MATCH_CHECKPOINT) as writer:
+        current_part = None
+        batches = iter_batches(INPUT_DATASET, columns=['id', 'cleaned_body'], checkpoint_file=INGEST_CHECKPOINT_FILE,
+                               start_part=writer.state.get('part', 0))
+        for part_number, batch in metrics.timed_iter(batches):
+            if current_part is not None and part_number != current_part:
+                writer.commit(part=part_number)  # Every earlier part is fully matched
+            current_part = part_number
+            metrics.inc('records_in', batch.num_rows, stage='search')
+            for news_id, cleaned_body in zip(batch.column('id').to_pylist(), batch.column('cleaned_body').to_pylist()):
+                for match in match_pairs(news_id, cleaned_body, matcher):
+                    writer.write(match)
+        if current_part is not None:
+            writer.commit(part=current_part + 1)
+
+def main(workers=NUM_WORKERS):
+    with metrics.stage('search'):
+        if INPUT_DATASET:
+            process_parquet_dataset()
+        elif workers > 1:
+            process_jsonl_shards(workers)
+        else:
+            # Process the large JSONL file line by line
+            process_jsonl_file()
+    metrics.export()  # Only when PIPELINE_METRICS=1
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,291 @@
+import os
+import copy
+import time
+import inspect
+import numpy as np
+import torch
+import metrics
+from inference_cache import model_fingerprint
+
+try:
+    import onnxruntime
+except ImportError:  # Optional: only needed for the ONNX Runtime backend
+    onnxruntime = None
+
+BACKENDS = ('torch', 'int8', 'onnx')  # Names accepted by load_backend
+ONNX_FILE = 'sentiment_model.onnx'  # Where the ONNX export is written
+ONNX_OPSET = 17  # ONNX opset used for the export
+INTRA_OP_THREADS = 0  # Threads per operator for int8 / ONNX Runtime; 0 leaves the library default
+PARITY_TOLERANCE = 0.05  # Largest allowed difference in negative probability from fp32
+PARITY_AGREEMENT = 0.99  # Smallest allowed fraction of documents with the same label as fp32
+
+class TorchBackend:
+    """
+    Run a sequence classification model with PyTorch in fp32.
+
+    Backends share one interface: `config` (the model config), `device`,
+    `fingerprint()` for the inference cache, and calling the backend with
+    input_ids and attention_mask tensors returns the logits as a tensor.
+
+    Args:
+        model: Sequence classification model (e.g. DistilBertForSequenceClassification).
+        device (str or torch.device): Device to run on; defaults to CUDA when available.
+    """
+
+    name = 'torch'
+
+    def __init__(self, model, device=None):
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.device = torch.device(device)
+        self.model = model.to(self.device).eval()
+        self.config = model.config
+
+    def fingerprint(self):
+        return model_fingerprint(self.model)
+
+    def __call__(self, input_ids, attention_mask):
+        with torch.inference_mode():
+            return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+class QuantizedBackend(TorchBackend):
+    """
+    Run a model on CPU with its Linear layers dynamically quantized to int8.
+
+    Weights are stored as int8 and activations are quantized on the fly, which
+    cuts the memory and time of the matrix multiplications that dominate a
+    transformer on CPU.
+
+    Args:
+        model: fp32 sequence classification model; it is not modified.
+        threads (int): torch intra-op threads; 0 leaves the current setting (default: 0).
+    """
+
+    name = 'int8'
+
+    def __init__(self, model, threads=INTRA_OP_THREADS):
+        if threads:
+            torch.set_num_threads(threads)
+        self.source_fingerprint = model_fingerprint(model)
+        quantized = torch.ao.quantization.quantize_dynamic(
+            copy.deepcopy(model).to('cpu').eval(), {torch.nn.Linear}, dtype=torch.qint8, inplace=True,
+        )
+        super().__init__(quantized, device='cpu')
+
+    def fingerprint(self):
+        # Packed int8 weights cannot be hashed like a state_dict; scores differ from fp32, so key them apart
+        return f"{self.source_fingerprint}:{self.name}"
+
+class _LogitsOnly(torch.nn.Module):
+    """Wrap a Hugging Face model so the ONNX graph has plain tensor inputs and a logits output."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+class OnnxBackend:
+    """
+    Run a model exported to ONNX with ONNX Runtime on CPU.
+
+    The model is exported once to onnx_file with dynamic batch and sequence
+    axes; an existing export is reused while the model fingerprint it was made
+    from still matches.
+
+    Args:
+        model: fp32 sequence classification model to export.
+        onnx_file (str): Path of the exported model (default: 'sentiment_model.onnx').
+        threads (int): ONNX Runtime intra-op threads; 0 leaves the default (default: 0).
+    """
+
+    name = 'onnx'
+
+    def __init__(self, model, onnx_file=ONNX_FILE, threads=INTRA_OP_THREADS):
+        if onnxruntime is None:
+            raise ImportError("The ONNX backend needs onnxruntime (pip install onnxruntime onnx)")
+        self.device = torch.device('cpu')
+        self.config = model.config
+        self.source_fingerprint = model_fingerprint(model)
+        fingerprint_file = onnx_file + '.fingerprint'
+        exported = None
+        if os.path.exists(onnx_file) and os.path.exists(fingerprint_file):
+            with open(fingerprint_file, 'r') as f:
+                exported = f.read().strip()
+        if exported != self.source_fingerprint:
+            export_onnx(model, onnx_file)
+            with open(fingerprint_file, 'w') as f:
+                f.write(self.source_fingerprint)
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(onnx_file, options, providers=['CPUExecutionProvider'])
+
+    def fingerprint(self):
+        return f"{self.source_fingerprint}:{self.name}"
+
+    def __call__(self, input_ids, attention_mask):
+        logits, = self.session.run(['logits'], {
+            'input_ids': input_ids.cpu().numpy(),
+            'attention_mask': attention_mask.cpu().numpy(),
+        })
+        return torch.from_numpy(logits)
+
+def export_onnx(model, onnx_file=ONNX_FILE):
+    """Export a sequence classification model to ONNX with dynamic batch and sequence axes."""
+    # Tracing leaves state behind on the module it runs, so export a copy and keep the caller's model untouched
+    model = copy.deepcopy(model).to('cpu').eval()
+    example = torch.ones((2, 8), dtype=torch.long)
+    # torch 2.5+ can export through dynamo; keep the TorchScript exporter, which older versions always use
+    options = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+    torch.onnx.export(
+        _LogitsOnly(model), (example, example), onnx_file,
+        input_names=['input_ids', 'attention_mask'], output_names=['logits'],
+        dynamic_axes={'input_ids': {0: 'batch', 1: 'sequence'},
+                      'attention_mask': {0: 'batch', 1: 'sequence'},
+                      'logits': {0: 'batch'}},
+        opset_version=ONNX_OPSET, **options,
+    )
+
+def load_backend(name, model, device=None, threads=INTRA_OP_THREADS, onnx_file=ONNX_FILE):
+    """
+    Create a backend by name.
+
+    Args:
+        name (str): 'torch' (fp32), 'int8' (dynamic quantization) or 'onnx' (ONNX Runtime).
+        model: fp32 sequence classification model.
+        device (str): Device for the 'torch' backend; the others always run on CPU.
+        threads (int): Intra-op threads for 'int8' and 'onnx'; 0 leaves the default.
+        onnx_file (str): Export path for 'onnx'.
+    """
+    if name == 'torch':
+        return TorchBackend(model, device)
+    if name == 'int8':
+        return QuantizedBackend(model, threads)
+    if name == 'onnx':
+        return OnnxBackend(model, onnx_file, threads)
+    raise ValueError(f"Unknown backend {name!r}; expected one of {BACKENDS}")
+
+def parity_check(engine, reference_engine, texts, tolerance=PARITY_TOLERANCE, agreement=PARITY_AGREEMENT):
+    """
+    Compare a backend's scores with the fp32 reference on a held-out set.
+
+    Args:
+        engine (SentimentEngine): Engine running the backend under test.
+        reference_engine (SentimentEngine): Engine running the fp32 TorchBackend.
+        texts (list): Held-out documents.
+        tolerance (float): Largest allowed absolute difference in negative probability.
+        agreement (float): Smallest allowed fraction of documents on the same side of 0.5.
+
+    Returns:
+        dict: max_abs_diff, mean_abs_diff, label_agreement and passed.
+    """
+    scores = np.array(engine.score_documents(texts))
+    reference = np.array(reference_engine.score_documents(texts))
+    diff = np.abs(scores - reference)
+    same_label = float(np.mean((scores >= 0.5) == (reference >= 0.5))) if len(texts) else 1.0
+    max_abs_diff = float(diff.max()) if len(texts) else 0.0
+    return {
+        'max_abs_diff': max_abs_diff,
+        'mean_abs_diff': float(diff.mean()) if len(texts) else 0.0,
+        'label_agreement': same_label,
+        'passed': max_abs_diff <= tolerance and same_label >= agreement,
+    }
+
+def rss_mb():
+    """Resident memory of this process in MB (peak RSS without psutil), or None if unavailable."""
+    current, peak = metrics.rss_bytes()
+    rss = current if current is not None else peak
+    return rss / 2 ** 20 if rss is not None else None
+
+def benchmark(engines, texts, repeats=3):
+    """
+    Measure documents/sec and memory of each engine on the same texts.
+
+    Each engine is warmed up once, then timed over `repeats` passes; the best
+    pass is reported so one-off stalls do not skew the comparison. RSS is the
+    whole process's, so backends loaded earlier still count towards it; run a
+    single backend per process for absolute memory figures.
+
+    Args:
+        engines (dict): Backend name -> SentimentEngine (without an inference cache).
+        texts (list): Documents to score.
+        repeats (int): Timed passes per engine (default: 3).
+
+    Returns:
+        dict: Backend name -> {'docs_per_sec', 'rss_mb'}.
+    """
+    results = {}
+    for name, engine in engines.items():
+        engine.score_documents(texts[:engine.batch_size])  # Warm-up: allocator, ONNX Runtime arenas, kernels
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            engine.score_documents(texts)
+            best = min(best, time.perf_counter() - start)
+        results[name] = {'docs_per_sec': len(texts) / best if best else 0.0, 'rss_mb': rss_mb()}
+    return results
+
+def build_tiny_model(directory, seed=0):
+    """
+    Create a small randomly initialized DistilBERT classifier and fast tokenizer, offline.
+
+    Both are saved to `directory` so they also load with from_pretrained.
+    Intended for testing the backends without downloading a checkpoint.
+
+    Returns:
+        tuple: (model, tokenizer)
+    """
+    from transformers import DistilBertConfig, DistilBertForSequenceClassification, DistilBertTokenizerFast
+
+    os.makedirs(directory, exist_ok=True)
+    words = ("the a of and to in is was for on with as by at from company bank market shares profit loss "
+             "revenue growth strong weak fraud lawsuit fine investigation record rose fell quarter year "
+             "reported said investors customers ceo board deal merger debt default rating upgrade downgrade").split()
+    vocab = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + list('abcdefghijklmnopqrstuvwxyz0123456789.,') + words
+    vocab += ['##' + char for char in 'abcdefghijklmnopqrstuvwxyz0123456789']
+    vocab_file = os.path.join(directory, 'vocab.txt')
+    with open(vocab_file, 'w') as f:
+        f.write('\n'.join(vocab) + '\n')
+    tokenizer = DistilBertTokenizerFast(vocab_file=vocab_file, do_lower_case=True)
+
+    torch.manual_seed(seed)
+    config = DistilBertConfig(
+        vocab_size=len(vocab), dim=32, n_layers=2, n_heads=2, hidden_dim=64, max_position_embeddings=512,
+        id2label={0: 'NEGATIVE', 1: 'POSITIVE'}, label2id={'NEGATIVE': 0, 'POSITIVE': 1},
+    )
+    model = DistilBertForSequenceClassification(config).eval()
+    model.save_pretrained(directory)
+    tokenizer.save_pretrained(directory)
+    return model, tokenizer
+
+if __name__ == "__main__":
+    # Check parity and compare speed of every available backend:
+    #   python sentiment_backends.py [model name or directory]
+    # Without an argument a tiny random DistilBERT is built in ./tiny_distilbert, so this runs offline.
+    import sys
+    import random
+    from transformers import DistilBertTokenizerFast, DistilBertForSequenceClassification
+    from sentiment_engine import SentimentEngine
+
+    if len(sys.argv) > 1:
+        tokenizer = DistilBertTokenizerFast.from_pretrained(sys.argv[1])
+        model = DistilBertForSequenceClassification.from_pretrained(sys.argv[1])
+    else:
+        model, tokenizer = build_tiny_model('tiny_distilbert')
+
+    random.seed(0)
+    vocabulary = "the bank reported a strong quarter but the lawsuit and fraud investigation weighed on shares".split()
+    held_out = [" ".join(random.choices(vocabulary, k=random.randint(5, 400))) for _ in range(200)]
+
+    names = [name for name in BACKENDS if name != 'onnx' or onnxruntime is not None]
+    reference = SentimentEngine(TorchBackend(model, 'cpu'), tokenizer)
+    engines = {name: SentimentEngine(load_backend(name, model, device='cpu'), tokenizer) for name in names}
+    for name, engine in engines.items():
+        print(f"{name}: parity {parity_check(engine, reference, held_out)}")
+    for name, result in benchmark(engines, held_out).items():
+        rss = f"{result['rss_mb']:.0f} MB" if result['rss_mb'] is not None else "unknown"
+        print(f"{name}: {result['docs_per_sec']:.1f} docs/sec, {rss} RSS")
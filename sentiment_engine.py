@@ -0,0 +1,229 @@
+import gc
+import time
+import numpy as np
+import torch
+import metrics
+from inference_cache import window_key
+from sentiment_backends import TorchBackend
+
+try:
+    import psutil
+except ImportError:  # Optional: only used to detect host memory pressure
+    psutil = None
+
+BATCH_SIZE = 32  # Chunks per forward pass
+MAX_LENGTH = 512  # Tokens per window, including [CLS] and [SEP]
+STRIDE = 128  # Tokens shared by consecutive windows of a long document
+DOCS_PER_ROUND = 512  # Documents whose chunks are gathered and length-sorted together
+MEMORY_PRESSURE = 0.9  # Fraction of device (or host) memory in use that triggers GC / cache clearing
+NEGATIVE_LABEL = 'NEGATIVE'  # Model label whose probability is reported
+
+class SentimentEngine:
+    """
+    Batched sentiment inference over many documents.
+
+    Documents are tokenized in rounds, each document once, into overlapping
+    windows of at most max_length tokens, so long articles are scored in full.
+    The windows of a round are sorted by token length so each fixed-size batch
+    pads as little as possible, run through the model's backend (PyTorch
+    under torch.inference_mode by default), and the per-chunk negative probabilities
+    are scattered back to their documents. Memory is only reclaimed (gc and the
+    CUDA cache) when usage crosses MEMORY_PRESSURE, and a CUDA out-of-memory
+    error halves the batch size instead of aborting.
+
+    Args:
+        model: Sequence classification model (e.g. DistilBertForSequenceClassification),
+            or a backend from sentiment_backends (fp32, int8 or ONNX Runtime).
+        tokenizer: Matching fast tokenizer.
+        device (str or torch.device): Device for a plain model; defaults to CUDA when available.
+        batch_size (int): Chunks per forward pass (default: 32).
+        max_length (int): Tokens per window (default: 512).
+        stride (int): Tokens shared by consecutive windows (default: 128).
+        docs_per_round (int): Documents tokenized and bucketed together (default: 512).
+        cache (InferenceCache): Reuse scores of windows seen before and store new ones (default: None).
+    """
+
+    def __init__(self, model, tokenizer, device=None, batch_size=BATCH_SIZE, max_length=MAX_LENGTH,
+                 stride=STRIDE, docs_per_round=DOCS_PER_ROUND, cache=None):
+        if isinstance(model, torch.nn.Module):
+            model = TorchBackend(model, device)
+        self.model = model
+        self.device = model.device
+        if not getattr(tokenizer, 'is_fast', False):
+            raise ValueError("SentimentEngine needs a fast tokenizer (e.g. DistilBertTokenizerFast) to window documents")
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.stride = stride
+        self.special_tokens = tokenizer.num_special_tokens_to_add()
+        if not 0 <= stride < max_length - self.special_tokens:
+            raise ValueError(f"stride must be below the {max_length - self.special_tokens} content tokens of a window")
+        self.docs_per_round = docs_per_round
+        self.cache = cache
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+
+        label2id = {label.upper(): int(index) for label, index in model.config.label2id.items()}
+        if NEGATIVE_LABEL not in label2id:
+            raise ValueError(f"Model has no {NEGATIVE_LABEL} label: {model.config.label2id}")
+        self.negative_index = label2id[NEGATIVE_LABEL]
+
+        self.docs_scored = 0
+        self.chunks_scored = 0
+        self.seconds = 0.0
+
+    def chunk_documents(self, texts):
+        """
+        Split each document into overlapping token ID windows with a single tokenizer pass.
+
+        Returns:
+            list: Per document, its windows (lists of token IDs with special tokens).
+        """
+        texts = list(texts)
+        documents = [[] for _ in texts]
+        # The fast tokenizer emits the overflow windows itself, mapped back to their texts
+        encoded = self.tokenizer(
+            texts, truncation=True, max_length=self.max_length, stride=self.stride,
+            return_overflowing_tokens=True,
+        )
+        for input_ids, document in zip(encoded['input_ids'], encoded['overflow_to_sample_mapping']):
+            documents[document].append(input_ids)
+        return documents
+
+    def aggregate(self, chunks, probabilities):
+        """
+        Combine the window probabilities of one document into its score.
+
+        Each window is weighted by the tokens it adds beyond its overlap with the
+        previous window, so every token of the document counts once.
+        """
+        if not len(probabilities):
+            return 0.0
+        lengths = np.array([len(chunk) - self.special_tokens for chunk in chunks], dtype=np.float64)
+        weights = np.maximum(np.concatenate((lengths[:1], lengths[1:] - self.stride)), 1)
+        return float(np.average(probabilities, weights=weights))
+
+    def _pad(self, chunks):
+        """Pad a batch of token ID lists into input_ids and attention_mask tensors."""
+        width = max(len(chunk) for chunk in chunks)
+        input_ids = torch.full((len(chunks), width), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(chunks), width), dtype=torch.long)
+        for row, chunk in enumerate(chunks):
+            input_ids[row, :len(chunk)] = torch.tensor(chunk, dtype=torch.long)
+            attention_mask[row, :len(chunk)] = 1
+        return input_ids.to(self.device), attention_mask.to(self.device)
+
+    def _forward(self, chunks):
+        """Negative probability of each chunk in one batch."""
+        input_ids, attention_mask = self._pad(chunks)
+        logits = self.model(input_ids, attention_mask)
+        probabilities = torch.softmax(logits.float(), dim=-1)[:, self.negative_index]
+        return probabilities.cpu().numpy()
+
+    def predict_chunks(self, chunks):
+        """
+        Negative probability of every chunk, batched by similar length.
+
+        Chunks found in the inference cache skip the model; the rest are scored
+        and added to it.
+
+        Returns:
+            np.ndarray: One probability per chunk, in input order.
+        """
+        probabilities = np.zeros(len(chunks), dtype=np.float64)
+        to_score = range(len(chunks))
+        if self.cache is not None:
+            keys = [window_key(chunk) for chunk in chunks]
+            cached = self.cache.get_many(keys)
+            to_score = []
+            first_index = {}  # Identical windows within the round are scored once
+            for i, key in enumerate(keys):
+                if key in cached:
+                    probabilities[i] = cached[key]
+                elif key not in first_index:
+                    first_index[key] = i
+                    to_score.append(i)
+
+        order = sorted(to_score, key=lambda i: len(chunks[i]))  # Length buckets minimize padding
+        start = 0
+        while start < len(order):
+            batch = order[start:start + self.batch_size]
+            try:
+                with metrics.timer('sentiment_chunk_seconds'):
+                    probabilities[batch] = self._forward([chunks[i] for i in batch])
+            except torch.cuda.OutOfMemoryError:
+                if self.batch_size == 1:
+                    raise
+                self.batch_size //= 2
+                torch.cuda.empty_cache()
+                print(f"Out of memory; retrying with batch size {self.batch_size}")
+                continue
+            start += len(batch)
+            self._relieve_memory_pressure()
+        self.chunks_scored += len(order)
+        metrics.inc('sentiment_windows', len(order), source='model')
+        metrics.inc('sentiment_windows', len(chunks) - len(order), source='cache')
+
+        if self.cache is not None:
+            self.cache.put_many({keys[i]: probabilities[i] for i in order})
+            for i, key in enumerate(keys):
+                if key not in cached and first_index[key] != i:
+                    probabilities[i] = probabilities[first_index[key]]
+        return probabilities
+
+    def _relieve_memory_pressure(self):
+        """Collect garbage and release cached CUDA blocks, but only when memory is nearly full."""
+        if self.device.type == 'cuda':
+            total = torch.cuda.get_device_properties(self.device).total_memory
+            if torch.cuda.memory_reserved(self.device) > MEMORY_PRESSURE * total:
+                gc.collect()
+                torch.cuda.empty_cache()
+        elif psutil is not None and psutil.virtual_memory().percent > MEMORY_PRESSURE * 100:
+            gc.collect()
+
+    def score_documents(self, texts, progress=None):
+        """
+        Negative probability of every document.
+
+        Args:
+            texts (list): Document texts.
+            progress (tqdm): Optional progress bar, advanced once per document.
+
+        Returns:
+            list: One score per document, in input order.
+        """
+        scores = []
+        for start in range(0, len(texts), self.docs_per_round):
+            round_start = time.perf_counter()
+            documents = self.chunk_documents(texts[start:start + self.docs_per_round])
+            self.seconds += time.perf_counter() - round_start
+            scores.extend(self.score_chunked(documents))
+            if progress is not None:
+                progress.update(len(documents))
+        return scores
+
+    def score_chunked(self, documents):
+        """
+        Negative probability of documents already split by chunk_documents.
+
+        Lets tokenization run elsewhere (e.g. a prefetch thread) while this scores.
+
+        Returns:
+            list: One score per document, in input order.
+        """
+        round_start = time.perf_counter()
+        # Flatten the chunks, remembering which document each belongs to
+        chunks = [chunk for document in documents for chunk in document]
+        probabilities = self.predict_chunks(chunks)
+        scores = []
+        offset = 0
+        for document in documents:
+            scores.append(self.aggregate(document, probabilities[offset:offset + len(document)]))
+            offset += len(document)
+        self.seconds += time.perf_counter() - round_start
+        self.docs_scored += len(documents)
+        metrics.inc('records_in', len(documents), stage='sentiment')
+        return scores
+
+    def throughput(self):
+        """Documents scored per second of engine time so far."""
+        return self.docs_scored / self.seconds if self.seconds else 0.0
@@ -0,0 +1,140 @@
+import json
+import time
+import queue
+import threading
+import metrics
+from batch_writer import CheckpointedWriter, committed_size
+from columnar import ParquetPartWriter, is_dataset, iter_batches
+
+INPUT_FILE = 'filtered_news.jsonl'  # Ingest output to score (JSONL, or a Parquet dataset directory)
+INGEST_CHECKPOINT_FILE = 'ingest_checkpoint.json'  # Only records the ingest step has committed are scored
+OUTPUT_FILE = 'sentiment_scores.jsonl'  # One {'id', 'neg_probability'} line per article; '.parquet' writes a dataset
+CHECKPOINT_FILE = 'sentiment_checkpoint.json'  # Committed output size and input position
+READ_BATCH = 512  # Articles read, tokenized and committed together
+PREFETCH_BATCHES = 4  # Tokenized batches queued ahead of the model
+TEXT_FIELD = 'original_body'  # Field that is scored
+
+_DONE = object()
+
+def iter_record_batches(input_file, offset, batch_size=READ_BATCH, end=None):
+    """
+    Yield batches of JSONL records starting at a byte offset.
+
+    Yields:
+        tuple: (records, byte offset just past the batch's last line).
+    """
+    with open(input_file, 'rb') as f:
+        f.seek(offset)
+        records = []
+        while end is None or offset < end:
+            line = f.readline()
+            if not line.endswith(b'\n') or (end is not None and offset + len(line) > end):
+                break  # Incomplete last line; scored on a later run
+            offset += len(line)
+            if line.strip():
+                records.append(json.loads(line))
+            if len(records) >= batch_size:
+                yield records, offset
+                records = []
+        if records:
+            yield records, offset
+
+def iter_dataset_batches(dataset_dir, columns, start_part=0, start_row=0, batch_size=READ_BATCH,
+                         checkpoint_file=None):
+    """
+    Yield batches of records with only the given columns from a Parquet dataset.
+
+    Yields:
+        tuple: (records, {'part', 'row'} position just past the batch).
+    """
+    row = 0
+    current_part = start_part
+    for part_number, batch in iter_batches(dataset_dir, columns, checkpoint_file, start_part, batch_size):
+        if part_number != current_part:
+            current_part, row = part_number, 0
+        first = row
+        row += batch.num_rows
+        if part_number == start_part and row <= start_row:
+            continue  # Committed by an earlier run
+        if part_number == start_part and first < start_row:
+            batch = batch.slice(start_row - first)
+        yield batch.to_pylist(), {'part': part_number, 'row': row}
+
+def _prefetch(engine, batches, output_queue, text_field):
+    """Producer thread: read and tokenize batches ahead of the model."""
+    try:
+        for records, position in batches:
+            documents = engine.chunk_documents([record.get(text_field) or '' for record in records])
+            output_queue.put((records, documents, position))
+    except BaseException as e:  # Re-raised in the consumer
+        output_queue.put(e)
+        return
+    output_queue.put(_DONE)
+
+def score_stream(engine, input_file=INPUT_FILE, output_file=OUTPUT_FILE, checkpoint_file=CHECKPOINT_FILE,
+                 ingest_checkpoint_file=INGEST_CHECKPOINT_FILE, batch_size=READ_BATCH,
+                 prefetch=PREFETCH_BATCHES, text_field=TEXT_FIELD, progress=None):
+    """
+    Score a news JSONL file incrementally and resumably.
+
+    Records are read in batches from the input's last committed position: a
+    byte offset into a JSONL file, or a (part, row) position in a Parquet
+    dataset, of which only the id and text columns are read. A producer thread
+    tokenizes up to `prefetch` batches ahead while the model scores the current
+    one. Scores are appended to the output (JSONL, or Parquet parts when
+    output_file ends in '.parquet') and committed together with the input
+    position, so memory stays flat and a restart resumes after the last commit.
+
+    Args:
+        engine (SentimentEngine): Engine used for tokenization and scoring.
+        input_file (str): News JSONL or Parquet dataset with 'id' and text_field (default: 'filtered_news.jsonl').
+        output_file (str): Output of {'id', 'neg_probability'} (default: 'sentiment_scores.jsonl').
+        checkpoint_file (str): Checkpoint of the output size and input position.
+        ingest_checkpoint_file (str): Ingest checkpoint bounding how far the input is read.
+        batch_size (int): Articles per batch, and per commit for JSONL output (default: 512).
+        prefetch (int): Tokenized batches queued ahead of the model (default: 4).
+        text_field (str): Field to score (default: 'original_body').
+        progress (tqdm): Optional progress bar, advanced once per article.
+
+    Returns:
+        int: Articles scored in this run.
+    """
+    scored = 0
+    started = time.perf_counter()
+    if output_file.endswith('.parquet'):
+        writer = ParquetPartWriter(output_file, checkpoint_file)  # Parts of up to writer.batch_size scores
+    else:
+        writer = CheckpointedWriter(output_file, checkpoint_file, batch_size=batch_size)
+    with writer, metrics.stage('sentiment'):
+        if is_dataset(input_file):
+            batches = iter_dataset_batches(input_file, ['id', text_field], writer.state.get('part', 0),
+                                           writer.state.get('row', 0), batch_size, ingest_checkpoint_file)
+        else:
+            end = committed_size(ingest_checkpoint_file, input_file)
+            batches = iter_record_batches(input_file, writer.state.get('offset', 0), batch_size, end)
+            batches = ((records, {'offset': offset}) for records, offset in batches)
+
+        prefetched = queue.Queue(maxsize=prefetch)  # Bounded, so reading never runs far ahead
+        batches = metrics.timed_iter(batches)  # Reading and parsing, in the producer thread
+        producer = threading.Thread(target=_prefetch, args=(engine, batches, prefetched, text_field), daemon=True)
+        producer.start()
+        while True:
+            item = prefetched.get()
+            if item is _DONE:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            records, documents, position = item
+            for record, score in zip(records, engine.score_chunked(documents)):
+                writer.write({'id': record.get('id'), 'neg_probability': score})
+            writer.maybe_commit(**position)
+            scored += len(records)
+            if progress is not None:
+                progress.update(len(records))
+        producer.join()
+        if writer.pending:
+            writer.commit(**position)
+
+    elapsed = time.perf_counter() - started
+    print(f"Scored {scored} articles in {elapsed:.1f}s ({scored / elapsed if elapsed else 0:.1f} docs/sec)")
+    return scored
@@ -0,0 +1,227 @@
+import json
+import sqlite3
+import numpy as np
+import pandas as pd
+
+STORE_FILE = 'shap_store.db'  # Default location of the SHAP store
+HASH_KEYS = ('shap_store_row_a', 'shap_store_row_b')  # Two 64-bit row hashes make one 128-bit key
+NO_SEGMENT = ''  # Segment of rows added without one
+TABLES = ('models', 'explanations', 'row_ids', 'aggregates')  # Every table has a 'model' key column
+
+def row_hashes(X):
+    """
+    Content hash of every row of a feature DataFrame, ignoring the index.
+
+    Returns:
+        list: One 16-byte key per row.
+    """
+    X = X.reset_index(drop=True)
+    first, second = (pd.util.hash_pandas_object(X, index=False, hash_key=key).to_numpy() for key in HASH_KEYS)
+    keys = np.empty((len(X), 2), dtype='<u8')
+    keys[:, 0], keys[:, 1] = first, second
+    return [bytes(key) for key in keys]
+
+class ShapStore:
+    """
+    Persistent store of per-row SHAP values for one model, stored in SQLite.
+
+    Explanations are keyed by a content hash of the row, so a row seen on an
+    earlier day (under any row ID) is never explained again. Row IDs map to
+    their current row hash and segment. Per segment, the store keeps the row
+    count and the sum of |SHAP| per feature, updated as rows are added or
+    change, so importance queries never touch the per-row values. Every table
+    is keyed by the model fingerprint and class, so values of other models
+    (e.g. before a retrain) or classes are kept but never read; prune()
+    deletes them.
+
+    Args:
+        model_fingerprint (str): Fingerprint of the model, e.g. Shap_Explain.model_fingerprint().
+        columns (list): Feature names, in the order of the stored values.
+        path (str): SQLite database file (default: 'shap_store.db').
+        class_index (int): Class whose SHAP values are stored (default: 1).
+    """
+
+    def __init__(self, model_fingerprint, columns, path=STORE_FILE, class_index=1):
+        self.model_fingerprint = model_fingerprint
+        self.class_index = class_index
+        self.key = f"{model_fingerprint}:class{class_index}"  # The 'model' column of every table
+        self.columns = [str(column) for column in columns]
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS models (model TEXT PRIMARY KEY, columns TEXT)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS explanations (
+                model TEXT, row_hash BLOB, shap BLOB, PRIMARY KEY (model, row_hash)
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS row_ids (
+                model TEXT, row_id TEXT, row_hash BLOB, segment TEXT, PRIMARY KEY (model, row_id)
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS aggregates (
+                model TEXT, segment TEXT, rows INTEGER, abs_sums BLOB, PRIMARY KEY (model, segment)
+            )
+        """)
+        with self.conn:
+            row = self.conn.execute("SELECT columns FROM models WHERE model = ?", (self.key,)).fetchone()
+            if row is None:
+                self.conn.execute("INSERT INTO models VALUES (?, ?)", (self.key, json.dumps(self.columns)))
+            elif json.loads(row[0]) != self.columns:
+                raise ValueError(f"{path} holds SHAP values for columns {json.loads(row[0])}, not {self.columns}")
+
+    def _select(self, sql, keys, *params):
+        """Run `sql` (ending in 'IN ') for many keys, staying under SQLite's bound parameter limit."""
+        keys = list(keys)
+        for i in range(0, len(keys), 900):
+            chunk = keys[i:i + 900]
+            yield from self.conn.execute(sql + f"({','.join('?' * len(chunk))})", list(params) + chunk)
+
+    def _decode(self, blob):
+        return np.frombuffer(blob, dtype=np.float64)
+
+    def missing(self, hashes):
+        """Return the set of row hashes that have not been explained yet."""
+        unique = set(hashes)
+        found = {row_hash for row_hash, in self._select(
+            "SELECT row_hash FROM explanations WHERE model = ? AND row_hash IN ", unique, self.key)}
+        return unique - found
+
+    def values(self, hashes):
+        """SHAP matrix (rows x features) of stored row hashes, in the given order."""
+        by_hash = dict(self._select(
+            "SELECT row_hash, shap FROM explanations WHERE model = ? AND row_hash IN ", set(hashes),
+            self.key))
+        matrix = np.empty((len(hashes), len(self.columns)), dtype=np.float64)
+        for i, row_hash in enumerate(hashes):
+            matrix[i] = self._decode(by_hash[row_hash])
+        return matrix
+
+    def add(self, row_ids, hashes, new_values=None, segments=None):
+        """
+        Record rows and update the aggregates.
+
+        Args:
+            row_ids (list): Row IDs.
+            hashes (list): row_hashes() of the rows, aligned with row_ids.
+            new_values (dict): row hash -> SHAP vector for hashes reported by missing().
+            segments (list): Segment of each row (e.g. region or product); None for no segmentation.
+
+        Returns:
+            int: Row IDs that were new or changed.
+        """
+        new_values = new_values or {}
+        row_ids = [str(row_id) for row_id in row_ids]
+        segments = [NO_SEGMENT if segment is None else str(segment) for segment in segments or [None] * len(row_ids)]
+        known = {row_id: (row_hash, segment) for row_id, row_hash, segment in self._select(
+            "SELECT row_id, row_hash, segment FROM row_ids WHERE model = ? AND row_id IN ", set(row_ids),
+            self.key)}
+
+        changes = []  # (row_id, old (hash, segment) or None, new (hash, segment))
+        for row_id, row_hash, segment in zip(row_ids, hashes, segments):
+            old = known.get(row_id)
+            if old != (row_hash, segment):
+                changes.append((row_id, old, (row_hash, segment)))
+                known[row_id] = (row_hash, segment)  # A row ID repeated in one call counts once
+        if not changes:
+            return 0
+
+        needed = {state[0] for _, old, new in changes for state in (old, new) if state is not None} - set(new_values)
+        stored = {row_hash: self._decode(blob) for row_hash, blob in self._select(
+            "SELECT row_hash, shap FROM explanations WHERE model = ? AND row_hash IN ", needed,
+            self.key)}
+        stored.update((row_hash, np.asarray(vector, dtype=np.float64)) for row_hash, vector in new_values.items())
+
+        deltas = {}  # segment -> [row count change, |SHAP| sum change]
+        for _, old, new in changes:
+            for state, sign in ((old, -1), (new, 1)):  # Move the row out of its old segment and into its new one
+                if state is None:
+                    continue
+                row_hash, segment = state
+                delta = deltas.setdefault(segment, [0, np.zeros(len(self.columns))])
+                delta[0] += sign
+                delta[1] += sign * np.abs(stored[row_hash])
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO explanations VALUES (?, ?, ?)",
+                ((self.key, row_hash, np.asarray(vector, dtype=np.float64).tobytes())
+                 for row_hash, vector in new_values.items()),
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO row_ids VALUES (?, ?, ?, ?)",
+                ((self.key, row_id, row_hash, segment) for row_id, _, (row_hash, segment) in changes),
+            )
+            for segment, (rows, abs_sums) in deltas.items():
+                row = self.conn.execute(
+                    "SELECT rows, abs_sums FROM aggregates WHERE model = ? AND segment = ?",
+                    (self.key, segment),
+                ).fetchone()
+                if row is not None:
+                    rows += row[0]
+                    abs_sums = abs_sums + self._decode(row[1])
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO aggregates VALUES (?, ?, ?, ?)",
+                    (self.key, segment, rows, abs_sums.tobytes()),
+                )
+        return len(changes)
+
+    def _aggregates(self):
+        rows = self.conn.execute(
+            "SELECT segment, rows, abs_sums FROM aggregates WHERE model = ? AND rows > 0", (self.key,))
+        return [(segment, count, self._decode(blob)) for segment, count, blob in rows]
+
+    def global_importance(self):
+        """Mean |SHAP| per feature over every stored row ID, largest first."""
+        aggregates = self._aggregates()
+        rows = sum(count for _, count, _ in aggregates)
+        abs_sums = sum((sums for _, _, sums in aggregates), np.zeros(len(self.columns)))
+        importance = pd.Series(abs_sums / rows if rows else abs_sums, index=self.columns)
+        return importance.sort_values(ascending=False, kind='stable')
+
+    def segment_importance(self):
+        """Mean |SHAP| per feature (columns) for each segment (rows), plus the segment's row count."""
+        aggregates = self._aggregates()
+        importance = pd.DataFrame(
+            [sums / count for _, count, sums in aggregates],
+            index=pd.Index([segment for segment, _, _ in aggregates], name='segment'),
+            columns=self.columns,
+        )
+        importance.insert(0, 'rows', [count for _, count, _ in aggregates])
+        return importance
+
+    def top_contributors(self, row_id, n=3):
+        """
+        The n features with the largest |SHAP| for one row ID.
+
+        Returns:
+            list: (feature, SHAP value) pairs, largest |SHAP| first.
+        """
+        row = self.conn.execute(
+            "SELECT shap FROM row_ids JOIN explanations USING (model, row_hash) WHERE model = ? AND row_id = ?",
+            (self.key, str(row_id)),
+        ).fetchone()
+        if row is None:
+            raise KeyError(row_id)
+        values = self._decode(row[0])
+        order = np.argsort(-np.abs(values), kind='stable')[:n]
+        return [(self.columns[i], float(values[i])) for i in order]
+
+    def prune(self):
+        """
+        Delete the rows of every other model and class, e.g. once a retrained model has replaced the old one.
+
+        Returns:
+            int: Rows deleted across all tables.
+        """
+        deleted = 0
+        with self.conn:
+            for table in TABLES:
+                deleted += self.conn.execute(f"DELETE FROM {table} WHERE model != ?", (self.key,)).rowcount
+        return deleted
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM row_ids WHERE model = ?", (self.key,)).fetchone()[0]
+
+    def close(self):
+        self.conn.close()
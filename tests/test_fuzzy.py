@@ -0,0 +1,99 @@
+import pandas as pd
+import pytest
+from rapidfuzz import fuzz
+
+from fuzzy import NGRAM_SIZE, NgramIndex, compare_with_brute_force, fuzzy_join_blocked, fuzzy_join_datasets
+
+def frames():
+    df1 = pd.DataFrame({
+        'id': [1, 2, 3, 4, 5, 6, 7, 8],
+        'name': ['Alice Johnson', 'Bob Smith', 'ab', 'Acme Corp', 'x', 'Bob Smith', 'Zed', 'Acme Corp.'],
+    })
+    df2 = pd.DataFrame({
+        'id': ['A', 'B', 'C', 'D', 'E', 'F', 'G'],
+        # 'Acme Corp' ties between C and D (identical), 'ab' and 'x' are shorter than an n-gram
+        'name': ['Alice Jonson', 'Bobby Smith', 'Acme Corp', 'Acme Corp', 'ab', 'x', 'Zedd'],
+    })
+    return df1, df2
+
+def test_frames_cover_short_strings():
+    df1, df2 = frames()
+    assert any(len(value) < NGRAM_SIZE for value in df1['name'])
+    assert any(len(value) < NGRAM_SIZE for value in df2['name'])
+
+@pytest.mark.parametrize('scorer', [fuzz.ratio, fuzz.token_sort_ratio])
+@pytest.mark.parametrize('threshold', [0, 50, 80])
+@pytest.mark.parametrize('max_candidates', [None, 500])
+def test_blocked_join_equals_brute_force(scorer, threshold, max_candidates):
+    df1, df2 = frames()
+    brute = fuzzy_join_datasets(df1, df2, 'name', 'name', 'id', 'id', scorer, threshold)
+    blocked = fuzzy_join_blocked(df1, df2, 'name', 'name', 'id', 'id', scorer, threshold,
+                                 max_candidates=max_candidates)
+    pd.testing.assert_frame_equal(blocked, brute, check_dtype=False)
+    assert compare_with_brute_force(df1, df2, 'name', 'name', 'id', 'id', scorer, threshold,
+                                    max_candidates=max_candidates).empty
+
+def test_ties_go_to_the_earlier_row():
+    df1, df2 = frames()
+    result = fuzzy_join_blocked(df1, df2, 'name', 'name', 'id', 'id', fuzz.ratio, 80)
+    assert result.loc[result['id_df1'] == 4, 'id_df2'].tolist() == ['C']
+
+def test_blocked_join_with_workers(monkeypatch):
+    import fuzzy
+    monkeypatch.setattr(fuzzy, 'JOIN_CHUNK_SIZE', 2)
+    df1, df2 = frames()
+    brute = fuzzy_join_datasets(df1, df2, 'name', 'name', 'id', 'id', fuzz.ratio, 50)
+    blocked = fuzzy_join_blocked(df1, df2, 'name', 'name', 'id', 'id', fuzz.ratio, 50, workers=2, max_pairs=3)
+    pd.testing.assert_frame_equal(blocked, brute, check_dtype=False)
+
+def test_missing_values_never_match(tmp_path):
+    df1, df2 = frames()
+    df1.loc[len(df1)] = [9, float('nan')]
+    df1.loc[len(df1)] = [10, float('nan')]
+    df2.loc[len(df2)] = ['H', float('nan')]
+    brute = fuzzy_join_datasets(df1, df2, 'name', 'name', 'id', 'id', fuzz.ratio, 50)
+    blocked = fuzzy_join_blocked(df1, df2, 'name', 'name', 'id', 'id', fuzz.ratio, 50)
+    pd.testing.assert_frame_equal(blocked, brute, check_dtype=False)
+    assert not blocked['id_df1'].isin([9, 10]).any()
+
+    # An all-missing column is float64, and tolist() returns a distinct NaN object per row
+    empty = pd.DataFrame({'id': [1, 2], 'name': [float('nan'), float('nan')]})
+    assert fuzzy_join_blocked(empty, df2, 'name', 'name', 'id', 'id', fuzz.ratio, 50).empty
+
+    # A cached match of the string 'nan' must not be reused for a missing value
+    from match_cache import MatchCache
+
+    cache = MatchCache(str(tmp_path / 'match_cache.db'))
+    targets = pd.DataFrame({'id': ['N'], 'name': ['nan']})
+    strings = pd.DataFrame({'id': [1], 'name': ['nan']})
+    assert len(fuzzy_join_blocked(strings, targets, 'name', 'name', 'id', 'id', cache=cache)) == 1
+    assert fuzzy_join_blocked(empty, targets, 'name', 'name', 'id', 'id', cache=cache).empty
+    cache.close()
+
+def test_cache_keeps_every_reference_list(tmp_path):
+    from match_cache import MatchCache
+
+    df1, df2 = frames()
+    other_df2 = df2.iloc[::-1].reset_index(drop=True)
+    cache = MatchCache(str(tmp_path / 'match_cache.db'))
+    expected = fuzzy_join_blocked(df1, df2, 'name', 'name', 'id', 'id', cache=cache)
+    fuzzy_join_blocked(df1, other_df2, 'name', 'name', 'id', 'id', cache=cache)  # Same namespace, new fingerprint
+    hits = cache.hits
+    cached = fuzzy_join_blocked(df1, df2, 'name', 'name', 'id', 'id', cache=cache)
+    assert cache.hits - hits == df1['name'].nunique()  # Nothing was evicted by the second join
+    pd.testing.assert_frame_equal(cached, expected)
+    cache.close()
+
+def test_short_query_respects_max_candidates():
+    index = NgramIndex(['abcdef', 'ab', 'abcd', 'x', 'abcdefgh', 'xy'])
+    assert index.candidates('ab').tolist() == list(range(6))
+    assert index.candidates('ab', max_candidates=3).tolist() == [1, 3, 5]  # Closest in length, ascending
+
+def test_cache_keys_keep_the_source_type(tmp_path):
+    from match_cache import MatchCache
+
+    cache = MatchCache(str(tmp_path / 'match_cache.db'))
+    cache.put_many('job', 'fp', 'scorer', {1: 'int'})
+    assert cache.get_many('job', 'fp', 'scorer', ['1']) == {}
+    assert cache.get_many('job', 'fp', 'scorer', [1]) == {1: 'int'}
+    cache.close()
@@ -0,0 +1,42 @@
+import json
+import os
+
+import pytest
+
+import handle_duplicates
+from dedup_index import KEY_SIZE
+
+WORDS = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'theta', 'kappa', 'lambda', 'sigma', 'omega', 'rho']
+
+def article(record_id):
+    # Distinct words per article so near-duplicate detection stays out of the way
+    n = int(record_id)
+    return {'newsReferenceId': record_id, 'body': ' '.join(f"{word}{n}" for word in WORDS)}
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # main() uses paths relative to the working directory
+    os.mkdir('path_to_your_json_files')
+    return tmp_path
+
+def write_input(name, ids):
+    with open(os.path.join('path_to_your_json_files', name), 'w') as f:
+        json.dump([article(record_id) for record_id in ids], f)
+
+def output_ids():
+    with open(handle_duplicates.OUTPUT_FILE, 'r') as f:
+        return [json.loads(line)['id'] for line in f]
+
+def test_legacy_id_log_is_migrated(workdir):
+    with open(handle_duplicates.PROCESSED_IDS_LOG, 'w') as f:
+        f.write("1\n2\n")
+    write_input('a.json', ['1', '2', '3'])
+    handle_duplicates.main(workers=1)
+    assert output_ids() == ['3']  # Legacy IDs are not written again
+    assert os.path.getsize(handle_duplicates.PROCESSED_IDS_INDEX + '.keys') == 3 * KEY_SIZE
+
+    # A later run keeps using the index and does not migrate the legacy log twice
+    write_input('b.json', ['1', '3', '4'])
+    handle_duplicates.main(workers=1)
+    assert output_ids() == ['3', '4']
+    assert os.path.getsize(handle_duplicates.PROCESSED_IDS_INDEX + '.keys') == 4 * KEY_SIZE
@@ -0,0 +1,108 @@
+import pytest
+
+import metrics
+
+@pytest.fixture
+def recording(monkeypatch):
+    monkeypatch.setenv(metrics.METRICS_ENV, '0')  # Restored after the test
+    metrics.reset()
+    metrics.enable()
+    yield
+    metrics.enable(False)
+    metrics.reset()
+
+def by_name(entries, name):
+    return {tuple(sorted(entry['labels'].items())): entry for entry in entries if entry['name'] == name}
+
+def test_disabled_records_nothing(monkeypatch):
+    monkeypatch.setenv(metrics.METRICS_ENV, '0')
+    metrics.enable(False)
+    metrics.inc('records_in', stage='ingest')
+    metrics.observe('clean_text_seconds', 0.1)
+    assert metrics.drain() is None
+    assert metrics.export() is None
+
+def test_inc_and_observe(recording):
+    metrics.inc('records_in', stage='ingest')
+    metrics.inc('records_in', 2, stage='ingest')
+    metrics.inc('records_dropped', stage='ingest', reason='too_short')
+    for seconds in (0.0001, 0.0002, 0.003, 100.0):
+        metrics.observe('clean_text_seconds', seconds)
+    data = metrics.snapshot()
+
+    counters = by_name(data['counters'], 'records_in')
+    assert counters[(('stage', 'ingest'),)]['value'] == 3
+    assert by_name(data['counters'], 'records_dropped')[(('reason', 'too_short'), ('stage', 'ingest'))]['value'] == 1
+    histogram = by_name(data['histograms'], 'clean_text_seconds')[()]
+    assert histogram['count'] == 4
+    assert histogram['sum'] == pytest.approx(100.0033)
+    assert histogram['p50'] == 0.00025  # Upper bound of the bucket holding the median
+    assert histogram['p99'] == metrics.LATENCY_BUCKETS[-1]  # Above every bucket
+    assert histogram['buckets']['+Inf'] == 1
+
+def test_timer_skips_failed_blocks(recording):
+    with metrics.timer('shap_chunk_seconds', step='explain'):
+        pass
+    with pytest.raises(RuntimeError):
+        with metrics.timer('shap_chunk_seconds', step='explain'):
+            raise RuntimeError
+    histogram = by_name(metrics.snapshot()['histograms'], 'shap_chunk_seconds')[(('step', 'explain'),)]
+    assert histogram['count'] == 1
+
+def test_stage_io_and_compute(recording):
+    with metrics.stage('ingest'):
+        with metrics.stage('ingest'):  # Re-entering the current stage does nothing
+            with metrics.io():
+                pass
+        assert metrics.current_stage() == 'ingest'
+    assert metrics.current_stage() == metrics.NO_STAGE
+    counters = metrics.snapshot()['counters']
+    wall = by_name(counters, 'stage_seconds')[(('stage', 'ingest'),)]['value']
+    io = by_name(counters, 'stage_io_seconds')[(('stage', 'ingest'),)]['value']
+    compute = by_name(counters, 'stage_compute_seconds')[(('stage', 'ingest'),)]['value']
+    assert 0 <= io <= wall
+    assert compute == pytest.approx(wall - io)
+
+def test_drain_and_merge(recording):
+    metrics.inc('records_in', 5, stage='search')
+    metrics.inc('stage_io_seconds', 2.0, stage='search')
+    metrics.observe('customer_search_seconds', 0.001)
+    worker = metrics.drain()
+    assert metrics.snapshot()['counters'] == []  # drain() resets
+    assert metrics.drain()['counters'] == {}
+
+    metrics.inc('records_in', 1, stage='search')
+    metrics.inc('stage_seconds', 1.0, stage='search')
+    metrics.merge(worker)
+    metrics.merge(worker)
+    data = metrics.snapshot()
+    assert by_name(data['counters'], 'records_in')[(('stage', 'search'),)]['value'] == 11
+    # Worker I/O overlaps this process's wall clock, so it is kept apart from stage_io_seconds
+    assert by_name(data['counters'], 'worker_io_seconds')[(('stage', 'search'),)]['value'] == 4.0
+    assert (('stage', 'search'),) not in by_name(data['counters'], 'stage_io_seconds')
+    assert by_name(data['counters'], 'stage_compute_seconds')[(('stage', 'search'),)]['value'] == 1.0
+    assert by_name(data['histograms'], 'customer_search_seconds')[()]['count'] == 2
+    if worker['peak_rss'] is not None:
+        assert by_name(data['gauges'], 'worker_peak_resident_memory_bytes')[()]['value'] == worker['peak_rss']
+
+def test_prometheus_output(recording, tmp_path):
+    metrics.inc('records_dropped', 2, stage='ingest', reason='dup "id"')
+    metrics.set_gauge('queue_depth', 3)
+    metrics.observe('clean_text_seconds', 0.00002)
+    metrics.observe('clean_text_seconds', 0.5)
+    data = metrics.export(str(tmp_path / 'metrics.json'), str(tmp_path / 'metrics.prom'))
+    text = (tmp_path / 'metrics.prom').read_text()
+    assert text == metrics.to_prometheus(data)
+    lines = text.splitlines()
+
+    assert '# TYPE pipeline_records_dropped_total counter' in lines
+    assert 'pipeline_records_dropped_total{reason="dup \\"id\\"",stage="ingest"} 2' in lines
+    assert '# TYPE pipeline_queue_depth gauge' in lines
+    assert 'pipeline_queue_depth 3' in lines
+    assert '# TYPE pipeline_clean_text_seconds histogram' in lines
+    assert 'pipeline_clean_text_seconds_bucket{le="1e-05"} 0' in lines
+    assert 'pipeline_clean_text_seconds_bucket{le="2.5e-05"} 1' in lines  # Buckets are cumulative
+    assert 'pipeline_clean_text_seconds_bucket{le="0.5"} 2' in lines
+    assert 'pipeline_clean_text_seconds_bucket{le="+Inf"} 2' in lines
+    assert 'pipeline_clean_text_seconds_count 2' in lines
+    assert sum(line.startswith('# TYPE pipeline_clean_text_seconds ') for line in lines) == 1
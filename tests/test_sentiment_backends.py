@@ -0,0 +1,34 @@
+import random
+
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('transformers')
+
+import sentiment_backends
+from sentiment_backends import PARITY_AGREEMENT, PARITY_TOLERANCE, TorchBackend, build_tiny_model, load_backend, parity_check
+from sentiment_engine import SentimentEngine
+
+@pytest.fixture(scope='module')
+def tiny(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('tiny_distilbert')
+    model, tokenizer = build_tiny_model(str(directory))
+    return directory, model, tokenizer
+
+@pytest.fixture(scope='module')
+def held_out():
+    rng = random.Random(0)
+    vocabulary = "the bank reported a strong quarter but the lawsuit and fraud investigation weighed on shares".split()
+    return [" ".join(rng.choices(vocabulary, k=rng.randint(5, 300))) for _ in range(40)]
+
+@pytest.mark.parametrize('name, tolerance', [('int8', PARITY_TOLERANCE), ('onnx', 1e-4)])
+def test_backend_probabilities_match_fp32(tiny, held_out, name, tolerance):
+    if name == 'onnx' and sentiment_backends.onnxruntime is None:
+        pytest.skip('onnxruntime is not installed')
+    directory, model, tokenizer = tiny
+    reference = SentimentEngine(TorchBackend(model, 'cpu'), tokenizer)
+    backend = load_backend(name, model, device='cpu', onnx_file=str(directory / 'model.onnx'))
+    result = parity_check(SentimentEngine(backend, tokenizer), reference, held_out, tolerance=tolerance)
+    assert result['max_abs_diff'] <= tolerance
+    assert result['label_agreement'] >= PARITY_AGREEMENT
+    assert result['passed']
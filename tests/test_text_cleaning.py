@@ -0,0 +1,24 @@
+import json
+import os
+
+import pytest
+
+import text_cleaning
+
+FIXTURE_FILE = os.path.join(os.path.dirname(__file__), 'fixtures', 'clean_text_baseline.json')
+
+with open(FIXTURE_FILE, encoding='utf-8') as f:
+    BASELINE = json.load(f)  # Outputs of the original word_tokenize + stopwords pipeline
+
+@pytest.mark.parametrize('case', BASELINE, ids=range(len(BASELINE)))
+def test_clean_text_matches_baseline(case):
+    assert text_cleaning.clean_text(case['text']) == case['cleaned']
+
+def test_nltk_parity():
+    nltk = pytest.importorskip('nltk')
+    try:
+        nltk.word_tokenize('a. b.')
+        nltk.corpus.stopwords.words('english')
+    except LookupError:
+        pytest.skip('NLTK Punkt or stopwords data is not installed')
+    assert text_cleaning.parity_mismatches([case['text'] for case in BASELINE]) == []
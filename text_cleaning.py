@@ -0,0 +1,258 @@
+import re
+import sys
+from functools import lru_cache
+import metrics
+
+# NLTK's English stopword list, bundled so cleaning never needs a download
+STOPWORDS = frozenset("""
+i me my myself we our ours ourselves you you're you've you'll you'd your yours yourself
+yourselves he him his himself she she's her hers herself it it's its itself they them their
+theirs themselves what which who whom this that that'll these those am is are was were be
+been being have has had having do does did doing a an the and but if or because as until
+while of at by for with about against between into through during before after above below
+to from up down in out on off over under again further then once here there when where why
+how all any both each few more most other some such no nor not only own same so than too
+very s t can will just don don't should should've now d ll m o re ve y ain aren aren't
+couldn couldn't didn didn't doesn doesn't hadn hadn't hasn hasn't haven haven't isn isn't ma
+mightn mightn't mustn mustn't needn needn't shan shan't shouldn shouldn't wasn wasn't weren
+weren't won won't wouldn wouldn't
+""".split())
+
+# Abbreviations Punkt does not treat as sentence ends (a subset of its English model, so
+# the bundled port can differ from NLTK on rarer abbreviations)
+ABBREVIATIONS = frozenset("""
+mr mrs ms dr prof rev gen gov sen rep col lt sgt capt cmdr adm maj messrs jr sr st mt ft
+inc corp co ltd bros cos dept vs
+jan feb aug sept oct nov dec
+calif fla ill mass mich minn conn ariz colo ga ky la md mo nev ore pa tenn tex va wash wis
+okla ala ark kan neb vt wyo
+""".split())
+
+# --- Sentence-end detection (mirrors Punkt on lowercased text) ---
+
+_NON_WORD = r"""[)\";}\]\*:@\'\({\[!?]"""
+_MULTI_CHAR = r"(?:\-{2,}|\.{2,}|(?:\.\s){2,}\.)"
+_PERIOD_CONTEXT = re.compile(r"[.?!](?=(?P<after_tok>%s|\s+(?P<next_tok>\S+)))" % _NON_WORD)
+_PUNKT_WORD = re.compile(r"""(
+    %(MultiChar)s
+    |
+    (?=[^\(\"\`{\[:;&\#\*@\)}\]\-,])\S+?
+    (?=\s|$|%(NonWord)s|%(MultiChar)s|,(?=$|\s|%(NonWord)s|%(MultiChar)s))
+    |
+    \S
+)""" % {'NonWord': _NON_WORD, 'MultiChar': _MULTI_CHAR}, re.UNICODE | re.VERBOSE)
+_BOUNDARY_REALIGNMENT = re.compile(r'["\')\]}]+?(?:\s+|(?=--)|$)', re.MULTILINE)
+_ELLIPSIS = re.compile(r"\.\.+$")
+_INITIAL = re.compile(r"[^\W\d]\.$")
+_NUMBER = re.compile(r"^-?[\.,]?\d[\d,\.-]*\.?$")
+_PUNKT_PUNCTUATION = tuple(';:,.!?')
+_WHITESPACE = ' \t\n\r\x0b\x0c'
+
+def _is_sentbreak(token, next_token):
+    """Decide whether a Punkt token ends a sentence, given the token after it."""
+    if token in ('.', '?', '!'):
+        return True
+    if not token.endswith('.') or token.endswith('..') or _ELLIPSIS.match(token):
+        return False
+    core = token[:-1]
+    if core in ABBREVIATIONS or core.split('-')[-1] in ABBREVIATIONS:
+        return False  # A lowercase next word never re-opens a break after an abbreviation
+    if _INITIAL.match(token) or _NUMBER.match(token):
+        # Orthographic heuristic: punctuation or a lowercase word next means no break
+        return not (next_token in _PUNKT_PUNCTUATION or next_token[:1].islower())
+    return True
+
+def _contains_sentbreak(context):
+    """True if any token but the last in a candidate context ends a sentence."""
+    tokens = _PUNKT_WORD.findall(context)
+    return any(_is_sentbreak(token, tokens[i + 1]) for i, token in enumerate(tokens[:-1]))
+
+def _last_whitespace_index(text):
+    """Index of the last ASCII whitespace character in text, or 0 if there is none."""
+    return max(0, max(text.rfind(char) for char in _WHITESPACE))
+
+def _potential_end_contexts(text):
+    """Yield (match, context) for candidate sentence ends, keeping only the last one per word."""
+    previous_start = previous_stop = 0
+    previous_match = None
+    for match in _PERIOD_CONTEXT.finditer(text):
+        index = _last_whitespace_index(text[previous_stop:match.start()])
+        word_start = previous_stop + index + 1 if index else previous_start
+        if previous_match and previous_stop <= word_start:
+            yield previous_match, text[previous_start:previous_stop] + previous_match.group() + previous_match.group('after_tok')
+        previous_match, previous_start, previous_stop = match, word_start, match.start()
+    if previous_match:
+        yield previous_match, text[previous_start:previous_stop] + previous_match.group() + previous_match.group('after_tok')
+
+def split_sentences(text):
+    """Split text into sentences the way NLTK's sent_tokenize does for lowercased text."""
+    if '.' not in text and '?' not in text and '!' not in text:
+        return [text.rstrip()] if text.strip() else []
+    slices = []
+    last_break = 0
+    for match, context in _potential_end_contexts(text):
+        if _contains_sentbreak(context):
+            slices.append([last_break, match.end()])
+            last_break = match.start('next_tok') if match.group('next_tok') else match.end()
+    slices.append([last_break, len(text.rstrip())])
+
+    # Move closing quotes and brackets that start a sentence back onto the previous one
+    sentences = []
+    for first, second in zip(slices, slices[1:] + [None]):
+        if second:
+            m = _BOUNDARY_REALIGNMENT.match(text, second[0], second[1])
+            if m:
+                sentences.append(text[first[0]:second[0] + len(m.group(0).rstrip())])
+                second[0] = m.end()
+                continue
+        if first[1] > first[0]:
+            sentences.append(text[first[0]:first[1]])
+    return sentences
+
+# --- Word tokenization (NLTK's Treebank-style word tokenizer rules) ---
+
+_STARTING_QUOTES = [
+    (re.compile(r"([«“‘„]|[`]+)", re.U), r" \1 "),
+    (re.compile(r"^\""), r"``"),
+    (re.compile(r"(``)"), r" \1 "),
+    (re.compile(r"([ \(\[{<])(\"|\'{2})"), r"\1 `` "),
+    (re.compile(r"(?i)(\')(?!re|ve|ll|m|t|s|d|n)(\w)\b", re.U), r"\1 \2"),
+]
+_FINAL_PERIOD = [
+    (re.compile(r'([^\.])(\.)([\]\)}>"\'' "»”’ " r"]*)\s*$", re.U), r"\1 \2 \3 "),
+    (re.compile(r'([^\.])(\.)([\]\)}>"\']*)\s*$'), r"\1 \2\3 "),
+]
+_PUNCTUATION = [
+    (re.compile(r"([:,])([^\d])"), r" \1 \2"),
+    (re.compile(r"([:,])$"), r" \1 "),
+    (re.compile(r"\.{2,}", re.U), r" \g<0> "),
+    (re.compile(r"[;@#$%&]"), r" \g<0> "),
+    (re.compile(r"[?!]"), r" \g<0> "),
+    (re.compile(r"([^'])' "), r"\1 ' "),
+    (re.compile(r"[*]", re.U), r" \g<0> "),
+]
+_PARENS_BRACKETS = (re.compile(r"[\]\[\(\)\{\}\<\>]"), r" \g<0> ")
+_DOUBLE_DASHES = (re.compile(r"--"), r" -- ")
+_ENDING_QUOTES = [
+    (re.compile(r"([»”’])", re.U), r" \1 "),
+    (re.compile(r"''"), " '' "),
+    (re.compile(r'"'), " '' "),
+    (re.compile(r"([^' ])('[sS]|'[mM]|'[dD]|') "), r"\1 \2 "),
+    (re.compile(r"([^' ])('ll|'LL|'re|'RE|'ve|'VE|n't|N'T) "), r"\1 \2 "),
+]
+_CONTRACTIONS = [re.compile(pattern) for pattern in (
+    r"(?i)\b(can)(?#X)(not)\b",
+    r"(?i)\b(d)(?#X)('ye)\b",
+    r"(?i)\b(gim)(?#X)(me)\b",
+    r"(?i)\b(gon)(?#X)(na)\b",
+    r"(?i)\b(got)(?#X)(ta)\b",
+    r"(?i)\b(lem)(?#X)(me)\b",
+    r"(?i)\b(more)(?#X)('n)\b",
+    r"(?i)\b(wan)(?#X)(na)(?=\s)",
+    r"(?i) ('t)(?#X)(is)\b",
+    r"(?i) ('t)(?#X)(was)\b",
+)]
+_CONTRACTION_WORDS = frozenset(['cannot', 'gimme', 'gonna', 'gotta', 'lemme', 'wanna'])
+
+_TOKEN = re.compile(r"\S+")
+_SPACED_QUOTE = re.compile(r" (?:\"|'')")
+
+@lru_cache(maxsize=1 << 16)
+def _clean_token(token, left, right, sentence_final):
+    """Split one whitespace token with the Treebank rules and keep alphanumeric non-stopwords.
+
+    Apart from the final-period rule, every Treebank rule only looks at a token and
+    the single characters around it, so tokenizing a token between its real
+    neighbours ('' at a sentence edge) gives the same words as tokenizing the
+    whole sentence.
+    """
+    text = left + token + right
+    for regexp, substitution in _STARTING_QUOTES:
+        text = regexp.sub(substitution, text)
+    if sentence_final:
+        for regexp, substitution in _FINAL_PERIOD:
+            text = regexp.sub(substitution, text)
+    for regexp, substitution in _PUNCTUATION:
+        text = regexp.sub(substitution, text)
+    regexp, substitution = _PARENS_BRACKETS
+    text = regexp.sub(substitution, text)
+    regexp, substitution = _DOUBLE_DASHES
+    text = regexp.sub(substitution, text)
+    # The sentence is padded with spaces before the remaining rules
+    text = ('' if left else ' ') + text + ('' if right else ' ')
+    for regexp, substitution in _ENDING_QUOTES:
+        text = regexp.sub(substitution, text)
+    for regexp in _CONTRACTIONS:
+        text = regexp.sub(r" \1 \2 ", text)
+    return tuple(word for word in text.split() if word.isalnum() and word not in STOPWORDS)
+
+def _clean_sentence(sentence):
+    """Return the alphanumeric non-stopword Treebank tokens of one sentence."""
+    final = _FINAL_PERIOD[0][0].search(sentence)
+    if final and _SPACED_QUOTE.search(final.group(3)):
+        final = None  # The starting-quote rules turn these into `` before the period rule runs
+    final_at = final.start(2) if final else -1  # Position of the sentence-final period
+    cleaned_words = []
+    for match in _TOKEN.finditer(sentence):
+        token = match.group()
+        if token.isalnum() and token not in _CONTRACTION_WORDS:
+            # Fast path: plain words pass through the Treebank rules unchanged
+            if token not in STOPWORDS:
+                cleaned_words.append(token)
+        else:
+            start, end = match.span()
+            left = sentence[start - 1] if start else ''
+            right = sentence[end] if end < len(sentence) else ''
+            cleaned_words.extend(_clean_token(token, left, right, start <= final_at < end))
+    return cleaned_words
+
+@metrics.timed('clean_text_seconds')
+def clean_text(text):
+    """
+    Remove stopwords from text and return cleaned text.
+
+    Tokenizes with the bundled sentence splitter and Treebank rules, so the output
+    is the same on every host whether or not NLTK is installed.
+    """
+    cleaned_words = []
+    for sentence in split_sentences(text.lower()):  # Lowercase entire text
+        cleaned_words.extend(_clean_sentence(sentence))
+    return " ".join(cleaned_words)
+
+def parity_mismatches(texts):
+    """
+    Compare the bundled cleaner against the original NLTK pipeline.
+
+    Requires NLTK with the 'punkt' and 'stopwords' data installed; it is imported
+    here only, never when cleaning.
+
+    Args:
+        texts (iterable): Raw texts to compare.
+
+    Returns:
+        list: (text, nltk_output, bundled_output) for every text that differs.
+    """
+    from nltk.corpus import stopwords
+    from nltk.tokenize import word_tokenize
+
+    nltk_stopwords = set(stopwords.words('english'))
+    mismatches = []
+    for text in texts:
+        words = word_tokenize(text.lower())
+        expected = " ".join(word for word in words if word.isalnum() and word not in nltk_stopwords)
+        actual = clean_text(text)
+        if expected != actual:
+            mismatches.append((text, expected, actual))
+    return mismatches
+
+if __name__ == "__main__":
+    # Parity check over the bodies of one or more news JSON files:
+    #   python text_cleaning.py news_1.json news_2.json
+    from json_stream import iter_json_array
+
+    bodies = [obj['body'].lower() for path in sys.argv[1:] for obj in iter_json_array(path) if 'body' in obj]
+    mismatches = parity_mismatches(bodies)
+    for text, expected, actual in mismatches[:10]:
+        print(f"Mismatch:\n  text:   {text[:200]!r}\n  nltk:   {expected[:200]!r}\n  ours:   {actual[:200]!r}")
+    print(f"{len(bodies) - len(mismatches)}/{len(bodies)} bodies identical to NLTK")
+    sys.exit(1 if mismatches else 0)
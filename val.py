@@ -1,10 +1,59 @@
+import numpy as np
 import pandas as pd
 from rapidfuzz import process, fuzz
+import metrics
+from match_cache import fingerprint, scorer_key
 
-def map_vita_to_mandates(df_vita, df_mandates, raw_column, id_column, name_column, threshold=80):
+CHUNK_SIZE = 1000  # VITA rows scored per cdist call; the score matrix is CHUNK_SIZE x mandates
+
+def top_k_matches(queries, choices, scorer=fuzz.partial_ratio, top_k=1, threshold=0, chunk_size=CHUNK_SIZE, workers=-1):
+    """
+    Find the top-k best scoring choices for every query with chunked, multithreaded cdist.
+
+    Only one chunk_size x len(choices) score matrix is alive at a time, so memory
+    stays bounded however many queries there are. Ties are broken by choice
+    position, earlier first, matching process.extractOne.
+
+    Args:
+        queries (list): Strings to match.
+        choices (list): Candidate strings, preprocessed once by the caller.
+        scorer (function): rapidfuzz scorer (default: fuzz.partial_ratio).
+        top_k (int): Matches kept per query (default: 1).
+        threshold (float): Minimum score for a match (default: 0).
+        chunk_size (int): Queries scored per cdist call (default: 1000).
+        workers (int): Threads used by cdist; -1 uses all cores (default: -1).
+
+    Returns:
+        tuple: (indices, scores) arrays of shape (len(queries), top_k); indices are
+            positions in choices, -1 where there are fewer than top_k matches.
+    """
+    top_k = min(top_k, len(choices))
+    indices = np.full((len(queries), top_k), -1, dtype=np.int64)
+    scores = np.zeros((len(queries), top_k), dtype=np.float64)
+    if top_k == 0:
+        return indices, scores
+
+    for start in range(0, len(queries), chunk_size):
+        chunk = queries[start:start + chunk_size]
+        matrix = process.cdist(chunk, choices, scorer=scorer, dtype=np.float64, workers=workers)
+        if top_k == 1:
+            best = np.argmax(matrix, axis=1)[:, None]  # First maximum per row
+        else:
+            best = np.argsort(-matrix, axis=1, kind='stable')[:, :top_k]  # Stable keeps ties in position order
+        best_scores = np.take_along_axis(matrix, best, axis=1)
+
+        keep = best_scores >= threshold
+        indices[start:start + len(chunk)] = np.where(keep, best, -1)
+        scores[start:start + len(chunk)] = np.where(keep, best_scores, 0)
+    return indices, scores
+
+def map_vita_to_mandates(df_vita, df_mandates, raw_column, id_column, name_column, threshold=80, top_k=1, workers=-1, cache=None):
     """
     Maps raw_mandate_name from the VITA dataset to src_sys_vldtn_id and vldtn_item_nm in mandates.
 
+    The "id - name" candidate strings are built once, and all VITA rows are scored
+    in chunked, multithreaded cdist calls (see top_k_matches).
+
     Args:
         df_vita (pd.DataFrame): VITA dataset with raw mandate names.
         df_mandates (pd.DataFrame): Mandate dataset with IDs and mandate names.
@@ -12,48 +61,72 @@ def map_vita_to_mandates(df_vita, df_mandates, raw_column, id_column, name_colum
         id_column (str): Column name in mandates dataset for mandate IDs.
         name_column (str): Column name in mandates dataset for mandate names.
         threshold (int): Minimum similarity score for matching (default: 80).
+        top_k (int): Matches returned per VITA row; above 1 a match_rank column is added (default: 1).
+        workers (int): Threads used for scoring; -1 uses all cores (default: -1).
+        cache (MatchCache): Reuse matches of raw names seen in earlier runs against the
+            same mandates and settings, and store the new ones (default: None).
 
     Returns:
         pd.DataFrame: A DataFrame with matched raw_mandate_name, src_sys_vldtn_id, and vldtn_item_nm.
     """
-    matches = []
+    # Combine mandate ID and name for matching, once for all VITA rows
+    mandate_ids = df_mandates[id_column].tolist()
+    mandate_names = df_mandates[name_column].tolist()
+    mandate_candidates = [f"{mandate_id} - {name}" for mandate_id, name in zip(mandate_ids, mandate_names)]
 
-    for idx, row in df_vita.iterrows():
-        raw_mandate = row[raw_column]
-        
-        # Combine mandate ID and name for matching
-        mandate_candidates = df_mandates.apply(
-            lambda x: f"{x[id_column]} - {x[name_column]}", axis=1
+    raw_mandates = [raw for raw in df_vita[raw_column].tolist() if isinstance(raw, str)]
+    ranked = {}  # raw name -> [[mandate position, score], ...], best first
+    if cache is not None:
+        cache_args = (
+            'vita_mandates',
+            fingerprint(mandate_candidates),
+            scorer_key(fuzz.partial_ratio, threshold=threshold, top_k=top_k),
         )
-        
-        # Find the best match
-        best_match = process.extractOne(
-            raw_mandate, mandate_candidates, scorer=fuzz.partial_ratio
-        )
-        
-        if best_match and best_match[1] >= threshold:
-            matched_index = mandate_candidates[mandate_candidates == best_match[0]].index[0]
-            matches.append({
+        ranked = cache.get_many(*cache_args, raw_mandates)
+
+    to_score = list(dict.fromkeys(raw for raw in raw_mandates if raw not in ranked))
+    indices, scores = top_k_matches(
+        to_score, mandate_candidates, scorer=fuzz.partial_ratio,
+        top_k=top_k, threshold=threshold, workers=workers,
+    )
+    scored = {
+        raw: [[int(index), float(score)] for index, score in zip(row_indices, row_scores) if index >= 0]
+        for raw, row_indices, row_scores in zip(to_score, indices, scores)
+    }
+    if cache is not None:
+        cache.put_many(*cache_args, scored)
+    ranked.update(scored)
+
+    matches = []
+    for raw_mandate in raw_mandates:
+        for rank, (matched_index, score) in enumerate(ranked[raw_mandate], start=1):
+            match = {
                 "raw_mandate_name": raw_mandate,
-                "src_sys_vldtn_id": df_mandates.loc[matched_index, id_column],
-                "vldtn_item_nm": df_mandates.loc[matched_index, name_column],
-                "similarity_score": best_match[1]
-            })
+                "src_sys_vldtn_id": mandate_ids[matched_index],
+                "vldtn_item_nm": mandate_names[matched_index],
+                "similarity_score": score
+            }
+            if top_k > 1:
+                match["match_rank"] = rank
+            matches.append(match)
 
+    metrics.inc('records_in', len(raw_mandates), stage='vita_mapping')
+    metrics.inc('matches', len(matches), stage='vita_mapping')
     return pd.DataFrame(matches)
 
-# Example usage
-# df_vita = pd.read_csv('./data/vita.csv')  # Load VITA dataset
-# df_mandates = pd.read_csv('./data/mandates.csv')  # Load Mandate dataset
-
-result = map_vita_to_mandates(
-    df_vita, df_mandates,
-    raw_column="raw_mandate_name",
-    id_column="src_sys_vldtn_id",
-    name_column="vldtn_item_nm",
-    threshold=85
-)
-
-# Display or save result
-print(result)
-# result.to_csv('./data/mapped_result.csv', index=False)
+if __name__ == "__main__":
+    # Example usage
+    df_vita = pd.read_csv('./data/vita.csv')  # Load VITA dataset
+    df_mandates = pd.read_csv('./data/mandates.csv')  # Load Mandate dataset
+
+    result = map_vita_to_mandates(
+        df_vita, df_mandates,
+        raw_column="raw_mandate_name",
+        id_column="src_sys_vldtn_id",
+        name_column="vldtn_item_nm",
+        threshold=85
+    )
+
+    # Display or save result
+    print(result)
+    # result.to_csv('./data/mapped_result.csv', index=False)